@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+"""Bitboard backend for the ChessBoard.
+Keeps one 64 bit integer per piece (bit r * 8 + c is set if that piece is on (r, c)),
+plus the occupancy of each side, so move generation is done with bitwise operations
+instead of scalar lookups into the numpy board. Sliding pieces look their attacks up in the
+magic bitboard tables generated offline by magic.py.
+
+The numpy board is still kept up to date as a mailbox, so printing, looking up captured
+pieces and anything else that reads board.board keeps working."""
+
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chessboard import (
+    W_CASTLE_LEFT,
+    W_CASTLE_RIGHT,
+    B_CASTLE_LEFT,
+    B_CASTLE_RIGHT,
+    KNIGHT_TARGETS,
+    KING_TARGETS,
+    RAYS as SQUARE_RAYS,
+    PAWN_ATTACKS as SQUARE_PAWN_ATTACKS,
+    WHITE_PIECES,
+    BLACK_PIECES,
+    ALL_PIECES,
+    SIZE,
+    PROMOTION_FLAGS,
+    Move,
+    ChessBoard,
+    encode_move,
+)
+from magic import load_magics
+
+FULL = (1 << 64) - 1
+SQUARES = [divmod(sq, SIZE) for sq in range(SIZE * SIZE)]  # square index -> (r, c)
+PIECE_COLOR = {p: "white" for p in WHITE_PIECES}
+PIECE_COLOR.update({p: "black" for p in BLACK_PIECES})
+
+
+def _bit(r: int, c: int) -> int:
+    """Bitboard with only (r, c) set"""
+    return 1 << (r * SIZE + c)
+
+
+def _to_bitboards(table: Sequence[Sequence[Sequence[Tuple[int, int]]]]) -> List[int]:
+    """Converts a chessboard [r][c] -> [(r, c), ...] lookup table into square index -> bitboard"""
+    bitboards = []
+    for r, c in SQUARES:
+        bb = 0
+        for r2, c2 in table[r][c]:
+            bb |= _bit(r2, c2)
+        bitboards.append(bb)
+    return bitboards
+
+
+KNIGHT_ATTACKS = _to_bitboards(KNIGHT_TARGETS)
+KING_ATTACKS = _to_bitboards(KING_TARGETS)
+PAWN_ATTACKS = {player: _to_bitboards(table) for player, table in SQUARE_PAWN_ATTACKS.items()}
+RAYS = {step: _to_bitboards(table) for step, table in SQUARE_RAYS.items()}
+MAGICS = load_magics()
+ROOK_MASKS, ROOK_MAGICS, ROOK_SHIFTS, ROOK_OFFSETS, ROOK_TABLE = (
+    MAGICS["rook_" + name] for name in ("masks", "magics", "shifts", "offsets", "attacks"))
+BISHOP_MASKS, BISHOP_MAGICS, BISHOP_SHIFTS, BISHOP_OFFSETS, BISHOP_TABLE = (
+    MAGICS["bishop_" + name] for name in ("masks", "magics", "shifts", "offsets", "attacks"))
+
+
+def rook_attacks(sq: int, occupied: int) -> int:
+    """Bitboard of all squares a rook on sq attacks, up to and including the first blockers"""
+    return ROOK_TABLE[ROOK_OFFSETS[sq] + ((((occupied & ROOK_MASKS[sq]) * ROOK_MAGICS[sq]) & FULL) >> ROOK_SHIFTS[sq])]
+
+
+def bishop_attacks(sq: int, occupied: int) -> int:
+    """Bitboard of all squares a bishop on sq attacks, up to and including the first blockers"""
+    return BISHOP_TABLE[
+        BISHOP_OFFSETS[sq] + ((((occupied & BISHOP_MASKS[sq]) * BISHOP_MAGICS[sq]) & FULL) >> BISHOP_SHIFTS[sq])]
+
+
+# rays heading towards higher square indices find their first blocker with the lowest set bit
+POSITIVE_STEPS = {step for step in RAYS if step[0] * SIZE + step[1] > 0}
+
+
+def sliding_attacks(sq: int, occupied: int, steps: Sequence[Tuple[int, int]]) -> int:
+    """Bitboard of all squares a sliding piece on sq attacks, up to and including the first blocker
+    along each step direction. Ray by ray version of rook_attacks / bishop_attacks, kept as a reference"""
+    attacks = 0
+    for step in steps:
+        ray = RAYS[step][sq]
+        blockers = ray & occupied
+        if blockers:
+            if step in POSITIVE_STEPS:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[step][first]  # cut off everything behind the blocker
+        attacks |= ray
+    return attacks
+
+
+class BitboardChessBoard(ChessBoard):
+    """ChessBoard backed by twelve piece bitboards plus the occupancy of each side, one bit per square."""
+
+    def __init__(self, debug: bool = False, promotions: str = "qn"):
+        self.bitboards: Dict[str, int] = {p: 0 for p in ALL_PIECES}
+        self.occupied: Dict[str, int] = {"white": 0, "black": 0}
+        super().__init__(debug, promotions)
+
+    @property
+    def board(self) -> np.array:
+        return self._board
+
+    @board.setter
+    def board(self, board: np.array) -> None:
+        """Assigning a whole new numpy board reloads the bitboards from it"""
+        self._board = board
+        self._sync_board_to_piece_set()
+
+    def has_piece(self, piece: str) -> bool:
+        """Checks if there's at least one of this piece anywhere on the board"""
+        return self.bitboards[piece] != 0
+
+    def _scan_bitboards(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Builds (bitboards, occupied) from scratch out of the piece set"""
+        bitboards = {p: 0 for p in ALL_PIECES}
+        occupied = {"white": 0, "black": 0}
+        for p, r, c in self.piece_set:
+            bitboards[p] |= _bit(r, c)
+            occupied[PIECE_COLOR[p]] |= _bit(r, c)
+        return bitboards, occupied
+
+    def _sync_board_to_piece_set(self) -> None:
+        """Sets the piece list and bitboards from the ground truth of the board"""
+        super()._sync_board_to_piece_set()
+        self.bitboards, self.occupied = self._scan_bitboards()
+
+    def _add_piece(self, piece: str, r: int, c: int) -> None:
+        """Places a piece on an empty square, keeping the piece set and bitboards in sync"""
+        super()._add_piece(piece, r, c)
+        bit = 1 << (r * SIZE + c)
+        self.bitboards[piece] |= bit
+        self.occupied[PIECE_COLOR[piece]] |= bit
+
+    def _remove_piece(self, r: int, c: int) -> str:
+        """Lifts the piece off a square, keeping the piece set and bitboards in sync. Returns the piece"""
+        piece = super()._remove_piece(r, c)
+        bit = 1 << (r * SIZE + c)
+        self.bitboards[piece] ^= bit
+        self.occupied[PIECE_COLOR[piece]] ^= bit
+        return piece
+
+    def _verify_incremental_state(self) -> None:
+        """Debug mode: also cross-checks the bitboards against the board"""
+        super()._verify_incremental_state()
+        if (self.bitboards, self.occupied) != self._scan_bitboards():
+            raise RuntimeError("bitboards out of sync with board")
+
+    def _piece_targets(self, piece: str, sq: int) -> int:
+        """Bitboard of all the destinations for a piece on sq, ignoring special moves"""
+        player = PIECE_COLOR[piece]
+        own = self.occupied[player]
+        enemy = self.occupied["black" if player == "white" else "white"]
+        occupied = own | enemy
+
+        piece_type = piece.lower()
+        if piece_type == "p":
+            bit = 1 << sq
+            if player == "white":
+                pushes = (bit >> SIZE) & ~occupied
+                if pushes and sq // SIZE == 6:  # double jump if not blocked and on home row
+                    pushes |= (pushes >> SIZE) & ~occupied
+            else:
+                pushes = ((bit << SIZE) & FULL) & ~occupied
+                if pushes and sq // SIZE == 1:
+                    pushes |= (pushes << SIZE) & ~occupied
+            return pushes | (PAWN_ATTACKS[player][sq] & enemy)
+        elif piece_type == "r":
+            targets = rook_attacks(sq, occupied)
+        elif piece_type == "n":
+            targets = KNIGHT_ATTACKS[sq]
+        elif piece_type == "b":
+            targets = bishop_attacks(sq, occupied)
+        elif piece_type == "q":
+            targets = rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+        elif piece_type == "k":
+            targets = KING_ATTACKS[sq]
+        else:
+            raise ValueError("Unknown piece! {}".format(piece))
+        return targets & ~own
+
+    def get_dests_for_piece(self, r: int, c: int, piece=None) -> Sequence[Tuple[int, int]]:
+        """Given a particular piece, generates all possible destinations for it to move to.
+        piece: optional param to override piece at board location
+        Returns [(r,c),...]. """
+        if piece is None:
+            piece = self._board[r, c]
+        if piece not in PIECE_COLOR:
+            raise ValueError("Unknown piece! {}".format(piece))
+
+        dests = []
+        targets = self._piece_targets(piece, r * SIZE + c)
+        while targets:
+            low = targets & -targets
+            dests.append(SQUARES[low.bit_length() - 1])
+            targets ^= low
+        return dests
+
+    def is_attacked(self, r: int, c: int, by_player: str) -> bool:
+        """Checks if any of by_player's pieces attack (r, c), by casting each attack pattern
+        out from the square and masking it with the attacker's bitboards"""
+        sq = r * SIZE + c
+        bitboards = self.bitboards
+        if by_player == "white":
+            pawn, knight, bishop, rook, queen, king, defender = "P", "N", "B", "R", "Q", "K", "black"
+        else:
+            pawn, knight, bishop, rook, queen, king, defender = "p", "n", "b", "r", "q", "k", "white"
+
+        if KNIGHT_ATTACKS[sq] & bitboards[knight] or KING_ATTACKS[sq] & bitboards[king] \
+                or PAWN_ATTACKS[defender][sq] & bitboards[pawn]:
+            return True
+        occupied = self.occupied["white"] | self.occupied["black"]
+        if rook_attacks(sq, occupied) & (bitboards[rook] | bitboards[queen]):
+            return True
+        return bool(bishop_attacks(sq, occupied) & (bitboards[bishop] | bitboards[queen]))
+
+    def king_square(self, turn=None) -> Optional[Tuple[int, int]]:
+        """(r, c) of the player's king, or None if it's not on the board"""
+        if turn is None:
+            turn = self.turn
+        king = self.bitboards["K" if turn == "white" else "k"]
+        if not king:
+            return None
+        return SQUARES[(king & -king).bit_length() - 1]
+
+    def mobility(self, turn=None) -> int:
+        """Counts the destinations of all the player's pieces with popcounts"""
+        if turn is None:
+            turn = self.turn
+        count = 0
+        for piece in (WHITE_PIECES if turn == "white" else BLACK_PIECES):
+            bb = self.bitboards[piece]
+            while bb:
+                low = bb & -bb
+                bb ^= low
+                count += bin(self._piece_targets(piece, low.bit_length() - 1)).count("1")
+        return count
+
+    def _get_castle_moves(self, player: str) -> Sequence[Move]:
+        """Returns any castle moves available to the current player.
+        Same rules as ChessBoard._get_castle_moves, checked with bitboard masks."""
+        moves = []
+        occupied = self.occupied["white"] | self.occupied["black"]
+        if player == "white":
+            king, rook, row, left, right = "K", "R", 7, W_CASTLE_LEFT, W_CASTLE_RIGHT
+            left_flag, right_flag = self.w_castle_left_flag, self.w_castle_right_flag
+        else:
+            king, rook, row, left, right = "k", "r", 0, B_CASTLE_LEFT, B_CASTLE_RIGHT
+            left_flag, right_flag = self.b_castle_left_flag, self.b_castle_right_flag
+
+        if not self.bitboards[king] & _bit(row, 4):
+            return moves
+        if left_flag and self.bitboards[rook] & _bit(row, 0) \
+                and not occupied & (_bit(row, 1) | _bit(row, 2) | _bit(row, 3)):
+            moves.append(Move(row, 4, row, 2, king, special=left))
+        if right_flag and self.bitboards[rook] & _bit(row, 7) \
+                and not occupied & (_bit(row, 5) | _bit(row, 6)):
+            moves.append(Move(row, 4, row, 6, king, special=right))
+        return moves
+
+    def pseudo_legal_moves(self, turn=None) -> Sequence[Move]:
+        """returns a list of all possible moves given the current board state and turn,
+        without checking whether they leave our own king in check.
+        turn: "white" or "black" or None, to use the current turn
+        Returns a list of Move Objects."""
+        if turn is None:
+            turn = self.turn
+        if turn == "white":
+            pieces, promote_row = WHITE_PIECES, 0
+        else:
+            pieces, promote_row = BLACK_PIECES, 7
+
+        all_moves = []
+        board = self._board
+        for piece in pieces:
+            bb = self.bitboards[piece]
+            while bb:
+                low = bb & -bb
+                bb ^= low
+                sq = low.bit_length() - 1
+                r_from, c_from = SQUARES[sq]
+                targets = self._piece_targets(piece, sq)
+                while targets:
+                    low = targets & -targets
+                    targets ^= low
+                    r_to, c_to = SQUARES[low.bit_length() - 1]
+                    captured = board[r_to, c_to]
+
+                    # handle pawn promotions
+                    if r_to == promote_row and (piece == "P" or piece == "p"):
+                        for special in self.promotions:
+                            promoted = special.upper() if piece == "P" else special
+                            all_moves.append(Move(r_from, c_from, r_to, c_to, promoted, captured, special))
+                    else:
+                        all_moves.append(Move(r_from, c_from, r_to, c_to, piece, captured))
+
+        # add special moves
+        all_moves.extend(self._get_castle_moves(turn))
+        all_moves.extend(self._get_en_passant_moves(turn))
+
+        return all_moves
+
+    def generate_packed(self, buffer: array, turn=None) -> int:
+        """Same moves as pseudo_legal_moves(), packed straight from the target bitboards into a buffer
+        (see MoveBuffers). They can leave the king in check. Returns the number of moves written."""
+        if turn is None:
+            turn = self.turn
+        if turn == "white":
+            pieces, promote_row = WHITE_PIECES, 0
+        else:
+            pieces, promote_row = BLACK_PIECES, 7
+        promotions = [PROMOTION_FLAGS[p] << 12 for p in self.promotions]
+
+        n = 0
+        for piece in pieces:
+            promotes = piece == "P" or piece == "p"
+            bb = self.bitboards[piece]
+            while bb:
+                low = bb & -bb
+                bb ^= low
+                sq_from = low.bit_length() - 1
+                targets = self._piece_targets(piece, sq_from)
+                while targets:
+                    low = targets & -targets
+                    targets ^= low
+                    sq_to = low.bit_length() - 1
+                    code = sq_from | sq_to << 6
+                    if promotes and sq_to // SIZE == promote_row:
+                        for promotion in promotions:
+                            buffer[n] = code | promotion
+                            n += 1
+                    else:
+                        buffer[n] = code
+                        n += 1
+
+        for move in self._get_castle_moves(turn) + self._get_en_passant_moves(turn):
+            buffer[n] = encode_move(move)
+            n += 1
+        return n
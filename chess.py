@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 
+import time
 from typing import Dict, List, Tuple, Sequence, Set, Callable, TypeVar, Optional
 from copy import deepcopy
 from termcolor import colored
 
 import numpy as np
 
-from search import minmax, iterative_deepening
+from search import minmax, iterative_deepening, TRANSPOSITION_TABLE, MOVE_ORDERING, SEARCH_STATS
+from parallel_search import lazy_smp, root_split
+from time_manager import TimeManager
 from chessboard import (
     EN_PASSANT_SPOT,
     W_CASTLE_LEFT, 
@@ -18,6 +21,10 @@ from chessboard import (
     SIZE, 
     ALL_PIECES,
 )
+from bitboard import BitboardChessBoard
+from piece_tables import PIECE_VALUES, PIECE_SQUARE_TABLES
+from mailbox_board import MailboxChessBoard, CODES
+from hash_cache import HashCache
 
 
 ##################
@@ -25,197 +32,192 @@ from chessboard import (
 
 WIN_SCORE = 1000
 _PIECE_TABLE = None  # cache
-PIECE_VALUES = {
-    "K": 20000,
-    "k": -20000,
-    "Q": 900,
-    "q": -900,
-    "R": 500,
-    "r": -500,
-    "B": 330,
-    "b": -330,
-    "N": 320,
-    "n": -320,
-    "P": 100,
-    "p": -100,
-    ".": 0,
-}
+
+EVAL_CACHE = HashCache(size_mb=4, value_type="i")
+# Maps board.hash -> score, checked by the eval's params (see _eval_config and eval_chess_board).
+# Replace it with a HashCache(size_mb=..., value_type="i") to change the memory budget.
 
 
 def _get_piece_tables() -> Dict:
-    """Returns piece tables for the eval function.
+    """Returns piece tables for the eval function, as numpy arrays.
     source: https://www.chessprogramming.org/Simplified_Evaluation_Function"""
     global _PIECE_TABLE
-    if _PIECE_TABLE is not None:
-        return _PIECE_TABLE
-
-    piece_table = {}
-    piece_table["P"] = np.array(
-        (
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (50, 50, 50, 50, 50, 50, 50, 50),
-            (10, 10, 20, 30, 30, 20, 10, 10),
-            (5, 5, 10, 25, 25, 10, 5, 5),
-            (0, 0, 0, 20, 20, 0, 0, 0),
-            (5, -5, -10, 0, 0, -10, -5, 5),
-            (5, 10, 10, -20, -20, 10, 10, 5),
-            (0, 0, 0, 0, 0, 0, 0, 0),
-        )
-    )
-    piece_table["N"] = np.array(
-        (
-            (-50, -40, -30, -30, -30, -30, -40, -50),
-            (-40, -20, 0, 0, 0, 0, -20, -40),
-            (-30, 0, 10, 15, 15, 10, 0, -30),
-            (-30, 5, 15, 20, 20, 15, 5, -30),
-            (-30, 0, 15, 20, 20, 15, 0, -30),
-            (-30, 5, 10, 15, 15, 10, 5, -30),
-            (-40, -20, 0, 5, 5, 0, -20, -40),
-            (-50, -40, -30, -30, -30, -30, -40, -50),
-        )
-    )
-    piece_table["B"] = np.array(
-        (
-            (-20, -10, -10, -10, -10, -10, -10, -20),
-            (-10, 0, 0, 0, 0, 0, 0, -10),
-            (-10, 0, 5, 10, 10, 5, 0, -10),
-            (-10, 5, 5, 10, 10, 5, 5, -10),
-            (-10, 0, 10, 10, 10, 10, 0, -10),
-            (-10, 10, 10, 10, 10, 10, 10, -10),
-            (-10, 5, 0, 0, 0, 0, 5, -10),
-            (-20, -10, -10, -10, -10, -10, -10, -20),
-        )
-    )
-    piece_table["R"] = np.array(
-        (
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (5, 10, 10, 10, 10, 10, 10, 5),
-            (-5, 0, 0, 0, 0, 0, 0, -5),
-            (-5, 0, 0, 0, 0, 0, 0, -5),
-            (-5, 0, 0, 0, 0, 0, 0, -5),
-            (-5, 0, 0, 0, 0, 0, 0, -5),
-            (-5, 0, 0, 0, 0, 0, 0, -5),
-            (0, 0, 0, 5, 5, 0, 0, 0),
-        )
-    )
-    piece_table["Q"] = np.array(
-        (
-            (-20, -10, -10, -5, -5, -10, -10, -20),
-            (-10, 0, 0, 0, 0, 0, 0, -10),
-            (-10, 0, 5, 5, 5, 5, 0, -10),
-            (-5, 0, 5, 5, 5, 5, 0, -5),
-            (0, 0, 5, 5, 5, 5, 0, -5),
-            (-10, 5, 5, 5, 5, 5, 0, -10),
-            (-10, 0, 5, 0, 0, 0, 0, -10),
-            (-20, -10, -10, -5, -5, -10, -10, -20),
-        )
-    )
-    piece_table["K"] = np.array(
-        (
-            (-30, -40, -40, -50, -50, -40, -40, -30),
-            (-30, -40, -40, -50, -50, -40, -40, -30),
-            (-30, -40, -40, -50, -50, -40, -40, -30),
-            (-30, -40, -40, -50, -50, -40, -40, -30),
-            (-20, -30, -30, -40, -40, -30, -30, -20),
-            (-10, -20, -20, -20, -20, -20, -20, -10),
-            (20, 20, 0, 0, 0, 0, 20, 20),
-            (20, 30, 10, 0, 0, 10, 30, 20),
-        )
-    )
-    piece_table["."] = np.array(
-        (
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (0, 0, 0, 0, 0, 0, 0, 0),
-            (0, 0, 0, 0, 0, 0, 0, 0),
-        )
-    )
-
-    # fill in black piece table. Flip and negate values
-    for p in list(piece_table.keys()):  # cast to list to allow iterating over original keys
-        piece_table[p.lower()] = -np.flip(piece_table[p])
-
-    # # add base piece values
-    # # add piece values
-    # for p, v in PIECE_VALUES.items():
-    #     piece_table[p] += v
-
-    _PIECE_TABLE = piece_table
-    return piece_table
-
-
-def eval_game_over(board: ChessBoard) -> Tuple[int, bool]:
+    if _PIECE_TABLE is None:
+        _PIECE_TABLE = {p: np.array(table) for p, table in PIECE_SQUARE_TABLES.items()}
+    return _PIECE_TABLE
+
+
+def eval_game_over(board: ChessBoard, no_moves: bool = False) -> Tuple[int, bool]:
     """Returns (score, game_over).
+    no_moves: the side to move has no legal moves, so the game is over one way or another.
     white win -> positive.
     black win -> negative
     draw -> 0"""
 
     # look for 3 fold repetition tie
-    if len(board.past_moves) >= 10:
-        if board.past_moves[-1] == board.past_moves[-5] == board.past_moves[-9] and \
-            board.past_moves[-2] == board.past_moves[-6] == board.past_moves[-10]:
-            return 0, True
+    if board.repetitions() >= 2:
+        return 0, True
 
     # look for win condition
-    if "k" not in board.board:
+    if not board.has_piece("k"):
         return WIN_SCORE, True
-    if "K" not in board.board:
+    if not board.has_piece("K"):
         return -WIN_SCORE, True
 
     # look for max turn limit
     if len(board.past_moves) > 200:
         return 0, True
 
+    # the search found no legal moves: checkmate if we're in check, otherwise stalemate
+    if no_moves:
+        if board.in_check():
+            return (-WIN_SCORE if board.turn == "white" else WIN_SCORE), True
+        return 0, True
+
     return 0, False
 
 
-def eval_chess_board(board: ChessBoard, params : Dict = {}) -> Tuple[int, bool]:
+def eval_chess_board(board: ChessBoard, params : Dict = {}, alpha=-np.inf, beta=np.inf) -> Tuple[int, bool]:
     """Evaluates a ChessBoard.
     "white" winning -> positive
     "black" winning -> negative.
     return (score, game_over)
     Scores are roughly in "millipawns" pawn / 100.
 
+    alpha, beta: the search's window. The cheap terms (material, piece tables) are added up first,
+    and if they're already more than lazy_margin outside the window the expensive ones are skipped:
+    the search only needs to know the score is out of the window, not by how much.
+
     params dict:
         piece_tables: bool to include piece_tables in the score
         material: bool to include material in the score
         mobility: bool to include mobility in the score
+        full_eval: bool to sum material and piece tables over the whole board instead of
+            reading the board's running totals. Slower, for verifying them.
+        lazy_margin: how far outside the window skips the expensive terms, default 300. None for never
+        eval_cache: bool to look the score up in EVAL_CACHE before working it out. Defaults to mobility:
+            without it the other terms are running totals, quicker to read than the cache
+        no_moves: set by the search when the side to move has no legal moves
 
     Tons of good heuristics here: https://www.chessprogramming.org/Evaluation
     """
 
     # check if game is over
-    end_score, game_over = eval_game_over(board)
+    end_score, game_over = eval_game_over(board, params.get("no_moves", False))
     if game_over:
         return end_score, game_over
 
+    # the rest only depends on the position and the terms switched on, so it may have been worked out before
+    mobility = params.get("mobility", False)
+    eval_cache = params.get("eval_cache", mobility)
+    if eval_cache:
+        config = _eval_config(params)
+        score = EVAL_CACHE.probe(board.hash, config)
+        if score is not None:
+            return score, False
+
     score = 0
 
+    # the board keeps running totals of material and piece table scores as pieces move.
+    # full_eval re-sums them over every piece, to verify the totals
+    full_eval = params.get("full_eval", False)
+
     # get material score
     if params.get("material", True):
-        score += sum(PIECE_VALUES[p] for p, _, _ in board.piece_set)
+        if full_eval:
+            score += sum(PIECE_VALUES[p] for p, _, _ in board.piece_set)
+        else:
+            score += board.material
 
     # piece table score
     if params.get("piece_table", True):
-        piece_table = _get_piece_tables()
-        score += sum(piece_table[p][r, c] for p, r, c in board.piece_set)
+        if full_eval:
+            piece_table = _get_piece_tables()
+            score += sum(piece_table[p][r, c] for p, r, c in board.piece_set)
+        else:
+            score += board.piece_square
+
+    # the rest are expensive, skip them if they're very unlikely to bring the score back into the window
+    lazy_margin = params.get("lazy_margin", 300)
+    if mobility and lazy_margin is not None and (score + lazy_margin <= alpha or score - lazy_margin >= beta):
+        SEARCH_STATS["lazy_evals"] += 1
+        return score, False
 
     # mobility
-    if params.get("mobility", False):
-        moves = len(board.moves(turn="white")) - len(board.moves(turn="black"))
-        score += 10 * moves
+    if mobility:
+        score += 10 * (board.mobility("white") - board.mobility("black"))
 
+    if eval_cache:  # not the lazy scores above, they're only good enough for that window
+        EVAL_CACHE.store(board.hash, config, score)
     return score, False
 
 
+def _eval_config(params: Dict) -> int:
+    """Which terms eval_chess_board adds up with these params, as a number from 1 to 16
+    to tell positions evaluated differently apart in EVAL_CACHE"""
+    return 1 + (params.get("material", True)
+                | params.get("piece_table", True) << 1
+                | params.get("mobility", False) << 2
+                | params.get("full_eval", False) << 3)
+
+
+# Batch evaluation: boards as an (N, 8, 8) stack of the mailbox's signed integer piece codes
+# (see mailbox_board.CODES: white positive, black negative, 0 empty). Shifting a code by
+# CODE_OFFSET gives its row in these stacked tables.
+CODE_OFFSET = 6
+_CODE_VALUES = None  # cache, (13,) material value per code
+_CODE_TABLES = None  # cache, (13, 8, 8) piece table per code
+
+
+def _get_code_tables() -> Tuple[np.array, np.array]:
+    """Returns (values, tables): PIECE_VALUES and _get_piece_tables() stacked by piece code"""
+    global _CODE_VALUES, _CODE_TABLES
+    if _CODE_TABLES is None:
+        piece_tables = _get_piece_tables()
+        pieces = sorted(CODES, key=CODES.get)  # index == code + CODE_OFFSET
+        _CODE_VALUES = np.array([PIECE_VALUES[p] for p in pieces], dtype=np.int64)
+        _CODE_TABLES = np.stack([piece_tables[p] for p in pieces]).astype(np.int64)
+    return _CODE_VALUES, _CODE_TABLES
+
+
+def encode_boards(boards: Sequence[ChessBoard]) -> np.array:
+    """Stacks the boards into an (N, 8, 8) int8 array of piece codes, for eval_batch"""
+    strings = np.stack([board.board for board in boards])
+    codes = np.zeros(strings.shape, dtype=np.int8)
+    for p, code in CODES.items():
+        codes[strings == p] = code
+    return codes
+
+
+def eval_batch(codes: np.array, params: Dict = {}) -> np.array:
+    """Material and piece table scores for a whole stack of boards at once.
+    Agrees exactly with eval_chess_board, for positions that aren't game over and without
+    mobility (which needs move generation).
+    codes: (N, 8, 8) integer piece codes, see encode_boards
+    params dict: material, piece_table as in eval_chess_board
+    returns: (N,) int64 scores"""
+    values, tables = _get_code_tables()
+    index = codes.astype(np.intp) + CODE_OFFSET
+    scores = np.zeros(len(codes), dtype=np.int64)
+    if params.get("material", True):
+        scores += values[index].sum(axis=(1, 2))
+    if params.get("piece_table", True):
+        rows, cols = np.indices((SIZE, SIZE))
+        scores += tables[index, rows, cols].sum(axis=(1, 2))
+    return scores
+
 
 ##################
 # Chess Players
 Player = TypeVar('Player', bound=Callable[[ChessBoard, Optional[Dict]], Move])
+MAX_SEARCH_DEPTH = 64  # deepest iterative deepening goes when the search is limited by time instead
+
+# board representations an engine can search on, selected by params["board"]
+BOARD_BACKENDS = {
+    "array": ChessBoard,
+    "bitboard": BitboardChessBoard,
+    "mailbox": MailboxChessBoard,
+}
 
 def human_player(board: ChessBoard) -> Move:
     """Gets CLI input for the next move"""
@@ -315,43 +317,109 @@ def computer_player(board: ChessBoard, params: Dict = {}) -> Move:
     The param dict gets passed down to minmax and the eval_fn.
     Full list of possible params:
         search:
-            depth: original max_depth passed to minmax
+            depth: original max_depth passed to minmax, or the deepest iterative deepening goes with a time limit.
+                defaults to 4, or no practical limit with a time limit
+            max_t: search by iterative deepening for up to this many seconds
+            clock: search by iterative deepening, budgeting the time from our remaining seconds on the clock
+            increment: seconds added to the clock after each move
+            moves_to_go: moves until the next time control, if there is one
+            max_nodes: search by iterative deepening for exactly this many nodes, for reproducible games
+            workers: search on this many processes (lazy SMP, see parallel_search.py), 1 by default
+            root_split: instead split the root moves of a fixed depth search over the workers (default one per core)
             time_discount: how much to discount each turn
             explore_ratio: fraction of possible moves to explore
             min_branches: overrides explore_ratio in case there are few branches
+            null_move: depth reduction for null move pruning, 0 for off
+            lmr: moves searched at full depth before late move reductions, 0 for off
+            ... see minmax for the rest
+            board: which of BOARD_BACKENDS to search on. defaults to "array"
         eval:
             piece_tables: bool to include piece_tables in the score
             material: bool to include material in the score
             mobility: bool to include mobility in the score
     """
 
+    backend = BOARD_BACKENDS[params.get("board", "array")]
+    if type(board) is not backend:
+        board = backend.from_board(board)
+
+    if params.get("root_split", False):
+        TRANSPOSITION_TABLE.new_search()
+        MOVE_ORDERING.new_search()
+        _, move, _ = root_split(board, eval_chess_board, params.get("depth", 4), params.get("workers"), params)
+        return move
+
+    timed = "clock" in params or "max_t" in params or "max_nodes" in params
+    if timed or params.get("workers", 1) > 1:
+        # without a time control, only as deep as the fixed depth search below
+        depth = params.get("depth", MAX_SEARCH_DEPTH if timed else 4)
+        if "max_nodes" in params:
+            time_manager = TimeManager.from_nodes(params["max_nodes"])
+        elif "clock" in params:
+            time_manager = TimeManager.from_clock(params["clock"], params.get("increment", 0.0),
+                                                  params.get("moves_to_go"))
+        else:
+            time_manager = TimeManager(params.get("max_t", np.inf))
+        if params.get("workers", 1) > 1:
+            _, move, _ = lazy_smp(board, eval_chess_board, depth, params["workers"], params=params,
+                                  time_manager=time_manager)
+        else:
+            _, move, _ = iterative_deepening(board, eval_chess_board, depth, params=params, time_manager=time_manager)
+        return move
+
     depth = params.get("depth", 4)
-    _, move = minmax(board, eval_chess_board, depth)
+    TRANSPOSITION_TABLE.new_search()
+    MOVE_ORDERING.new_search()
+    _, move, _ = minmax(board, eval_chess_board, depth, params=params)
     return move
 
 
-def play_game(white_params={}, black_params={}, human=None, display=True):
+def play_game(white_params={}, black_params={}, human=None, display=True, clock=None, increment=0.0,
+              board: Optional[ChessBoard] = None):
     """Have the computer play itself.
     white_params / black_params: Optional dictionaries passed to those AIs.
-    human: optional str 'white' or 'black' to have a human play one of those sides. """
-    board = ChessBoard()
+    human: optional str 'white' or 'black' to have a human play one of those sides.
+    clock: optional seconds on each side's game clock. Running out loses the game.
+    increment: seconds added to a side's clock after each of its moves.
+    board: position to start from, defaults to the starting position."""
+    if board is None:
+        board = ChessBoard()
 
     params = {"white": white_params, "black": black_params}
+    remaining = {"white": clock, "black": clock}
 
     # show first move if first player is human
     if human == "white":
         print(board)
 
-    over = False
+    score, over = eval_chess_board(board)
     while not over:
+        # the king is never captured, so checkmate and stalemate are only seen by running out of moves
+        if not board.moves():
+            score, over = eval_game_over(board, no_moves=True)
+            if display:
+                print("{} has no moves. Final Score: {}".format(board.turn, score))
+            break
+
         if display:
             print("-----")
             print("Turn: {}".format(board.turn))
 
-        if board.turn == human:
+        turn = board.turn
+        t0 = time.time()
+        if turn == human:
             move = human_player(board)
+        elif clock is None:
+            move = computer_player(board, params[turn])
         else:
-            move = computer_player(board, params[board.turn])
+            move = computer_player(board, dict(params[turn], clock=remaining[turn], increment=increment))
+        if clock is not None:
+            remaining[turn] -= time.time() - t0
+            if remaining[turn] < 0:
+                if display:
+                    print("{} lost on time".format(turn))
+                return (-WIN_SCORE if turn == "white" else WIN_SCORE), board
+            remaining[turn] += increment
         board.do_move(move)
         score, over = eval_chess_board(board)
 
@@ -1,30 +1,176 @@
 #!/usr/bin/env python3
 
+import random
 import time
 import numpy as np
-from search import minmax
+from search import minmax, iterative_deepening, reset_search_state, SEARCH_STATS, DEPTH_STATS, TRANSPOSITION_TABLE
 from chessboard import (
     ChessBoard,
 )
-from chess import eval_chess_board
-
-
-b = ChessBoard()
-b.board = np.array(
-    (
-        "r . . . k . . r".split(),
-        "p . p p q p b .".split(),
-        "b n . . p n p .".split(),
-        ". . . P N . . .".split(),
-        ". p . . P . . .".split(),
-        ". . N . . Q . p".split(),
-        "P P P B B P P P".split(),
-        "R . . . K . . R".split(),
+from chess import eval_chess_board, BOARD_BACKENDS, EVAL_CACHE, encode_boards, eval_batch
+from parallel_search import lazy_smp, root_split, WORKER_STATS
+from perft import PERFT_POSITIONS
+
+KIWIPETE = PERFT_POSITIONS["kiwipete"].fen
+
+
+def time_backend(board_cls=ChessBoard, depth=4, params={}):
+    """Times a minmax search on the perft 2 position using the given board backend.
+    Returns (seconds, nodes)"""
+    b = board_cls()
+    b.board = np.array(
+        (
+            "r . . . k . . r".split(),
+            "p . p p q p b .".split(),
+            "b n . . p n p .".split(),
+            ". . . P N . . .".split(),
+            ". p . . P . . .".split(),
+            ". . N . . Q . p".split(),
+            "P P P B B P P P".split(),
+            "R . . . K . . R".split(),
+        )
     )
-)
-b._sync_board_to_piece_set()
+    b._sync_board_to_piece_set()
+
+    reset_search_state()  # don't let one backend reuse another's work
+    t0 = time.time()
+    _, move, _ = minmax(b, eval_chess_board, depth, params=params)
+    t1 = time.time()
+    return t1 - t0, SEARCH_STATS["nodes"]
+
+
+def time_iterative_deepening(depth=5, fen=KIWIPETE):
+    """Prints the nodes searched at each depth of iterative deepening, with and without
+    principal variation search, aspiration windows and each of the selective search options"""
+    configs = [("alpha-beta", {"pvs": False, "aspiration_window": 0}), ("pvs", {"aspiration_window": 0}),
+               ("pvs+aspiration", {}), ("+null move", {"null_move": 2}), ("+lmr", {"null_move": 2, "lmr": 3}),
+               ("+futility", {"null_move": 2, "lmr": 3, "futility_margins": [200, 500]}),
+               ("+razoring", {"null_move": 2, "lmr": 3, "futility_margins": [200, 500], "razor_margins": [300, 600]})]
+    for name, params in configs:
+        b = BOARD_BACKENDS["mailbox"].from_fen(fen)
+        reset_search_state()
+        t0 = time.time()
+        iterative_deepening(b, eval_chess_board, depth, max_t=np.inf, params=params)
+        print("{:>15}: {:.2f}s nodes per depth {}, researches {}".format(
+            name, time.time() - t0, [d["nodes"] for d in DEPTH_STATS],
+            SEARCH_STATS["pvs_researches"] + sum(d["researches"] for d in DEPTH_STATS)))
+
+
+def time_lazy_eval(depth=4, fen=KIWIPETE):
+    """Prints the time to search with the mobility term, with and without skipping it outside the window"""
+    for name, params in [("full eval", {"mobility": True, "lazy_margin": None}), ("lazy eval", {"mobility": True})]:
+        b = BOARD_BACKENDS["mailbox"].from_fen(fen)
+        reset_search_state()
+        t0 = time.time()
+        iterative_deepening(b, eval_chess_board, depth, max_t=np.inf, params=params)
+        print("{:>15}: {:.2f}s {} nodes, {} lazy exits".format(
+            name, time.time() - t0, SEARCH_STATS["nodes"], SEARCH_STATS["lazy_evals"]))
+
+
+def time_node_budget(max_nodes=20000, fen=KIWIPETE):
+    """Prints the depth each backend reaches on a fixed node budget, and its time per node.
+    The node budget makes the search deterministic, so the depths (and moves) can be compared
+    between versions of the code however loaded the machine is, and only the times vary."""
+    for name, board_cls in BOARD_BACKENDS.items():
+        b = board_cls.from_fen(fen)
+        reset_search_state()
+        t0 = time.time()
+        score, move, _ = iterative_deepening(b, eval_chess_board, 64, params={}, max_nodes=max_nodes)
+        t = time.time() - t0
+        print("{:>10}: {} nodes to depth {} in {:.2f}s, {:.1f} us/node, {} {:.0f}".format(
+            name, SEARCH_STATS["nodes"], DEPTH_STATS[-1]["depth"], t, 1e6 * t / SEARCH_STATS["nodes"], move, score))
+
+
+def time_lazy_smp(depth=5, worker_counts=(1, 2, 4, 8), fen=KIWIPETE):
+    """Prints the time to reach depth with each number of lazy SMP workers, and the speedup over one.
+    Only meaningful with at least as many idle cores as workers."""
+    base = None
+    for workers in worker_counts:
+        b = BOARD_BACKENDS["mailbox"].from_fen(fen)
+        t0 = time.time()
+        lazy_smp(b, eval_chess_board, depth, workers, max_t=np.inf)
+        t = time.time() - t0
+        base = base or t
+        print("{:>2} workers: depth {} in {:.2f}s, speedup {:.2f}x, {} nodes in total".format(
+            workers, depth, t, base / t, sum(w["nodes"] for w in WORKER_STATS)))
+
+
+def time_root_split(depth=4, worker_counts=(1, 2, 4, 8), fen=KIWIPETE):
+    """Prints the time of a fixed depth search with the root moves split over each number of workers,
+    against minmax on its own. The move and score should always be the same."""
+    b = BOARD_BACKENDS["mailbox"].from_fen(fen)
+    for workers in (0,) + tuple(worker_counts):
+        reset_search_state()
+        t0 = time.time()
+        if workers:
+            score, move, _ = root_split(b, eval_chess_board, depth, workers)
+        else:
+            score, move, _ = minmax(b, eval_chess_board, depth)
+        print("{:>10}: {:.2f}s {} nodes, {} {}".format(
+            "{} workers".format(workers) if workers else "minmax", time.time() - t0, SEARCH_STATS["nodes"], move, score))
+
+
+def time_eval_cache(depth=4, fen=KIWIPETE):
+    """Prints the time to search with and without EVAL_CACHE, for a cheap and an expensive eval"""
+    for name, params in [("cheap eval", {}), ("mobility", {"mobility": True, "lazy_margin": None})]:
+        for cache in [False, True]:
+            b = BOARD_BACKENDS["mailbox"].from_fen(fen)
+            reset_search_state()
+            EVAL_CACHE.clear()
+            t0 = time.time()
+            iterative_deepening(b, eval_chess_board, depth, max_t=np.inf, params=dict(params, eval_cache=cache))
+            print("{:>15}: {:.2f}s {} nodes, eval cache hit rate {:.1%}".format(
+                name + (" cached" if cache else ""), time.time() - t0, SEARCH_STATS["nodes"],
+                EVAL_CACHE.stats()["hit_rate"]))
+
+
+def random_positions(n, seed=0):
+    """n positions from random games, for eval benchmarks"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < n:
+        b = ChessBoard()
+        for _ in range(80):
+            moves = b.moves()
+            if not moves or len(positions) == n:
+                break
+            b.do_move(rng.choice(moves))
+            positions.append(ChessBoard.from_board(b))
+    return positions
+
+
+def time_batch_eval(batch_sizes=(1, 10, 100, 1000, 10000)):
+    """Prints positions/sec of eval_batch at each batch size, against eval_chess_board one at a time"""
+    positions = random_positions(1000)
+    t0 = time.time()
+    for b in positions:
+        eval_chess_board(b, {"full_eval": True})
+    print("{:>10}: {:.0f} positions/s".format("scalar", len(positions) / (time.time() - t0)))
+
+    codes = encode_boards(positions)
+    for batch_size in batch_sizes:
+        batch = np.resize(codes, (batch_size, 8, 8))  # repeats the positions to fill the batch
+        repeats = max(1, 10000 // batch_size)
+        t0 = time.time()
+        for _ in range(repeats):
+            eval_batch(batch)
+        t = time.time() - t0
+        print("{:>10}: {:.0f} positions/s".format("batch " + str(batch_size), batch_size * repeats / t))
+
 
-t0 = time.time()
-_, move = minmax(b, eval_chess_board, 4)
-t1 = time.time()
-print(t1 - t0)
\ No newline at end of file
+if __name__ == "__main__":
+    for name, board_cls in BOARD_BACKENDS.items():
+        t, nodes = time_backend(board_cls)
+        print("{:>10}: {:.2f}s {} nodes {:.0f} nodes/s, tt hit rate {:.1%}".format(
+            name, t, nodes, nodes / t, TRANSPOSITION_TABLE.stats()["hit_rate"]))
+    for name, params in [("eval", {"eval_ordering": True}), ("cheap", {})]:
+        t, nodes = time_backend(BOARD_BACKENDS["mailbox"], params=params)
+        print("{:>10} ordering: {:.2f}s {} nodes, first move cutoffs {:.1%}".format(
+            name, t, nodes, SEARCH_STATS["first_move_cutoffs"] / max(SEARCH_STATS["beta_cutoffs"], 1)))
+    time_iterative_deepening()
+    time_lazy_eval()
+    time_eval_cache()
+    time_node_budget()
+    time_lazy_smp()
+    time_root_split()
+    time_batch_eval()
@@ -7,14 +7,17 @@ Does not contain any 'AI' to control the actual selection or evaluation of moves
 
 
 import time
+import random
 from typing import Dict, List, Tuple, Sequence, Set, Callable, TypeVar, Optional
 from copy import deepcopy
 from termcolor import colored
 import functools
+from array import array
 
 import numpy as np
 
 from search import minmax, iterative_deepening
+from piece_tables import PIECE_VALUES, PIECE_SQUARE_TABLES
 
 SIZE = 8
 WHITE_PIECES = ["P", "R", "N", "B", "K", "Q"]
@@ -26,11 +29,108 @@ B_CASTLE_LEFT = "b_castle_left"
 B_CASTLE_RIGHT = "b_castle_right"
 EN_PASSANT_SPOT = "en_passant_spot"
 
+# (from, to) of the rook's hop for each castle
+CASTLE_ROOK_HOPS = {
+    W_CASTLE_LEFT: ((7, 0), (7, 3)),
+    W_CASTLE_RIGHT: ((7, 7), (7, 5)),
+    B_CASTLE_LEFT: ((0, 0), (0, 3)),
+    B_CASTLE_RIGHT: ((0, 7), (0, 5)),
+}
+
+# castle rights packed into a bitmask, one bit per castle
+CASTLE_BITS = {W_CASTLE_LEFT: 1, W_CASTLE_RIGHT: 2, B_CASTLE_LEFT: 4, B_CASTLE_RIGHT: 8}
+ALL_CASTLE_RIGHTS = 15
+# rights kept when a piece moves from or to each square: moving the king or a rook (or capturing
+# a rook on its corner) loses the castles it takes part in for good
+CASTLE_RIGHTS_KEPT = [ALL_CASTLE_RIGHTS] * (8 * 8)
+CASTLE_RIGHTS_KEPT[7 * 8 + 4] ^= CASTLE_BITS[W_CASTLE_LEFT] | CASTLE_BITS[W_CASTLE_RIGHT]
+CASTLE_RIGHTS_KEPT[7 * 8 + 0] ^= CASTLE_BITS[W_CASTLE_LEFT]
+CASTLE_RIGHTS_KEPT[7 * 8 + 7] ^= CASTLE_BITS[W_CASTLE_RIGHT]
+CASTLE_RIGHTS_KEPT[0 * 8 + 4] ^= CASTLE_BITS[B_CASTLE_LEFT] | CASTLE_BITS[B_CASTLE_RIGHT]
+CASTLE_RIGHTS_KEPT[0 * 8 + 0] ^= CASTLE_BITS[B_CASTLE_LEFT]
+CASTLE_RIGHTS_KEPT[0 * 8 + 7] ^= CASTLE_BITS[B_CASTLE_RIGHT]
+
+# Zobrist hashing: a random 64 bit key for every (piece, square), castle flag, en passant spot
+# and for black being the side to move. A position's hash is the XOR of the keys of everything
+# in it, so do_move and undo_move can update it by XORing just the keys that change.
+_zobrist_rng = random.Random(0)  # fixed seed so hashes are the same in every process
+ZOBRIST_PIECES = {p: [[_zobrist_rng.getrandbits(64) for _ in range(SIZE)] for _ in range(SIZE)]
+                  for p in ALL_PIECES}
+ZOBRIST_CASTLE = {flag: _zobrist_rng.getrandbits(64)
+                  for flag in [W_CASTLE_LEFT, W_CASTLE_RIGHT, B_CASTLE_LEFT, B_CASTLE_RIGHT]}
+ZOBRIST_EN_PASSANT = [[_zobrist_rng.getrandbits(64) for _ in range(SIZE)] for _ in range(SIZE)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+# XOR of the castle keys for every castle rights bitmask
+ZOBRIST_CASTLE_RIGHTS = [0] * (ALL_CASTLE_RIGHTS + 1)
+for _rights in range(ALL_CASTLE_RIGHTS + 1):
+    for _flag, _bit in CASTLE_BITS.items():
+        if _rights & _bit:
+            ZOBRIST_CASTLE_RIGHTS[_rights] ^= ZOBRIST_CASTLE[_flag]
+
+# Packed moves: a move fits in 16 bits as from | to << 6 | flag << 12, with squares indexed r * SIZE + c.
+# Cheaper to generate and store than Move objects; the board fills in the piece etc. when decoding.
+MOVE_NORMAL = 0
+MOVE_EN_PASSANT = 1
+MOVE_CASTLE = 2
+PROMOTION_FLAGS = {"n": 4, "b": 5, "r": 6, "q": 7}
+PROMOTION_PIECES = {flag: p for p, flag in PROMOTION_FLAGS.items()}
+MAX_MOVES = 256  # more than any chess position has moves
+MAX_PLY = 128
+STATE_STACK_SIZE = 1024  # initial plies of undo state preallocated per board, doubled if a game runs longer
+SQUARE_COORDS = [divmod(sq, SIZE) for sq in range(SIZE * SIZE)]  # square index -> (r, c)
+MVV_LVA_VICTIM = {".": 0, "p": 10, "n": 20, "b": 30, "r": 40, "q": 50, "k": 60}  # x10 so victims dominate
+MVV_LVA_ATTACKER = {"p": 1, "n": 2, "b": 3, "r": 4, "q": 5, "k": 6}
+# castle special for each (from, to) square of the king
+CASTLE_SPECIALS = {
+    (7 * SIZE + 4, 7 * SIZE + 2): W_CASTLE_LEFT,
+    (7 * SIZE + 4, 7 * SIZE + 6): W_CASTLE_RIGHT,
+    (4, 2): B_CASTLE_LEFT,
+    (4, 6): B_CASTLE_RIGHT,
+}
+
+
 def inbound(r, c):
     """Checks if coords are in the board"""
     return 0 <= r < SIZE and 0 <= c < SIZE
 
 
+# piece delta movements
+KNIGHT_JUMPS = [(1, 2), (1, -2), (2, 1), (2, -1), (-1, 2), (-1, -2), (-2, 1), (-2, -1)]
+KING_JUMPS = [(1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1)]
+ROOK_STEPS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+BISHOP_STEPS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+PAWN_CAPTURE_JUMPS = {"white": [(-1, -1), (-1, 1)], "black": [(1, -1), (1, 1)]}
+
+
+def _jump_table(jumps: Sequence[Tuple[int, int]]) -> List[List[List[Tuple[int, int]]]]:
+    """table[r][c] is the list of in-bound squares one jump away from (r, c)"""
+    return [[[(r + dr, c + dc) for dr, dc in jumps if inbound(r + dr, c + dc)]
+             for c in range(SIZE)] for r in range(SIZE)]
+
+
+def _ray_table(dr: int, dc: int) -> List[List[List[Tuple[int, int]]]]:
+    """table[r][c] is the list of squares sliding from (r, c) along (dr, dc), nearest first"""
+    table = [[[] for c in range(SIZE)] for r in range(SIZE)]
+    for r in range(SIZE):
+        for c in range(SIZE):
+            r2, c2 = r + dr, c + dc
+            while inbound(r2, c2):
+                table[r][c].append((r2, c2))
+                r2, c2 = r2 + dr, c2 + dc
+    return table
+
+
+# Lookup tables built once at import, so move generation doesn't recompute deltas or bounds check.
+# All indexed [r][c] of the piece.
+KNIGHT_TARGETS = _jump_table(KNIGHT_JUMPS)
+KING_TARGETS = _jump_table(KING_JUMPS)
+PAWN_ATTACKS = {player: _jump_table(jumps) for player, jumps in PAWN_CAPTURE_JUMPS.items()}
+RAYS = {step: _ray_table(*step) for step in ROOK_STEPS + BISHOP_STEPS}
+ROOK_RAYS = [[[RAYS[step][r][c] for step in ROOK_STEPS] for c in range(SIZE)] for r in range(SIZE)]
+BISHOP_RAYS = [[[RAYS[step][r][c] for step in BISHOP_STEPS] for c in range(SIZE)] for r in range(SIZE)]
+QUEEN_RAYS = [[ROOK_RAYS[r][c] + BISHOP_RAYS[r][c] for c in range(SIZE)] for r in range(SIZE)]
+
+
 class Move(object):
     """Class to represent a move.
     Special moves: represented by the 'special' char code.
@@ -38,9 +138,10 @@ class Move(object):
         e: en passant
         q,n,b,r: promotion to that piece
     Tracking for special moves:
-        castle_changed: True if this move changed some ability to castle. (important for undo_move)
         castling: use the movement of the king as the to/from fields to distinguish which castle
-        
+    captured is filled in when the board generates the move. do_move never modifies the Move:
+    everything needed to undo it goes on the board's state stack, so Moves can be shared and reused.
+
     TODO: why isn't this hashable?
     """
 
@@ -53,9 +154,8 @@ class Move(object):
         self.r_to = r_to
         self.c_to = c_to
         self.special = special
-        self.old_flags = None  # filled in by do_move, for undoing later
 
-        # optional and are filled in by the board when doing a move
+        # optional, filled in by the board when generating moves
         self.piece = piece
         if captured is None:
             captured = "."
@@ -83,32 +183,247 @@ class Move(object):
         return self.__dict__ == other.__dict__
     
     def __hash__(self) -> int:
-        return hash((self.r_from, self.c_from, self.r_to, self.c_to, self.special, self.old_flags, self.piece, self.captured))
+        return hash((self.r_from, self.c_from, self.r_to, self.c_to, self.special, self.piece, self.captured))
+
+
+def encode_move(move: Move) -> int:
+    """Packs a Move into a 16 bit int"""
+    if move.special is None:
+        flag = MOVE_NORMAL
+    elif move.special == "e":
+        flag = MOVE_EN_PASSANT
+    elif move.special in CASTLE_ROOK_HOPS:
+        flag = MOVE_CASTLE
+    else:
+        flag = PROMOTION_FLAGS[move.special]
+    return (move.r_from * SIZE + move.c_from) | (move.r_to * SIZE + move.c_to) << 6 | flag << 12
+
+
+def decode_move(code: int, board: "ChessBoard") -> Move:
+    """Unpacks a move into a Move, like the one board.moves() would generate for it.
+    The board must be in the position the move was generated in, to fill in the piece."""
+    sq_from, sq_to, flag = code & 63, (code >> 6) & 63, code >> 12
+    r_from, c_from = divmod(sq_from, SIZE)
+    r_to, c_to = divmod(sq_to, SIZE)
+    piece = board._piece_at(r_from, c_from)
+    if flag == MOVE_NORMAL:
+        return Move(r_from, c_from, r_to, c_to, piece, board._piece_at(r_to, c_to))
+    elif flag == MOVE_EN_PASSANT:
+        return Move(r_from, c_from, r_to, c_to, piece, ".", "e")
+    elif flag == MOVE_CASTLE:
+        return Move(r_from, c_from, r_to, c_to, piece, special=CASTLE_SPECIALS[sq_from, sq_to])
+    special = PROMOTION_PIECES[flag]
+    return Move(r_from, c_from, r_to, c_to, special.upper() if piece.isupper() else special,
+                board._piece_at(r_to, c_to), special)
+
+
+class MoveBuffers(object):
+    """Preallocated packed move arrays, one per ply of a search, so generating moves at a
+    node reuses the same memory instead of allocating a new list of Moves.
+        count = board.generate_packed(buffers[ply])
+        for i in range(count): code = buffers[ply][i] ..."""
+
+    def __init__(self, max_ply: int = MAX_PLY, max_moves: int = MAX_MOVES):
+        self.buffers = [array("H", bytes(2 * max_moves)) for _ in range(max_ply)]
+
+    def __getitem__(self, ply: int) -> array:
+        return self.buffers[ply]
+
+    def __len__(self) -> int:
+        return len(self.buffers)
+
+
+def _castle_flag(bit: int) -> property:
+    """Boolean view of one bit of the board's castle_rights, so it reads and writes like a plain flag"""
+    def get(self) -> bool:
+        return bool(self.castle_rights & bit)
+
+    def set(self, allowed: bool) -> None:
+        if allowed:
+            self.castle_rights |= bit
+        else:
+            self.castle_rights &= ~bit
+    return property(get, set)
 
 
 class ChessBoard(object):
     """Class to represent a chessboard.
     Board is represented by a 2D array + a piece set, which must be kept in sync.
     Several extra flags store information for special moves that require info about the past, i.e. castling
+
+    Other backends (see chess.BOARD_BACKENDS) subclass it to store the pieces their own way, but keep
+    this interface, numpy board included, so they can be swapped in under minmax and eval_chess_board.
+
+    The board also carries a Zobrist hash of the position (pieces, turn, castle flags and
+    en passant spot), updated incrementally by do_move and undo_move. See the hash property.
+    Likewise running totals of the pieces' material (PIECE_VALUES) and piece-square table
+    scores, so the eval can read them instead of summing over every piece.
+
+    do_move pushes everything it can't recompute when undoing (castle rights, en passant square,
+    captured and moved piece, hash, eval totals) onto a preallocated stack of arrays indexed by ply, and
+    undo_move pops it back off, so neither allocates.
+
+    debug: cross-check the incrementally updated piece set and hash against the board after every
+        do_move and undo_move. Slow, but catches any bookkeeping bugs right where they happen.
+    promotions: the pieces pawns may promote to. Queen and knight cover nearly every useful
+        promotion and keep the search narrower; use "qnrb" for the full rules (e.g. perft).
     """
     TURNS = ["white", "black"]
 
-    def __init__(self):
-        self.board = np.full(shape=(SIZE, SIZE), fill_value=".", dtype="<U1")
-        self.piece_set: Set[Tuple[str, int, int]] = set()  # caches pieces for speedup. (piece, row, column?)
+    w_castle_left_flag = _castle_flag(CASTLE_BITS[W_CASTLE_LEFT])
+    w_castle_right_flag = _castle_flag(CASTLE_BITS[W_CASTLE_RIGHT])
+    b_castle_left_flag = _castle_flag(CASTLE_BITS[B_CASTLE_LEFT])
+    b_castle_right_flag = _castle_flag(CASTLE_BITS[B_CASTLE_RIGHT])
+
+    def __init__(self, debug: bool = False, promotions: str = "qn"):
+        self.debug = debug
+        self.promotions = promotions
 
         # some special moves require past info of board state
-        self.w_castle_left_flag = True
-        self.w_castle_right_flag = True
-        self.b_castle_left_flag = True
-        self.b_castle_right_flag = True
+        self.castle_rights = ALL_CASTLE_RIGHTS  # CASTLE_BITS still allowed, see the *_castle_*_flag properties
         self.en_passant_spot = None # destination of en passant in the most recent move.
-        
 
-        self.past_moves: Sequence[Tuple[Move, str]] = []
+        self.past_moves: List[Move] = []
         self.turn = "white"
+
+        # undo state stack, one entry per move in past_moves
+        self.ply = 0
+        self._allocate_state_stack(STATE_STACK_SIZE)
+
+        self._hash = 0
+        self.material = 0  # sum of PIECE_VALUES of all pieces, white positive
+        self.piece_square = 0  # sum of PIECE_SQUARE_TABLES of all pieces, white positive
+        self.board = np.full(shape=(SIZE, SIZE), fill_value=".", dtype="<U1")
+        self.piece_set: Set[Tuple[str, int, int]] = set()  # caches pieces for speedup. (piece, row, column?)
         self.set_starting_pieces()
 
+    @classmethod
+    def from_board(cls, other: "ChessBoard") -> "ChessBoard":
+        """Creates a board of this class with the same position and history as other,
+        which can be any board backend. Used to search a game on a different backend."""
+        board = cls(debug=other.debug, promotions=other.promotions)
+        board.castle_rights = other.castle_rights
+        board.en_passant_spot = other.en_passant_spot
+        board.past_moves = list(other.past_moves)
+        board.ply = other.ply
+        for name in ["_castle_stack", "_ep_stack", "_captured_stack", "_moved_stack", "_hash_stack",
+                     "_material_stack", "_piece_square_stack"]:
+            getattr(board, name)[:] = getattr(other, name)
+        board.turn = other.turn
+        board.board = np.array(other.board)
+        board._sync_board_to_piece_set()
+        return board
+
+    @classmethod
+    def from_fen(cls, fen: str, **kwargs) -> "ChessBoard":
+        """Creates a board from a FEN string, e.g. the starting position:
+            "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+        The move counters are optional and ignored. kwargs are passed on to the constructor."""
+        fields = fen.split()
+        placement, turn, castling, en_passant = fields[:4]
+
+        board = cls(**kwargs)
+        rows = []
+        for row in placement.split("/"):
+            squares = []
+            for char in row:
+                squares.extend("." * int(char) if char.isdigit() else char)
+            if len(squares) != SIZE:
+                raise ValueError("Bad FEN row {!r} in {!r}".format(row, fen))
+            rows.append(squares)
+        if len(rows) != SIZE:
+            raise ValueError("Bad FEN piece placement {!r}".format(fen))
+
+        board.turn = {"w": "white", "b": "black"}[turn]
+        board.castle_rights = 0
+        for char, flag in zip("QKqk", [W_CASTLE_LEFT, W_CASTLE_RIGHT, B_CASTLE_LEFT, B_CASTLE_RIGHT]):
+            if char in castling:
+                board.castle_rights |= CASTLE_BITS[flag]
+        board.en_passant_spot = None
+        if en_passant != "-":
+            # FEN gives the square the pawn skipped over, we track the pawn that double jumped
+            r, c = SIZE - int(en_passant[1]), ord(en_passant[0]) - ord("a")
+            board.en_passant_spot = (r - 1, c) if board.turn == "black" else (r + 1, c)
+        board.board = np.array(rows, dtype="<U1")
+        board._sync_board_to_piece_set()
+        return board
+
+    def to_fen(self) -> str:
+        """The position as a FEN string, see from_fen. The halfmove clock isn't tracked, so it's 0"""
+        rows = []
+        for row in self.board:
+            fen_row, empty = "", 0
+            for p in row:
+                if p == ".":
+                    empty += 1
+                    continue
+                fen_row += (str(empty) if empty else "") + p
+                empty = 0
+            rows.append(fen_row + (str(empty) if empty else ""))
+        castling = "".join(char for char, flag in zip("KQkq", [W_CASTLE_RIGHT, W_CASTLE_LEFT, B_CASTLE_RIGHT, B_CASTLE_LEFT])
+                           if self.castle_rights & CASTLE_BITS[flag]) or "-"
+        en_passant = "-"
+        if self.en_passant_spot is not None:
+            r, c = self.en_passant_spot
+            r = r + 1 if self.turn == "black" else r - 1  # the square the pawn skipped over
+            en_passant = "abcdefgh"[c] + str(SIZE - r)
+        return "{} {} {} {} 0 {}".format("/".join(rows), self.turn[0], castling, en_passant,
+                                         len(self.past_moves) // 2 + 1)
+
+    def compact(self) -> Tuple[str, str, bytes]:
+        """A small picklable copy of the board, e.g. to send to another process, for from_compact:
+        (FEN, promotions, the hashes of the game's earlier positions). Much smaller than pickling
+        the board with its history of moves, of which only the hashes matter for repetitions."""
+        return self.to_fen(), self.promotions, self._hash_stack[:self.ply].tobytes()
+
+    @classmethod
+    def from_compact(cls, state: Tuple[str, str, bytes], **kwargs) -> "ChessBoard":
+        """Rebuilds a board made by compact(). It can't undo the moves before it, and past_moves only
+        has a None for each, to count towards the game's length. kwargs are passed on to the constructor."""
+        fen, promotions, history = state
+        board = cls.from_fen(fen, promotions=promotions, **kwargs)
+        hashes = array("Q", history)
+        board._allocate_state_stack(max(STATE_STACK_SIZE, 2 * len(hashes)))
+        board._hash_stack[:len(hashes)] = hashes
+        board.ply = len(hashes)
+        board.past_moves = [None] * len(hashes)
+        return board
+
+    @property
+    def hash(self) -> int:
+        """64 bit Zobrist hash of the position: pieces, turn, castle flags and en passant spot.
+        Equal positions have equal hashes no matter how they were reached."""
+        return self._hash
+
+    def repetitions(self) -> int:
+        """How many times the current position has occurred before in this game.
+        Only looks back to the last capture or pawn move, no position before one can occur again."""
+        count = 0
+        hashes, captured, moved = self._hash_stack, self._captured_stack, self._moved_stack
+        for ply in range(self.ply - 1, -1, -1):
+            if captured[ply] != "." or moved[ply] in "Pp":
+                break
+            if hashes[ply] == self._hash:
+                count += 1
+        return count
+
+    def _allocate_state_stack(self, size: int) -> None:
+        """(Re)allocates the undo state stack with room for size plies, keeping what's on it"""
+        old = getattr(self, "_hash_stack", None)
+        stack = {
+            "_castle_stack": array("B", bytes(size)),  # castle_rights
+            "_ep_stack": array("b", [-1]) * size,  # en passant square index, -1 for none
+            "_captured_stack": ["."] * size,
+            "_moved_stack": ["."] * size,  # the piece that moved, before any promotion
+            "_hash_stack": array("Q", bytes(8 * size)),
+            "_material_stack": array("i", bytes(4 * size)),
+            "_piece_square_stack": array("i", bytes(4 * size)),
+        }
+        for name, new in stack.items():
+            if old is not None:
+                new[:len(old)] = getattr(self, name)
+            setattr(self, name, new)
+
     def next_turn(self) -> str:
         """Returns "white" or "black whichever is not our current turn"""
         if self.turn == "white":
@@ -116,15 +431,47 @@ class ChessBoard(object):
         else:
             return "white"
 
-    def _sync_board_to_piece_set(self) -> None:
-        """Sets the piece list from the ground truth of the board"""
-        self.piece_set = set()
+    def _scan_piece_set(self) -> Set[Tuple[str, int, int]]:
+        """Builds the piece set from scratch by scanning every square of the board"""
+        piece_set = set()
         for r in range(SIZE):
             for c in range(SIZE):
                 p = self.board[r, c]
                 if p != ".":
-                    self.piece_set.add((p, r, c))
-                        
+                    piece_set.add((p, r, c))
+        return piece_set
+
+    def _flags_hash(self) -> int:
+        """XOR of the Zobrist keys for the current castle flags and en passant spot"""
+        h = ZOBRIST_CASTLE_RIGHTS[self.castle_rights]
+        if self.en_passant_spot is not None:
+            r, c = self.en_passant_spot
+            h ^= ZOBRIST_EN_PASSANT[r][c]
+        return h
+
+    def _scan_hash(self) -> int:
+        """Computes the Zobrist hash from scratch out of the piece set, turn and flags"""
+        h = self._flags_hash()
+        if self.turn == "black":
+            h ^= ZOBRIST_BLACK_TO_MOVE
+        for p, r, c in self.piece_set:
+            h ^= ZOBRIST_PIECES[p][r][c]
+        return h
+
+    def _scan_eval_totals(self) -> Tuple[int, int]:
+        """Sums (material, piece_square) from scratch over the piece set"""
+        material = sum(PIECE_VALUES[p] for p, _, _ in self.piece_set)
+        piece_square = sum(PIECE_SQUARE_TABLES[p][r][c] for p, r, c in self.piece_set)
+        return material, piece_square
+
+    def _sync_board_to_piece_set(self) -> None:
+        """Sets the piece list, hash and eval totals from the ground truth of the board.
+        Only needed after editing self.board, turn or the flags directly:
+        do_move and undo_move keep them in sync."""
+        self.piece_set = self._scan_piece_set()
+        self._hash = self._scan_hash()
+        self.material, self.piece_square = self._scan_eval_totals()
+
     def clear_pieces(self) -> None:
         """Remove all pieces from the board"""
         self.board = np.full(shape=(SIZE, SIZE), fill_value=".", dtype="<U1")
@@ -152,6 +499,15 @@ class ChessBoard(object):
 
         self._sync_board_to_piece_set()
 
+    def _piece_at(self, r: int, c: int) -> str:
+        """Returns the piece on a square, or '.' if empty.
+        Board backends that don't store the numpy board directly override this."""
+        return self.board[r, c]
+
+    def has_piece(self, piece: str) -> bool:
+        """Checks if there's at least one of this piece anywhere on the board"""
+        return piece in self.board
+
     def find_my_pieces(self, turn=None) -> Sequence[Tuple[str, int, int]]:
         """Returns a list of all the current player's pieces and their locations.
         turn: override the current turn
@@ -168,49 +524,38 @@ class ChessBoard(object):
 
 
     def _get_sliding_dests(
-        self, r: int, c: int, player: str, steps: Sequence[Tuple[int, int]], max_steps=SIZE
+        self, r: int, c: int, player: str, rays: Sequence[Sequence[Tuple[int, int]]]
     ) -> Sequence[Tuple[int, int]]:
-        """Expand a list of "step" directions into a list of possible destinations for the piece"""
+        """Slide out along each precomputed ray until blocked, returning the possible destinations"""
         if player == "black":
-            my_piece = str.islower
             other_piece = str.isupper
         else:
-            my_piece = str.isupper
             other_piece = str.islower
 
+        board = self.board
         dests = []
-        for dr, dc in steps:
-            for i in range(1, max_steps + 1):
-                r2, c2 = r + i * dr, c + i * dc  # slide along step direction
-                if not inbound(r2, c2):
-                    break
-                elif my_piece(self.board[r2, c2]):
-                    break
-                elif other_piece(self.board[r2, c2]):
+        for ray in rays:
+            for r2, c2 in ray:
+                p = board[r2, c2]
+                if p == ".":  # empty square, don't break the search
                     dests.append((r2, c2))
+                else:
+                    if other_piece(p):
+                        dests.append((r2, c2))
                     break
-                else:  # empty square, don't break the search
-                    dests.append((r2, c2))
         return dests
 
     def _get_jumping_dests(
-        self, r: int, c: int, player: str, jumps: Sequence[Tuple[int, int]]
+        self, r: int, c: int, player: str, targets: Sequence[Tuple[int, int]]
     ) -> Sequence[Tuple[int, int]]:
-        """Filter a list of jumping destinations and return the valid ones"""
+        """Filter a precomputed list of jumping destinations and return the valid ones"""
         if player == "black":
             my_piece = str.islower
-            other_piece = str.isupper
         else:
             my_piece = str.isupper
-            other_piece = str.islower
 
-        dests = []
-        for dr, dc in jumps:
-            r2, c2 = r + dr, c + dc
-            if inbound(r2, c2):
-                if not my_piece(self.board[r2, c2]):
-                    dests.append((r2, c2))
-        return dests
+        board = self.board
+        return [(r2, c2) for r2, c2 in targets if not my_piece(board[r2, c2])]
 
     def _get_pawn_dests(self, r: int, c: int, player: str) -> Sequence[Tuple[int, int]]:
         """pawns are actually the most complex pieces on the board! Their moves:
@@ -219,29 +564,22 @@ class ChessBoard(object):
         NOTE: promotions are handled later, converting destinations that land on
         the back row into multiple possible Moves, turning into a Queen or Knight.
         NOTE: en passant handled elsewhere"""
-
-        pawn_jumps = []
+        board = self.board
+        dests = []
         if player == "white":
-            r2, c2 = r - 1, c
-            if inbound(r2, c2) and self.board[r2, c2] == ".":  # jump forward if clear
-                pawn_jumps.append((-1, 0))
-                if r == 6 and self.board[r - 2, c] == ".":  # double jump if not blocked and on home row
-                    pawn_jumps.append((-2, 0))
-            for dc in [-1, 1]:  # captures
-                r2, c2 = r - 1, c + dc
-                if inbound(r2, c2) and self.board[r2, c2].islower():
-                    pawn_jumps.append((-1, dc))
-        else:  # black
-            r2, c2 = r + 1, c
-            if inbound(r2, c2) and self.board[r2, c2] == ".":  # jump forward if clear
-                pawn_jumps.append((1, 0))
-                if r == 1 and self.board[r + 2, c] == ".":  # double jump if not blocked and on home row
-                    pawn_jumps.append((2, 0))
-            for dc in [-1, 1]:  # captures
-                r2, c2 = r + 1, c + dc
-                if inbound(r2, c2) and self.board[r2, c2].isupper():
-                    pawn_jumps.append((1, dc))
-        return self._get_jumping_dests(r, c, player, pawn_jumps)
+            forward, home_row, other_piece = -1, 6, str.islower
+        else:
+            forward, home_row, other_piece = 1, 1, str.isupper
+
+        r2 = r + forward
+        if inbound(r2, c) and board[r2, c] == ".":  # jump forward if clear
+            dests.append((r2, c))
+            if r == home_row and board[r2 + forward, c] == ".":  # double jump if not blocked and on home row
+                dests.append((r2 + forward, c))
+        for r2, c2 in PAWN_ATTACKS[player][r][c]:  # captures
+            if other_piece(board[r2, c2]):
+                dests.append((r2, c2))
+        return dests
 
     def _get_castle_moves(self, player : str) -> Sequence[Move]:
         """Returns any castle moves available to the current player.
@@ -255,9 +593,9 @@ class ChessBoard(object):
             - open space between them
                 - checked here, by row slice
             - king does not CROSS check
-                - TODO
+                - checked by moves()
             - king is not IN check
-                - TODO
+                - checked by moves()
         """
         moves = []
         if player == "white":
@@ -282,23 +620,23 @@ class ChessBoard(object):
         if self.en_passant_spot is not None:
             ep_r, ep_c = self.en_passant_spot
             if player == "white":
-                if inbound(ep_r, ep_c + 1) and self.board[ep_r, ep_c + 1] == "P":  # white has pawn to right
+                if inbound(ep_r, ep_c + 1) and self._piece_at(ep_r, ep_c + 1) == "P":  # white has pawn to right
                     # TODO: bounds checking?
                     moves.append(Move(ep_r, ep_c + 1, ep_r - 1, ep_c, "P", ".", "e"))
-                if inbound(ep_r, ep_c - 1) and self.board[ep_r, ep_c - 1] == "P":  # white has pawn to left
+                if inbound(ep_r, ep_c - 1) and self._piece_at(ep_r, ep_c - 1) == "P":  # white has pawn to left
                     moves.append(Move(ep_r, ep_c - 1, ep_r - 1, ep_c, "P", ".", "e"))
             else:
-                if inbound(ep_r, ep_c + 1) and self.board[ep_r, ep_c + 1] == "p":  # black has pawn to right
+                if inbound(ep_r, ep_c + 1) and self._piece_at(ep_r, ep_c + 1) == "p":  # black has pawn to right
                     # TODO: bounds checking?
                     moves.append(Move(ep_r, ep_c + 1, ep_r + 1, ep_c, "p", ".", "e"))
-                if inbound(ep_r, ep_c - 1) and self.board[ep_r, ep_c - 1] == "p":  # black has pawn to left
+                if inbound(ep_r, ep_c - 1) and self._piece_at(ep_r, ep_c - 1) == "p":  # black has pawn to left
                     moves.append(Move(ep_r, ep_c - 1, ep_r + 1, ep_c, "p", ".", "e"))
         return moves
 
     def get_dests_for_piece(self, r: int, c: int, piece=None) -> Sequence[Tuple[int, int]]:
         """Given a particular piece, generates all possible destinations for it to move to.
         piece: optional param to override piece at board location
-        TODO: filter destinations that would put us in check.
+        Destinations are pseudo legal: moves() filters the ones that leave our king in check.
         Returns [(r,c),...]. """
 
         if piece is None:
@@ -308,26 +646,19 @@ class ChessBoard(object):
         else:
             player = "white"
 
-        # piece delta movements
-        knight_jumps = [(1, 2), (1, -2), (2, 1), (2, -1), (-1, 2), (-1, -2), (-2, 1), (-2, -1)]
-        king_jumps = [(1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1)]
-        rook_steps = [(1, 0), (0, 1), (-1, 0), (0, -1)]
-        bishop_steps = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-        queen_steps = rook_steps + bishop_steps
-
         piece_type = piece.lower()
         if piece_type == "p":
             destinations = self._get_pawn_dests(r, c, player)
         elif piece_type == "r":
-            destinations = self._get_sliding_dests(r, c, player, rook_steps)
+            destinations = self._get_sliding_dests(r, c, player, ROOK_RAYS[r][c])
         elif piece_type == "n":
-            destinations = self._get_jumping_dests(r, c, player, knight_jumps)
+            destinations = self._get_jumping_dests(r, c, player, KNIGHT_TARGETS[r][c])
         elif piece_type == "b":
-            destinations = self._get_sliding_dests(r, c, player, bishop_steps)
+            destinations = self._get_sliding_dests(r, c, player, BISHOP_RAYS[r][c])
         elif piece_type == "q":
-            destinations = self._get_sliding_dests(r, c, player, queen_steps)
+            destinations = self._get_sliding_dests(r, c, player, QUEEN_RAYS[r][c])
         elif piece_type == "k":
-            destinations = self._get_jumping_dests(r, c, player, king_jumps)
+            destinations = self._get_jumping_dests(r, c, player, KING_TARGETS[r][c])
         else:
             raise ValueError("Unknown piece! {}".format(piece))
 
@@ -340,8 +671,9 @@ class ChessBoard(object):
             board[r, c] = 1
         return board
 
-    def moves(self, turn=None) -> Sequence[Move]:
-        """returns a list of all possible moves given the current board state and turn.
+    def pseudo_legal_moves(self, turn=None) -> Sequence[Move]:
+        """returns a list of all possible moves given the current board state and turn,
+        without checking whether they leave our own king in check.
         turn: "white" or "black" or None, to use the current turn
         Returns a list of Move Objects."""
         if turn is None:
@@ -350,19 +682,21 @@ class ChessBoard(object):
 
         # generate possible normal moves
         all_moves = []
+        piece_at = self._piece_at
         for piece, r_from, c_from in pieces:
-            for r_to, c_to in self.get_dests_for_piece(r_from, c_from):
-                
+            for r_to, c_to in self.get_dests_for_piece(r_from, c_from, piece):
+                captured = piece_at(r_to, c_to)
+
                 # handle pawn promotions
                 if piece == "P" and r_to == 0:
-                    all_moves.append(Move(r_from, c_from, r_to, c_to, piece="Q", special="q"))
-                    all_moves.append(Move(r_from, c_from, r_to, c_to, piece="N", special="n"))
+                    for special in self.promotions:
+                        all_moves.append(Move(r_from, c_from, r_to, c_to, special.upper(), captured, special))
                 elif piece == "p" and r_to == 7:
-                    all_moves.append(Move(r_from, c_from, r_to, c_to, piece="q", special="q"))
-                    all_moves.append(Move(r_from, c_from, r_to, c_to, piece="n", special="n"))
+                    for special in self.promotions:
+                        all_moves.append(Move(r_from, c_from, r_to, c_to, special, captured, special))
                 else:
                     # convert normal destinations into moves
-                    move = Move(r_from, c_from, r_to, c_to, piece=piece)
+                    move = Move(r_from, c_from, r_to, c_to, piece, captured)
                     all_moves.append(move)
 
         # add special moves
@@ -371,143 +705,382 @@ class ChessBoard(object):
 
         return all_moves
     
-    def _update_castling_flags(self, move: Move):
-        """Whether you're allowed to castle is NOT markov with the board state. Once a king or
-        rook has moved once, it cannot castle, even
-        if it moves back. We track these with flags"""
-        piece = move.piece
-        if piece == "k":
-            self.b_castle_left_flag, self.b_castle_right_flag = False, False
-        elif piece == "K":
-            self.w_castle_left_flag, self.w_castle_right_flag = False, False
-        elif piece == "r":
-            if move.c_from == 0 and move.r_from == 0:  # move from upper left
-                self.b_castle_left_flag = False
-            elif move.c_from == 7 and move.r_from == 0:  # move from upper right
-                self.b_castle_right_flag = False
-        elif piece == "R":
-            if move.c_from == 0 and move.r_from == 7:  # move from bottom left
-                self.w_castle_left_flag = False
-            elif move.c_from == 7 and move.r_from == 7:  # move from bottom right
-                self.w_castle_right_flag = False
-    
-    def _update_en_passant_flags(self, move: Move):
-        """En passant is only available the turn immediately
-        after a double jump. We track availability with a flag"""
-        piece = move.piece
-        if piece.lower() == "p" and abs(move.r_from - move.r_to) == 2:  # detect a double jump to enable en passant
-            self.en_passant_spot = (move.r_to, move.c_to)
+    def generate_packed(self, buffer: array, turn=None) -> int:
+        """Same moves as pseudo_legal_moves(), but packed into the start of a preallocated buffer
+        (see MoveBuffers). Returns the number of moves written."""
+        if turn is None:
+            turn = self.turn
+        promote_row = 0 if turn == "white" else 7
+        promotions = [PROMOTION_FLAGS[p] << 12 for p in self.promotions]
+
+        n = 0
+        for piece, r_from, c_from in self.find_my_pieces(turn):
+            sq_from = r_from * SIZE + c_from
+            promotes = piece in "Pp"
+            for r_to, c_to in self.get_dests_for_piece(r_from, c_from, piece):
+                code = sq_from | (r_to * SIZE + c_to) << 6
+                if promotes and r_to == promote_row:
+                    for promotion in promotions:
+                        buffer[n] = code | promotion
+                        n += 1
+                else:
+                    buffer[n] = code
+                    n += 1
+
+        for move in self._get_castle_moves(turn) + self._get_en_passant_moves(turn):
+            buffer[n] = encode_move(move)
+            n += 1
+        return n
+
+    def do_packed_move(self, code: int) -> Move:
+        """Does a packed move. Returns the decoded Move, which undo_move will pop"""
+        move = decode_move(code, self)
+        self.do_move(move)
+        return move
+
+    def checks_and_pins(self, turn=None) -> Tuple[int, Set[Tuple[int, int]], Dict[Tuple[int, int], Set[Tuple[int, int]]]]:
+        """Finds what's attacking the player's king, by looking out from it along every ray and jump.
+        Returns (checkers, evasions, pins):
+            checkers: how many enemy pieces give check
+            evasions: with one checker, the squares that capture it or block its ray
+            pins: pinned square -> the squares along the pin that piece can still move to"""
+        if turn is None:
+            turn = self.turn
+        checkers, evasions, pins = 0, set(), {}
+        king = self.king_square(turn)
+        if king is None:
+            return checkers, evasions, pins
+        kr, kc = king
+        if turn == "white":
+            mine, straight, diagonal, knight, pawn = str.isupper, "rq", "bq", "n", "p"
+        else:
+            mine, straight, diagonal, knight, pawn = str.islower, "RQ", "BQ", "N", "P"
+        piece_at = self._piece_at
+
+        for step in ROOK_STEPS + BISHOP_STEPS:
+            sliders = straight if step in ROOK_STEPS else diagonal
+            pinned = None
+            path = []
+            for r2, c2 in RAYS[step][kr][kc]:
+                path.append((r2, c2))
+                p = piece_at(r2, c2)
+                if p == ".":
+                    continue
+                if mine(p):
+                    if pinned is not None:
+                        break  # two of ours in the way, nothing to worry about
+                    pinned = (r2, c2)
+                    continue
+                if p in sliders:
+                    if pinned is None:
+                        checkers += 1
+                        evasions.update(path)
+                    else:
+                        pins[pinned] = set(path)
+                break
+        for r2, c2 in KNIGHT_TARGETS[kr][kc]:
+            if piece_at(r2, c2) == knight:
+                checkers += 1
+                evasions.add((r2, c2))
+        for r2, c2 in PAWN_ATTACKS[turn][kr][kc]:
+            if piece_at(r2, c2) == pawn:
+                checkers += 1
+                evasions.add((r2, c2))
+        return checkers, evasions, pins
+
+    def _king_move_is_safe(self, move: Move, enemy: str) -> bool:
+        """Checks the king's destination isn't attacked, with the king lifted off its square so it
+        can't hide behind itself from a slider"""
+        king = self._remove_piece(move.r_from, move.c_from)
+        safe = not self.is_attacked(move.r_to, move.c_to, enemy)
+        self._add_piece(king, move.r_from, move.c_from)
+        return safe
+
+    def moves(self, turn=None) -> Sequence[Move]:
+        """returns a list of all legal moves given the current board state and turn.
+        Checkers and pins are found once, then each pseudo legal move is kept only if it
+        doesn't leave our king in check:
+            - with two checkers only the king can move
+            - with one, other pieces must capture the checker or block it
+            - pinned pieces may only move along the pin
+            - the king can't move onto an attacked square, or castle out of, through or into check
+            - en passant is rare and can uncover a check along the row, so it's just tried out
+        turn: "white" or "black" or None, to use the current turn
+        Returns a list of Move Objects."""
+        if turn is None:
+            turn = self.turn
+        pseudo_legal = self.pseudo_legal_moves(turn)
+        if self.king_square(turn) is None:
+            return pseudo_legal  # no king to protect (only in test positions)
+
+        enemy = "black" if turn == "white" else "white"
+        checkers, evasions, pins = self.checks_and_pins(turn)
+        legal = []
+        for move in pseudo_legal:
+            special = move.special
+            if move.piece == "K" or move.piece == "k":
+                if special in CASTLE_ROOK_HOPS:
+                    passing = CASTLE_ROOK_HOPS[special][1][1]  # the king crosses the rook's destination
+                    if checkers or self.is_attacked(move.r_from, passing, enemy):
+                        continue
+                if self._king_move_is_safe(move, enemy):
+                    legal.append(move)
+            elif checkers >= 2:
+                continue
+            elif special == "e":
+                self.do_move(move)
+                if not self.in_check(turn):
+                    legal.append(move)
+                self.undo_move()
+            else:
+                to = (move.r_to, move.c_to)
+                if checkers and to not in evasions:
+                    continue
+                pin = pins.get((move.r_from, move.c_from))
+                if pin is not None and to not in pin:
+                    continue
+                legal.append(move)
+        return legal
+
+    def king_square(self, turn=None) -> Optional[Tuple[int, int]]:
+        """(r, c) of the player's king, or None if it's not on the board"""
+        if turn is None:
+            turn = self.turn
+        king = "K" if turn == "white" else "k"
+        for p, r, c in self.piece_set:
+            if p == king:
+                return r, c
+        return None
+
+    def is_attacked(self, r: int, c: int, by_player: str) -> bool:
+        """Checks if any of by_player's pieces attack (r, c), looking outwards from the square
+        with the precomputed tables: a knight a knight's jump away, a rook or queen at the end
+        of an open rook ray, etc."""
+        if by_player == "white":
+            pawn, knight, bishop, rook, queen, king = "P", "N", "B", "R", "Q", "K"
+            defender = "black"
         else:
-            self.en_passant_spot = None  # clear
+            pawn, knight, bishop, rook, queen, king = "p", "n", "b", "r", "q", "k"
+            defender = "white"
+        piece_at = self._piece_at
+
+        for r2, c2 in KNIGHT_TARGETS[r][c]:
+            if piece_at(r2, c2) == knight:
+                return True
+        for r2, c2 in KING_TARGETS[r][c]:
+            if piece_at(r2, c2) == king:
+                return True
+        for r2, c2 in PAWN_ATTACKS[defender][r][c]:  # squares an attacking pawn would hit us from
+            if piece_at(r2, c2) == pawn:
+                return True
+        for sliders, rays in [((rook, queen), ROOK_RAYS[r][c]), ((bishop, queen), BISHOP_RAYS[r][c])]:
+            for ray in rays:
+                for r2, c2 in ray:
+                    p = piece_at(r2, c2)
+                    if p != ".":
+                        if p in sliders:
+                            return True
+                        break
+        return False
+
+    def in_check(self, turn=None) -> bool:
+        """Checks if the player's king is attacked. False if there's no king"""
+        if turn is None:
+            turn = self.turn
+        king = self.king_square(turn)
+        if king is None:
+            return False
+        return self.is_attacked(king[0], king[1], "black" if turn == "white" else "white")
+
+    def mobility(self, turn=None) -> int:
+        """Counts the destinations of all the player's pieces, without building Move objects"""
+        return sum(len(self.get_dests_for_piece(r, c, p)) for p, r, c in self.find_my_pieces(turn))
+
+    def capture_score(self, move: Move) -> int:
+        """Most valuable victim, least valuable attacker score for the search's move ordering.
+        0 for quiet moves, promotions score like capturing the piece promoted to."""
+        special = move.special
+        victim = "p" if special == "e" else move.captured.lower()
+        score = MVV_LVA_VICTIM[victim]
+        if score:
+            score -= MVV_LVA_ATTACKER[move.piece.lower()]
+        if special in PROMOTION_FLAGS:
+            score += MVV_LVA_VICTIM[special]
+        return score
+
+    def move_index(self, move: Move) -> int:
+        """from square * 64 + to square, the index into the search's history (butterfly) table"""
+        return (move.r_from * SIZE + move.c_from) << 6 | (move.r_to * SIZE + move.c_to)
+
+    def _write_square(self, r: int, c: int, piece: str) -> None:
+        """Stores a piece (or '.') on a square of the underlying board representation.
+        Board backends that don't store the numpy board directly override this."""
+        self.board[r, c] = piece
+
+    def _add_piece(self, piece: str, r: int, c: int) -> None:
+        """Places a piece on an empty square, keeping the piece set, hash and eval totals in sync"""
+        self._write_square(r, c, piece)
+        self.piece_set.add((piece, r, c))
+        self._hash ^= ZOBRIST_PIECES[piece][r][c]
+        self.material += PIECE_VALUES[piece]
+        self.piece_square += PIECE_SQUARE_TABLES[piece][r][c]
+
+    def _remove_piece(self, r: int, c: int) -> str:
+        """Lifts the piece off a square, keeping the piece set, hash and eval totals in sync.
+        Returns the piece"""
+        piece = self._piece_at(r, c)
+        self._write_square(r, c, ".")
+        self.piece_set.discard((piece, r, c))
+        self._hash ^= ZOBRIST_PIECES[piece][r][c]
+        self.material -= PIECE_VALUES[piece]
+        self.piece_square -= PIECE_SQUARE_TABLES[piece][r][c]
+        return piece
+
+    def _verify_incremental_state(self) -> None:
+        """Debug mode: cross-checks everything do_move and undo_move update incrementally
+        against a full rescan of the board. Raises RuntimeError if they disagree."""
+        expected = self._scan_piece_set()
+        if self.piece_set != expected:
+            raise RuntimeError("piece_set out of sync with board. missing: {} extra: {}".format(
+                expected - self.piece_set, self.piece_set - expected))
+        if self._hash != self._scan_hash():
+            raise RuntimeError("hash out of sync with board")
+        if (self.material, self.piece_square) != self._scan_eval_totals():
+            raise RuntimeError("material / piece square totals out of sync with board")
 
     def do_move(self, move: Move):
-        """Do a move on the chessboard"""
-        
-        # move the piece
-        piece = self.board[move.r_from, move.c_from]  # type: str
-        move.piece = piece
-        captured = self.board[move.r_to, move.c_to]  # type: str
-        self.board[move.r_from, move.c_from] = "."
-        self.board[move.r_to, move.c_to] = piece
-
-        # save current state of flags for undoing later
-        move.old_flags = (
-            self.w_castle_left_flag, 
-            self.w_castle_right_flag,
-            self.b_castle_left_flag,
-            self.b_castle_right_flag,
-            self.en_passant_spot,
-        )
+        """Do a move on the chessboard. The move itself is left untouched"""
+        r_from, c_from, r_to, c_to, special = move.r_from, move.c_from, move.r_to, move.c_to, move.special
+        piece = self._piece_at(r_from, c_from)
+        captured = self._piece_at(r_to, c_to)
+
+        # push everything undo_move can't work out from the move onto the state stack
+        ply = self.ply
+        if ply == len(self._hash_stack):
+            self._allocate_state_stack(2 * ply)
+        ep = self.en_passant_spot
+        self._castle_stack[ply] = self.castle_rights
+        self._ep_stack[ply] = -1 if ep is None else ep[0] * SIZE + ep[1]
+        self._captured_stack[ply] = captured
+        self._moved_stack[ply] = piece
+        self._hash_stack[ply] = self._hash
+        self._material_stack[ply] = self.material
+        self._piece_square_stack[ply] = self.piece_square
+        self.ply = ply + 1
 
-        # record state that effects special moves
-        self._update_en_passant_flags(move)
-        self._update_castling_flags(move)
+        # record state that effects special moves.
+        # Whether you're allowed to castle is NOT markov with the board state: once a king or rook
+        # has moved, it can't castle even if it moves back. En passant is only available the turn
+        # immediately after a double jump.
+        self._hash ^= self._flags_hash()
+        self.castle_rights &= CASTLE_RIGHTS_KEPT[r_from * SIZE + c_from] & CASTLE_RIGHTS_KEPT[r_to * SIZE + c_to]
+        if (piece == "P" or piece == "p") and abs(r_from - r_to) == 2:  # double jump enables en passant
+            self.en_passant_spot = (r_to, c_to)
+        else:
+            self.en_passant_spot = None
+        self._hash ^= self._flags_hash()
+
+        # move the piece
+        self._remove_piece(r_from, c_from)
+        if captured != ".":
+            self._remove_piece(r_to, c_to)
+        if special in PROMOTION_FLAGS:
+            piece = special.upper() if piece.isupper() else special
+        self._add_piece(piece, r_to, c_to)
 
         # implement side effects for special moves
-        if move.special == W_CASTLE_LEFT:
-            self.board[7,0] = "."
-            self.board[7,3] = "R"
-        elif move.special == W_CASTLE_RIGHT:
-            self.board[7,7] = "."
-            self.board[7,5] = "R"
-        elif move.special == B_CASTLE_LEFT:
-            self.board[0,0] = "."
-            self.board[0,3] = "r"
-        elif move.special == B_CASTLE_RIGHT:
-            self.board[0,7] = "."
-            self.board[0,5] = "r"
-        elif move.special == "e":  # en passant
+        if special in CASTLE_ROOK_HOPS:
+            (r_rook, c_rook), (r_hop, c_hop) = CASTLE_ROOK_HOPS[special]
+            self._add_piece(self._remove_piece(r_rook, c_rook), r_hop, c_hop)
+        elif special == "e":  # en passant
             if self.turn == "white":
-                self.board[move.r_to + 1, move.c_to] = "."
-            else:
-                self.board[move.r_to - 1, move.c_to] = "."
-        elif move.special in ["q", "n"]:  # promotion
-            # TODO: clean up this by always filling in piece originally?
-            if piece.isupper():
-                piece = move.special.upper()
+                self._remove_piece(r_to + 1, c_to)
             else:
-                piece = move.special
-            self.board[move.r_to, move.c_to] = piece
+                self._remove_piece(r_to - 1, c_to)
 
         self.turn = self.next_turn()
+        self._hash ^= ZOBRIST_BLACK_TO_MOVE
 
-        # update piece set datastructure
-        self._sync_board_to_piece_set()  # TODO: much slower than tracking explicitly?
-            
         # save move
-        move.captured = captured
         self.past_moves.append(move)
 
+        if self.debug:
+            self._verify_incremental_state()
+
     def undo_move(self):
         """Undo the most recent move"""
         move = self.past_moves.pop()
-
-        piece = move.piece
-        captured = move.captured
-        self.board[move.r_from, move.c_from] = piece
-        self.board[move.r_to, move.c_to] = captured
+        self.turn = self.next_turn()
+        self.ply -= 1
+        ply = self.ply
 
         # undo recorded info needed for special moves.
-        (
-            self.w_castle_left_flag, 
-            self.w_castle_right_flag,
-            self.b_castle_left_flag,
-            self.b_castle_right_flag,
-            self.en_passant_spot
-        ) = move.old_flags
+        self.castle_rights = self._castle_stack[ply]
+        ep = self._ep_stack[ply]
+        self.en_passant_spot = None if ep < 0 else SQUARE_COORDS[ep]
 
         # special moves
-        if move.special == W_CASTLE_LEFT:
-            self.board[7,0] = "R"
-            self.board[7,3] = "."
-        elif move.special == W_CASTLE_RIGHT:
-            self.board[7,7] = "R"
-            self.board[7,5] = "."
-        elif move.special == B_CASTLE_LEFT:
-            self.board[0,0] = "r"
-            self.board[0,3] = "."
-        elif move.special == B_CASTLE_RIGHT:
-            self.board[0,7] = "r"
-            self.board[0,5] = "."
+        if move.special in CASTLE_ROOK_HOPS:
+            (r_rook, c_rook), (r_hop, c_hop) = CASTLE_ROOK_HOPS[move.special]
+            self._add_piece(self._remove_piece(r_hop, c_hop), r_rook, c_rook)
         elif move.special == "e":  # en passant
-            if self.turn == "black": # NOTE: careful, this is reverse, because the turn has not yet flipped back
-                self.board[move.r_to + 1, move.c_to] = "p"
-            else:
-                self.board[move.r_to - 1, move.c_to] = "P"
-        elif move.special in ["q", "n"]:  # promotion
-            # demote back to a pawn :p
-            # NOTE that processing a promotion forward saves move.piece as the new piece
-            if piece.isupper():
-                piece = "P"
+            if self.turn == "white":
+                self._add_piece("p", move.r_to + 1, move.c_to)
             else:
-                piece = "p"
-        self.board[move.r_from, move.c_from] = piece
+                self._add_piece("P", move.r_to - 1, move.c_to)
+
+        # move the piece back. The stack has the piece from before any promotion, so this also demotes it
+        self._remove_piece(move.r_to, move.c_to)
+        self._add_piece(self._moved_stack[ply], move.r_from, move.c_from)
+        captured = self._captured_stack[ply]
+        if captured != ".":
+            self._add_piece(captured, move.r_to, move.c_to)
+
+        self._hash = self._hash_stack[ply]
+        self.material = self._material_stack[ply]
+        self.piece_square = self._piece_square_stack[ply]
+
+        if self.debug:
+            self._verify_incremental_state()
+
+    def do_null_move(self) -> None:
+        """Passes the turn without moving, for the search's null move pruning.
+        Goes on the state stack like a move (None in past_moves), undo it with undo_null_move"""
+        ply = self.ply
+        if ply == len(self._hash_stack):
+            self._allocate_state_stack(2 * ply)
+        ep = self.en_passant_spot
+        self._ep_stack[ply] = -1 if ep is None else ep[0] * SIZE + ep[1]
+        self._captured_stack[ply] = self._moved_stack[ply] = "."  # nothing irreversible, see repetitions
+        self._hash_stack[ply] = self._hash
+        self.ply = ply + 1
 
+        self._hash ^= self._flags_hash()
+        self.en_passant_spot = None  # the chance to take en passant is gone after any move
+        self._hash ^= self._flags_hash()
         self.turn = self.next_turn()
+        self._hash ^= ZOBRIST_BLACK_TO_MOVE
+        self.past_moves.append(None)
+
+    def undo_null_move(self) -> None:
+        """Undoes do_null_move"""
+        self.past_moves.pop()
+        self.turn = self.next_turn()
+        self.ply -= 1
+        ep = self._ep_stack[self.ply]
+        self.en_passant_spot = None if ep < 0 else SQUARE_COORDS[ep]
+        self._hash = self._hash_stack[self.ply]
+
+    def null_move_allowed(self) -> bool:
+        """Whether the search may try passing the turn here. Not straight after another pass,
+        not in check (it would leave the king en prise), and not with only king and pawns:
+        those endings are where zugzwang is common, when any move makes things worse, so
+        passing would be far better than the real moves and the search would be fooled by it."""
+        if self.past_moves and self.past_moves[-1] is None:
+            return False
+        pieces = "NBRQ" if self.turn == "white" else "nbrq"
+        return any(self.has_piece(p) for p in pieces) and not self.in_check()
 
-        # update piece set datastructure
-        self._sync_board_to_piece_set()  # TODO: much slower than tracking explicitly?
-        
     def print_move(self, move: Move):
         """Graphically represents a move"""
         print(move)
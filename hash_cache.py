@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""Fixed size cache of values keyed by position hash, for anything that only depends on the
+position and one small number: e.g. perft counts (by depth) and eval scores (by eval config).
+
+The same position turns up many times in a search tree through different move orders, so
+its value can be looked up instead of worked out again. Each slot stores the hash, the value
+and the small number, and a stored value is only used if both match. The number can't be 0,
+that marks an empty slot.
+
+Direct mapped: each position has one slot, and a store always replaces what's there.
+"""
+
+from array import array
+from typing import Dict, Optional
+
+
+class HashCache(object):
+    """Maps (position hash, check) to a value, check being 1 to 255.
+
+    size_mb: memory budget for the cache.
+    value_type: array typecode of the values, e.g. "Q" for counts or "i" for scores.
+    """
+
+    def __init__(self, size_mb: float = 16, value_type: str = "i"):
+        self.size_mb = size_mb
+        self.value_type = value_type
+        self.entry_bytes = 8 + array(value_type).itemsize + 1  # hash, value, check
+        self.size = max(1, int(size_mb * 2 ** 20) // self.entry_bytes)
+        self.keys = array("Q", bytes(8 * self.size))
+        self.values = array(value_type, bytes(array(value_type).itemsize * self.size))
+        self.checks = array("B", bytes(self.size))  # 0 marks an empty slot
+
+        # statistics
+        self.probes = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def clear(self) -> None:
+        """Empties the cache and resets the statistics"""
+        self.__init__(self.size_mb, self.value_type)
+
+    def probe(self, key: int, check: int) -> Optional[int]:
+        """Returns the value stored for this position and check, or None"""
+        self.probes += 1
+        i = key % self.size
+        if self.checks[i] == check and self.keys[i] == key:
+            self.hits += 1
+            return self.values[i]
+        return None
+
+    def store(self, key: int, check: int, value: int) -> None:
+        i = key % self.size
+        self.keys[i] = key
+        self.checks[i] = check
+        self.values[i] = value
+
+    def stats(self) -> Dict[str, float]:
+        """Hit statistics since the cache was created or cleared"""
+        return {
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.probes if self.probes else 0.0,
+        }
@@ -20,27 +20,33 @@ def get_all_players() -> Sequence[Player]:
     """Returns a list of all combinations of different player settings dicts"""
     all_params = []
     for explore_ratio in [1.0]:
-        for depth in [3]:
+        for depth in [3, 4]:
             for piece_table in [True, False]:
                 for mobility in [True, False]:
-                    # speed control:
-                    if depth == 6 and explore_ratio > .6:
-                        continue
-                    if depth == 7 and explore_ratio > .4:
-                        continue
-                    if depth == 8 and explore_ratio > .2:
-                        continue
-
-                    # construct player params dict
-                    params = dict(
-                        depth=depth,
-                        explore_ratio=explore_ratio,
-                        min_branches=10,
-                        mobility=mobility,
-                        piece_table=piece_table
-                    )
-
-                    all_params.append(params)
+                    for null_move, lmr in [(0, 0), (2, 0), (0, 3), (2, 3)]:
+                        # null moves and reductions only kick in 3 plies from the leaves
+                        if depth < 4 and (null_move or lmr):
+                            continue
+                        # speed control:
+                        if depth == 6 and explore_ratio > .6:
+                            continue
+                        if depth == 7 and explore_ratio > .4:
+                            continue
+                        if depth == 8 and explore_ratio > .2:
+                            continue
+
+                        # construct player params dict
+                        params = dict(
+                            depth=depth,
+                            explore_ratio=explore_ratio,
+                            min_branches=10,
+                            mobility=mobility,
+                            piece_table=piece_table,
+                            null_move=null_move,
+                            lmr=lmr,
+                        )
+
+                        all_params.append(params)
 
     return all_params
 
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""Magic bitboard tables for sliding piece attacks.
+
+For each square a rook or bishop could stand on, the squares that can block it (its rays,
+minus the last square on each, which never changes the result) form a mask. Every subset
+of the mask maps to one attack set, and a "magic" multiplier perfectly hashes the subsets:
+    attacks = table[offset[sq] + (((occupied & mask[sq]) * magic[sq]) & FULL) >> shift[sq]]
+
+Finding the magics takes a while, so it's done offline by running this file, which writes
+MAGIC_FILE next to it. The engine only ever loads the saved tables.
+
+Usage:
+    python magic.py [--seed 0]
+"""
+
+import argparse
+import os
+import random
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from chessboard import SIZE, ROOK_STEPS, BISHOP_STEPS, RAYS
+
+FULL = (1 << 64) - 1
+MAGIC_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "magic_tables.npz")
+PIECES = {"rook": ROOK_STEPS, "bishop": BISHOP_STEPS}
+
+
+def _bit(r: int, c: int) -> int:
+    """Bitboard with only (r, c) set"""
+    return 1 << (r * SIZE + c)
+
+
+def relevant_mask(sq: int, steps: Sequence[Tuple[int, int]]) -> int:
+    """Bitboard of the squares whose occupancy can change a slider's attacks from sq"""
+    r, c = divmod(sq, SIZE)
+    mask = 0
+    for step in steps:
+        for r2, c2 in RAYS[step][r][c][:-1]:
+            mask |= _bit(r2, c2)
+    return mask
+
+
+def slow_attacks(sq: int, occupied: int, steps: Sequence[Tuple[int, int]]) -> int:
+    """Reference attacks: walk each ray until blocked"""
+    r, c = divmod(sq, SIZE)
+    attacks = 0
+    for step in steps:
+        for r2, c2 in RAYS[step][r][c]:
+            attacks |= _bit(r2, c2)
+            if occupied & _bit(r2, c2):
+                break
+    return attacks
+
+
+def subsets(mask: int) -> List[int]:
+    """Every subset of the mask's bits, including 0 and the mask itself (carry-rippler trick)"""
+    result = []
+    subset = 0
+    while True:
+        result.append(subset)
+        subset = (subset - mask) & mask
+        if subset == 0:
+            return result
+
+
+def find_magic(sq: int, steps: Sequence[Tuple[int, int]], rng: random.Random) -> Tuple[int, int, List[int]]:
+    """Searches random sparse multipliers until one maps every blocker subset of sq
+    to an index with no conflicting attacks.
+    Returns (magic, shift, table) with table indexed by the hashed occupancy."""
+    mask = relevant_mask(sq, steps)
+    bits = bin(mask).count("1")
+    shift = 64 - bits
+    occupancies = subsets(mask)
+    attacks = [slow_attacks(sq, occ, steps) for occ in occupancies]
+
+    while True:
+        magic = rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)  # few bits set works best
+        if bin(((mask * magic) & FULL) >> 56).count("1") < 6:
+            continue  # can't spread the mask into the top byte, don't bother
+        table = [None] * (1 << bits)
+        for occ, att in zip(occupancies, attacks):
+            index = ((occ * magic) & FULL) >> shift
+            if table[index] is None:
+                table[index] = att
+            elif table[index] != att:
+                break  # destructive collision, try another magic
+        else:
+            return magic, shift, [att or 0 for att in table]
+
+
+def find_magics(seed: int = 0) -> Dict[str, np.array]:
+    """Finds magics for every square for both rooks and bishops.
+    Returns the arrays saved to MAGIC_FILE: {piece}_masks, _magics, _shifts, _offsets and _attacks,
+    where _attacks is all 64 squares' tables end to end, starting at _offsets[sq]."""
+    rng = random.Random(seed)
+    tables = {}
+    for piece, steps in PIECES.items():
+        masks, magics, shifts, offsets, attacks = [], [], [], [], []
+        for sq in range(SIZE * SIZE):
+            magic, shift, table = find_magic(sq, steps, rng)
+            masks.append(relevant_mask(sq, steps))
+            magics.append(magic)
+            shifts.append(shift)
+            offsets.append(len(attacks))
+            attacks.extend(table)
+        tables[piece + "_masks"] = np.array(masks, dtype=np.uint64)
+        tables[piece + "_magics"] = np.array(magics, dtype=np.uint64)
+        tables[piece + "_shifts"] = np.array(shifts, dtype=np.uint8)
+        tables[piece + "_offsets"] = np.array(offsets, dtype=np.uint32)
+        tables[piece + "_attacks"] = np.array(attacks, dtype=np.uint64)
+    return tables
+
+
+def load_magics(path: str = MAGIC_FILE) -> Dict[str, List[int]]:
+    """Loads the saved tables as lists of python ints, which are much faster to index and
+    multiply than numpy scalars"""
+    if not os.path.exists(path):
+        raise FileNotFoundError("{} is missing, generate it with `python magic.py`".format(path))
+    with np.load(path) as data:
+        return {name: data[name].tolist() for name in data.files}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the magic bitboard tables")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, so the tables are reproducible")
+    parser.add_argument("--out", default=MAGIC_FILE, help="where to save the tables")
+    args = parser.parse_args()
+
+    tables = find_magics(args.seed)
+    np.savez_compressed(args.out, **tables)
+    print("saved {} rook and {} bishop table entries to {}".format(
+        len(tables["rook_attacks"]), len(tables["bishop_attacks"]), args.out))
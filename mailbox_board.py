@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""Integer mailbox backend for the ChessBoard.
+The board is a flat 10x12 array of signed piece codes: white pieces are positive, black
+pieces negative, and the board is framed by a border of OFFBOARD sentinel squares
+(two rows above and below, one column each side), so sliding and jumping pieces just walk
+precomputed offsets until they hit a sentinel instead of bounds checking every step.
+
+The numpy string board is only built when something asks for board.board, i.e. printing."""
+
+from array import array
+from typing import Sequence, Set, Tuple
+
+import numpy as np
+
+from chessboard import (
+    W_CASTLE_LEFT,
+    W_CASTLE_RIGHT,
+    B_CASTLE_LEFT,
+    B_CASTLE_RIGHT,
+    SIZE,
+    Move,
+    ChessBoard,
+)
+
+WIDTH = 10  # columns of the mailbox, including the sentinel column on each side
+EMPTY = 0
+OFFBOARD = 7
+CODES = {".": EMPTY, "P": 1, "N": 2, "B": 3, "R": 4, "Q": 5, "K": 6}
+CODES.update({p.lower(): -code for p, code in CODES.items() if p != "."})
+PIECES = {code: p for p, code in CODES.items()}
+
+# (r, c) <-> mailbox index
+INDEX = [[(r + 2) * WIDTH + c + 1 for c in range(SIZE)] for r in range(SIZE)]
+SQUARE = {INDEX[r][c]: (r, c) for r in range(SIZE) for c in range(SIZE)}
+
+KNIGHT_OFFSETS = [21, 19, 12, 8, -8, -12, -19, -21]
+KING_OFFSETS = [11, 10, 9, 1, -1, -9, -10, -11]
+ROOK_OFFSETS = [10, 1, -10, -1]
+BISHOP_OFFSETS = [11, 9, -9, -11]
+QUEEN_OFFSETS = ROOK_OFFSETS + BISHOP_OFFSETS
+
+
+class MailboxChessBoard(ChessBoard):
+    """ChessBoard backed by a 10x12 mailbox of signed integer piece codes (see the module docstring)."""
+
+    def __init__(self, debug: bool = False, promotions: str = "qn"):
+        self.mailbox = array("b", [OFFBOARD] * (WIDTH * (SIZE + 4)))
+        for r in range(SIZE):
+            for c in range(SIZE):
+                self.mailbox[INDEX[r][c]] = EMPTY
+        self._view = None  # cached string board, see the board property
+        super().__init__(debug, promotions)
+
+    @property
+    def board(self) -> np.array:
+        """The numpy string board, translated from the mailbox on demand.
+        The same array is handed out until the next move, so it can be edited in place
+        and loaded back with _sync_board_to_piece_set(), just like ChessBoard.board."""
+        if self._view is None:
+            self._view = np.full(shape=(SIZE, SIZE), fill_value=".", dtype="<U1")
+            for idx, (r, c) in SQUARE.items():
+                self._view[r, c] = PIECES[self.mailbox[idx]]
+        return self._view
+
+    @board.setter
+    def board(self, board: np.array) -> None:
+        """Assigning a whole new numpy board loads the mailbox from it"""
+        self._view = board
+        self._sync_board_to_piece_set()
+
+    def _scan_piece_set(self) -> Set[Tuple[str, int, int]]:
+        """Builds the piece set from scratch by scanning every square of the mailbox"""
+        return {(PIECES[self.mailbox[idx]], r, c) for idx, (r, c) in SQUARE.items()
+                if self.mailbox[idx] != EMPTY}
+
+    def _sync_board_to_piece_set(self) -> None:
+        """Loads the mailbox from the string board, if one has been handed out (and maybe edited),
+        then sets the piece list from the mailbox"""
+        if self._view is not None:
+            for idx, (r, c) in SQUARE.items():
+                self.mailbox[idx] = CODES[self._view[r, c]]
+        super()._sync_board_to_piece_set()
+
+    def _piece_at(self, r: int, c: int) -> str:
+        """Returns the piece on a square, or '.' if empty"""
+        return PIECES[self.mailbox[INDEX[r][c]]]
+
+    def has_piece(self, piece: str) -> bool:
+        """Checks if there's at least one of this piece anywhere on the board"""
+        return CODES[piece] in self.mailbox
+
+    def _write_square(self, r: int, c: int, piece: str) -> None:
+        """Stores a piece (or '.') on the mailbox, invalidating the string board"""
+        self.mailbox[INDEX[r][c]] = CODES[piece]
+        self._view = None
+
+    def _get_sliding_dests(self, r: int, c: int, player: str, steps: Sequence[int], max_steps=SIZE
+                           ) -> Sequence[Tuple[int, int]]:
+        """Walks each mailbox offset in steps until it hits a sentinel, our own piece, or a capture"""
+        sign = 1 if player == "white" else -1
+        mailbox = self.mailbox
+        start = INDEX[r][c]
+        dests = []
+        for step in steps:
+            idx = start + step
+            for _ in range(max_steps):
+                code = mailbox[idx]
+                if code == OFFBOARD or code * sign > 0:  # off the edge or blocked by our own piece
+                    break
+                dests.append(SQUARE[idx])
+                if code != EMPTY:  # capture, can't slide any further
+                    break
+                idx += step
+        return dests
+
+    def _get_jumping_dests(self, r: int, c: int, player: str, jumps: Sequence[int]
+                           ) -> Sequence[Tuple[int, int]]:
+        """Filter a list of jumping mailbox offsets and return the valid destinations"""
+        sign = 1 if player == "white" else -1
+        mailbox = self.mailbox
+        start = INDEX[r][c]
+        dests = []
+        for jump in jumps:
+            code = mailbox[start + jump]
+            if code != OFFBOARD and code * sign <= 0:
+                dests.append(SQUARE[start + jump])
+        return dests
+
+    def _get_pawn_dests(self, r: int, c: int, player: str) -> Sequence[Tuple[int, int]]:
+        """Pushes onto empty squares (a double push from the home row), and diagonal captures.
+        NOTE: promotions and en passant are handled elsewhere, same as ChessBoard"""
+        mailbox = self.mailbox
+        start = INDEX[r][c]
+        if player == "white":
+            sign, forward, home_row = 1, -WIDTH, 6
+        else:
+            sign, forward, home_row = -1, WIDTH, 1
+
+        dests = []
+        if mailbox[start + forward] == EMPTY:  # jump forward if clear
+            dests.append(SQUARE[start + forward])
+            if r == home_row and mailbox[start + 2 * forward] == EMPTY:
+                dests.append(SQUARE[start + 2 * forward])
+        for side in [-1, 1]:  # captures
+            code = mailbox[start + forward + side]
+            if code != OFFBOARD and code * sign < 0:
+                dests.append(SQUARE[start + forward + side])
+        return dests
+
+    def get_dests_for_piece(self, r: int, c: int, piece=None) -> Sequence[Tuple[int, int]]:
+        """Given a particular piece, generates all possible destinations for it to move to.
+        piece: optional param to override piece at board location
+        Returns [(r,c),...]. """
+        if piece is None:
+            piece = self._piece_at(r, c)
+        player = "black" if piece.islower() else "white"
+
+        piece_type = piece.lower()
+        if piece_type == "p":
+            return self._get_pawn_dests(r, c, player)
+        elif piece_type == "r":
+            return self._get_sliding_dests(r, c, player, ROOK_OFFSETS)
+        elif piece_type == "n":
+            return self._get_jumping_dests(r, c, player, KNIGHT_OFFSETS)
+        elif piece_type == "b":
+            return self._get_sliding_dests(r, c, player, BISHOP_OFFSETS)
+        elif piece_type == "q":
+            return self._get_sliding_dests(r, c, player, QUEEN_OFFSETS)
+        elif piece_type == "k":
+            return self._get_jumping_dests(r, c, player, KING_OFFSETS)
+        else:
+            raise ValueError("Unknown piece! {}".format(piece))
+
+    def _get_castle_moves(self, player: str) -> Sequence[Move]:
+        """Returns any castle moves available to the current player.
+        Same rules as ChessBoard._get_castle_moves, checked on the mailbox."""
+        moves = []
+        mailbox = self.mailbox
+        if player == "white":
+            row, sign, left, right = 7, 1, W_CASTLE_LEFT, W_CASTLE_RIGHT
+            left_flag, right_flag = self.w_castle_left_flag, self.w_castle_right_flag
+        else:
+            row, sign, left, right = 0, -1, B_CASTLE_LEFT, B_CASTLE_RIGHT
+            left_flag, right_flag = self.b_castle_left_flag, self.b_castle_right_flag
+        king, rook = sign * CODES["K"], sign * CODES["R"]
+        squares = INDEX[row]
+
+        if mailbox[squares[4]] != king:
+            return moves
+        if left_flag and mailbox[squares[0]] == rook \
+                and mailbox[squares[1]] == mailbox[squares[2]] == mailbox[squares[3]] == EMPTY:
+            moves.append(Move(row, 4, row, 2, PIECES[king], special=left))
+        if right_flag and mailbox[squares[7]] == rook \
+                and mailbox[squares[5]] == mailbox[squares[6]] == EMPTY:
+            moves.append(Move(row, 4, row, 6, PIECES[king], special=right))
+        return moves
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""Cheap move ordering for the search: sorts a node's moves without playing any of them.
+
+Alpha-beta prunes the most when the best move is searched first, but scoring every child with
+do_move / eval_fn / undo_move roughly doubles the work at each node. Instead moves are ranked by:
+    0. the hash move: the best move found by a previous (shallower) search of the position,
+       from the transposition table or the previous iteration's principal variation
+    1. captures (and promotions), most valuable victim first, then least valuable attacker (MVV-LVA)
+    2. the two killer moves of this ply: quiet moves that caused a beta cutoff in a sibling node
+    3. every other quiet move by its history score: how often, and how deep, it has caused
+       a cutoff anywhere in the tree (the "butterfly" table, indexed by side, from and to square)
+
+The game supplies the two game specific bits on its board:
+    board.capture_score(move) -> int  # MVV-LVA score of a capture or promotion, 0 for a quiet move
+    board.move_index(move) -> int  # same for the same from and to squares, e.g. from * 64 + to. < 4096
+
+Ties are broken by move_index, so the order doesn't depend on the order the board generated the
+moves in (e.g. iterating a set), and a search visits the same nodes every run.
+"""
+
+from collections import Counter
+from typing import List, Optional
+
+MAX_PLY = 128  # killer slots preallocated, grown if a search goes deeper
+CAPTURE_BASE = 1 << 40  # above any killer or history score
+KILLER_BASE = 1 << 39  # above any history score
+
+
+class MoveOrdering(object):
+    """Killer moves and history scores learned from the beta cutoffs of a search.
+    Both are keyed by board.move_index(move), so they carry over between sibling positions
+    where the move object itself might differ (e.g. a different piece captured)."""
+
+    def __init__(self, max_ply: int = MAX_PLY):
+        self.killers: List[List[int]] = [[None, None] for _ in range(max_ply)]
+        self.history = Counter()  # (turn, move index) -> sum of depth^2 of its cutoffs
+
+    def order(self, board, moves: List, ply: int, hash_move=None) -> List:
+        """Sorts moves in place, most promising first, and returns them.
+        ply: distance from the root of the search, for the killer slots
+        hash_move: searched first if it's one of moves"""
+        killer_1, killer_2 = self.killers[ply] if ply < len(self.killers) else (None, None)
+        history = self.history
+        turn = board.turn
+        capture_score, move_index = board.capture_score, board.move_index
+
+        def key(move):
+            index = move_index(move)
+            capture = capture_score(move)
+            if capture:
+                return (CAPTURE_BASE + capture) << 12 | index
+            if index == killer_1:
+                return (KILLER_BASE + 1) << 12 | index
+            if index == killer_2:
+                return KILLER_BASE << 12 | index
+            return history[turn, index] << 12 | index
+
+        moves.sort(key=key, reverse=True)
+        if hash_move is not None and hash_move in moves:  # `in` as it could be from a colliding position
+            moves.remove(hash_move)
+            moves.insert(0, hash_move)
+        return moves
+
+    def cutoff(self, board, move, depth: int, ply: int) -> None:
+        """Records that move caused a beta cutoff, depth plies from the leaves and ply from the root.
+        Only quiet moves are learned: captures are already ranked first by MVV-LVA."""
+        if board.capture_score(move):
+            return
+        index = board.move_index(move)
+        while ply >= len(self.killers):
+            self.killers.extend([None, None] for _ in range(len(self.killers)))
+        killers = self.killers[ply]
+        if killers[0] != index:
+            killers[1] = killers[0]
+            killers[0] = index
+        self.history[board.turn, index] += depth * depth
+
+    def new_search(self) -> None:
+        """Call before searching a new root position. Killers are specific to the old tree's plies,
+        so they're dropped, and the history is halved so the new search's cutoffs soon dominate."""
+        for killers in self.killers:
+            killers[0] = killers[1] = None
+        for key in list(self.history):
+            self.history[key] >>= 1
+            if not self.history[key]:
+                del self.history[key]
+
+    def clear(self) -> None:
+        """Forgets everything"""
+        self.__init__(len(self.killers))
+
+
+class PrincipalVariationTable(object):
+    """Triangular table of principal variations, the line of best play the search expects.
+    lines[ply] is the best line found from ply onwards in the current branch. It's built bottom up:
+    a node's line is its best move followed by that child's line, so the root ends up with the whole
+    PV. The last completed search's PV is kept by position hash, to be searched first next iteration
+    even if the transposition table has lost those entries."""
+
+    def __init__(self, max_ply: int = MAX_PLY):
+        self.lines: List[List] = [[] for _ in range(max_ply)]
+        self.previous = {}  # board.hash -> move, along the previous iteration's PV
+
+    def clear(self, ply: int) -> None:
+        """Empties a node's line, before searching it"""
+        while ply + 1 >= len(self.lines):
+            self.lines.extend([] for _ in range(len(self.lines)))
+        self.lines[ply] = []
+
+    def update(self, ply: int, move, line: Optional[List] = None) -> None:
+        """Sets a node's line to move, followed by line (default the line of the child at ply + 1)"""
+        self.lines[ply] = [move] + (self.lines[ply + 1] if line is None else line)
+
+    def follow(self, board, pv: List) -> None:
+        """Remembers the best move of each position along pv, played from board's current position"""
+        self.previous = {}
+        for move in pv:
+            self.previous[board.hash] = move
+            board.do_move(move)
+        for _ in pv:
+            board.undo_move()
+
+    def move(self, board):
+        """The previous iteration's best move in this position, or None if it's off the PV"""
+        return self.previous.get(board.hash)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""Parallel search of one position over several processes.
+
+Lazy SMP: every worker runs its own iterative deepening of the same root, and the only thing
+they share is the transposition table (a SharedTranspositionTable). What one worker stores, the
+others find as hash moves and cutoffs, so between them they skip work none of them would alone.
+To keep them from all searching the same tree in lockstep, every other worker starts a ply
+deeper than the rest. Once the first worker finishes (its last depth, or out of time) the others
+are told to stop, and the deepest completed search wins.
+https://www.chessprogramming.org/Lazy_SMP
+
+Root splitting: the first root move (the best, if the ordering is right) is searched alone to
+get a score to beat, then the rest are spread over a process pool. Each is only searched with a
+null window to prove it can't beat the best score so far, which the workers read from shared
+memory as they start each move, so every result that improves it narrows the later searches.
+Workers are sent the position in compact form (ChessBoard.compact), not the whole board.
+https://www.chessprogramming.org/Parallel_Search
+"""
+
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Pool, RawValue, cpu_count
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import search
+from chessboard import ChessBoard, encode_move, decode_move
+from search import minmax, iterative_deepening, DEPTH_STATS, SEARCH_STATS, MOVE_ORDERING, PV_TABLE
+from time_manager import TimeManager
+from transposition import SharedTranspositionTable, EXACT
+
+WORKER_STATS: List[Dict[str, float]] = []
+# One dict per worker of the last lazy_smp: worker, start_depth, depth (deepest completed), nodes, seconds.
+
+
+class StoppableTimeManager(TimeManager):
+    """TimeManager that also aborts once another process sets the shared stop flag"""
+
+    # the other processes change the result anyway, and the shared table mustn't be wiped to try
+    reproducible = False
+
+    def __init__(self, budget: float, hard_limit: Optional[float] = None, max_nodes: Optional[int] = None,
+                 stop=None):
+        super().__init__(budget, hard_limit, max_nodes)
+        self.stop = stop
+
+    def out_of_time(self) -> bool:
+        if self.stop.value and self.abortable:
+            self.aborted = True
+        return super().out_of_time()
+
+
+# each worker process attaches to the shared table once, see lazy_smp
+_stop = None
+
+
+def _init_worker(table_name: str, size_mb: float, stop) -> None:
+    global _stop
+    _stop = stop
+    search.TRANSPOSITION_TABLE = SharedTranspositionTable(size_mb, table_name, encode=encode_move)
+
+
+def _search_root(job) -> Dict:
+    """Worker side of lazy_smp: iterative deepening until it's done or told to stop.
+    Returns its stats, with the score and the packed moves of its deepest completed search"""
+    worker, board, eval_fn, max_depth, start_depth, limits, params = job
+    search.TRANSPOSITION_TABLE.decode = functools.partial(decode_move, board=board)
+    SEARCH_STATS.clear()
+    t0 = time.time()
+    time_manager = StoppableTimeManager(*limits, stop=_stop)
+    score, move, pv = iterative_deepening(board, eval_fn, max_depth, params=params,
+                                          time_manager=time_manager, start_depth=start_depth)
+    _stop.value = 1
+    return {"worker": worker, "start_depth": start_depth, "depth": DEPTH_STATS[-1]["depth"] if DEPTH_STATS else -1,
+            "nodes": SEARCH_STATS["nodes"], "seconds": time.time() - t0,
+            "score": score, "pv": [encode_move(m) for m in pv]}
+
+
+def lazy_smp(board: ChessBoard, eval_fn, max_depth: int, workers: Optional[int] = None, max_t: float = 10.0,
+             params: Dict = {}, time_manager: Optional[TimeManager] = None, size_mb: float = 16):
+    """Searches board with iterative deepening on workers processes (default one per core),
+    sharing a transposition table of size_mb. Each worker gets the time (or nodes) of time_manager
+    (default max_t seconds), see iterative_deepening.
+    WORKER_STATS is filled with each worker's deepest completed depth, nodes and seconds.
+    Returns: (score, move, pv) of the deepest completed search, the first worker's on a tie"""
+    if workers is None:
+        workers = cpu_count()
+    if time_manager is None:
+        time_manager = TimeManager(max_t)
+    table = SharedTranspositionTable(size_mb, encode=encode_move)
+    stop = RawValue("b", 0)
+    jobs = [(worker, board, eval_fn, max_depth, min(1 + worker % 2, max_depth),
+             (time_manager.budget, time_manager.hard_limit, time_manager.max_nodes), params)
+            for worker in range(workers)]
+    try:
+        with Pool(workers, initializer=_init_worker, initargs=(table.name, size_mb, stop)) as pool:
+            results = pool.map(_search_root, jobs)
+    finally:
+        table.close()
+
+    WORKER_STATS[:] = [{key: result[key] for key in ("worker", "start_depth", "depth", "nodes", "seconds")}
+                       for result in results]
+    best = max(results, key=lambda result: (result["depth"], -result["worker"]))
+    pv = []
+    for code in best["pv"]:  # unpacked in the positions along the line
+        pv.append(decode_move(code, board))
+        board.do_move(pv[-1])
+    for _ in pv:
+        board.undo_move()
+    return best["score"], pv[0] if pv else None, pv
+
+
+# the best root score so far, shared with every root_split worker
+_bound = None
+
+
+def _init_root_worker(bound) -> None:
+    global _bound
+    _bound = bound
+
+
+def _search_root_move(job) -> Dict:
+    """Worker side of root_split: does one root move on the compact root position, and searches it
+    with a null window against the best score so far. Only if it beats (or ties) that is it
+    searched again with the window open on that side, to get its actual score.
+    Returns its score, whether that's exact or only a bound, its packed PV and the nodes searched"""
+    board_cls, state, code, eval_fn, max_depth, params = job
+    board = board_cls.from_compact(state)
+    direction = 1.0 if board.turn == "white" else -1.0
+    board.do_move(decode_move(code, board))
+    time_discount = params.get("time_discount", 0.95)
+    nodes = SEARCH_STATS["nodes"]
+    bound = _bound.value
+    # ties are searched too, so the move ordered first can be preferred whatever order the results come in
+    alpha, beta = (bound - 1, bound) if direction > 0 else (bound, bound + 1)
+    score, _, pv = minmax(board, eval_fn, max_depth - 1, alpha / time_discount, beta / time_discount, params, 1)
+    exact = (score >= bound) if direction > 0 else (score <= bound)
+    if exact:
+        alpha, beta = (bound - 1, np.inf) if direction > 0 else (-np.inf, bound + 1)
+        score, _, pv = minmax(board, eval_fn, max_depth - 1, alpha / time_discount, beta / time_discount, params, 1)
+    return {"score": score, "exact": exact, "pv": [encode_move(m) for m in pv],
+            "nodes": SEARCH_STATS["nodes"] - nodes}
+
+
+def root_split(board: ChessBoard, eval_fn, max_depth: int, workers: Optional[int] = None, params: Dict = {}):
+    """minmax of board to max_depth, with the root moves after the first searched on workers processes
+    (default one per core). Each worker has its own transposition table, copied from this process's.
+    Ties go to the move ordered first, so the result doesn't depend on the order the workers finish in.
+    Returns: (score, move, pv) like minmax"""
+    if workers is None:
+        workers = cpu_count()
+    if max_depth < 2:
+        return minmax(board, eval_fn, max_depth, params=params)
+    direction = 1.0 if board.turn == "white" else -1.0
+    time_discount = params.get("time_discount", 0.95)
+
+    all_moves = board.moves()
+    if not all_moves:
+        return minmax(board, eval_fn, max_depth, params=params)
+    entry = search.TRANSPOSITION_TABLE.probe(board.hash)
+    hash_move = entry[3] if entry is not None else PV_TABLE.move(board)
+    if hash_move is None:  # internal iterative deepening, as in minmax
+        _, hash_move, _ = minmax(board, eval_fn, max_depth - 2, params=params)
+    MOVE_ORDERING.order(board, all_moves, 0, hash_move)
+
+    # the first move alone, with a full window
+    board.do_move(all_moves[0])
+    best_score, _, line = minmax(board, eval_fn, max_depth - 1, params=params, ply=1)
+    board.undo_move()
+    best = (0, best_score, [all_moves[0]] + line)
+
+    bound = RawValue("d", best_score)
+    state = board.compact()
+    with ProcessPoolExecutor(workers, initializer=_init_root_worker, initargs=(bound,)) as pool:
+        futures = {pool.submit(_search_root_move, (type(board), state, encode_move(move), eval_fn, max_depth, params)): i
+                   for i, move in enumerate(all_moves[1:], start=1)}
+        for future in as_completed(futures):
+            i, result = futures[future], future.result()
+            SEARCH_STATS["nodes"] += result["nodes"]
+            if not result["exact"]:
+                continue
+            score = result["score"]
+            if score * direction > best[1] * direction or (score == best[1] and i < best[0]):
+                board.do_move(all_moves[i])
+                pv = [all_moves[i]]
+                for code in result["pv"]:  # unpacked in the positions along the line
+                    pv.append(decode_move(code, board))
+                    board.do_move(pv[-1])
+                for _ in pv:
+                    board.undo_move()
+                best = (i, score, pv)
+                bound.value = score
+
+    _, best_score, pv = best
+    search.TRANSPOSITION_TABLE.store(board.hash, max_depth, EXACT, best_score, pv[0])
+    return int(best_score * time_discount), pv[0], pv
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""Perft: counts the leaf nodes of the legal move tree to a fixed depth.
+
+The counts for well known positions are published, so any mismatch points straight at a move
+generation bug, and the time taken is a benchmark of move generation alone (no eval or pruning).
+https://www.chessprogramming.org/Perft_Results
+
+Usage:
+    python perft.py                           # every reference position, checked against the known counts
+    python perft.py --position kiwipete --depth 3 --divide
+    python perft.py --fen "8/8/8/8/8/8/8/K6k w - - 0 1" --depth 4 --board bitboard
+    python perft.py --position kiwipete --depth 5 --workers 8 --cache-mb 64
+"""
+
+import argparse
+import os
+import time
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type
+
+from chessboard import ChessBoard
+from hash_cache import HashCache
+from chess import BOARD_BACKENDS
+
+
+class PerftPosition(NamedTuple):
+    fen: str
+    counts: List[int]  # expected leaf nodes at depth 1, 2, ...
+
+
+# https://www.chessprogramming.org/Perft_Results
+PERFT_POSITIONS: Dict[str, PerftPosition] = {
+    "start": PerftPosition(
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609]),
+    "kiwipete": PerftPosition(
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603]),
+    "position3": PerftPosition(
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624]),
+    "position4": PerftPosition(
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333]),
+    "position5": PerftPosition(
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487]),
+    "position6": PerftPosition(
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594]),
+}
+
+
+def perft(board: ChessBoard, depth: int, cache: Optional[HashCache] = None) -> int:
+    """Number of leaf nodes depth plies below the board's position.
+    Bulk counts the last ply: the number of moves is the number of leaves, no need to play them.
+    cache: optional HashCache("Q") to reuse the counts of transposed subtrees. The count below a
+    position only depends on the depth, which is stored as the check (perft never stores depth 0)."""
+    if depth == 0:
+        return 1
+    if cache is not None:
+        nodes = cache.probe(board.hash, depth)
+        if nodes is not None:
+            return nodes
+    moves = board.moves()
+    if depth == 1:
+        if cache is not None:  # counting the moves is the expensive part, so cache those too
+            cache.store(board.hash, depth, len(moves))
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.do_move(move)
+        nodes += perft(board, depth - 1, cache)
+        board.undo_move()
+    if cache is not None:
+        cache.store(board.hash, depth, nodes)
+    return nodes
+
+
+def divide(board: ChessBoard, depth: int, cache: Optional[HashCache] = None) -> Dict[str, int]:
+    """Perft split up by root move, the standard way to narrow down a wrong count:
+    compare against another engine's divide and recurse into the move that disagrees.
+    Returns {move in long algebraic notation, e.g. "e2e4" or "a7a8q": leaf nodes}"""
+    counts = {}
+    for move in board.moves():
+        board.do_move(move)
+        counts[move_name(move)] = perft(board, depth - 1, cache)
+        board.undo_move()
+    return counts
+
+
+# each worker process keeps one cache for all the root moves it's handed, see parallel_divide
+_worker_cache: Optional[HashCache] = None
+
+
+def _init_worker(cache_mb: float) -> None:
+    global _worker_cache
+    _worker_cache = HashCache(cache_mb, "Q") if cache_mb > 0 else None
+
+
+def _count_root_move(job: Tuple[ChessBoard, object, int]) -> Tuple[str, int, float, int, int, int]:
+    """Worker side of parallel_divide: counts one root move's subtree.
+    Returns (move name, nodes, seconds, worker pid, cache probes, cache hits) so far in this worker"""
+    board, move, depth = job
+    t0 = time.time()
+    board.do_move(move)
+    nodes = perft(board, depth - 1, _worker_cache)
+    probes, hits = (_worker_cache.probes, _worker_cache.hits) if _worker_cache is not None else (0, 0)
+    return move_name(move), nodes, time.time() - t0, os.getpid(), probes, hits
+
+
+def parallel_divide(board: ChessBoard, depth: int, workers: Optional[int] = None, cache_mb: float = 0
+                    ) -> Tuple[Dict[str, int], Dict[int, Dict[str, float]]]:
+    """divide(), with the root moves spread over a pool of worker processes. Each worker has its
+    own HashCache of cache_mb (0 for none), so the counts are exactly the same as perft's.
+    Returns (counts per root move, stats per worker pid: nodes, seconds, nodes/s, cache probes, hits)"""
+    if workers is None:
+        workers = cpu_count()
+    jobs = [(board, move, depth) for move in board.moves()]
+    counts = {}
+    stats: Dict[int, Dict[str, float]] = defaultdict(lambda: {"nodes": 0, "seconds": 0.0, "probes": 0, "hits": 0})
+    with Pool(workers, initializer=_init_worker, initargs=(cache_mb,)) as pool:
+        for name, nodes, seconds, pid, probes, hits in pool.imap_unordered(_count_root_move, jobs):
+            counts[name] = nodes
+            worker = stats[pid]
+            worker["nodes"] += nodes
+            worker["seconds"] += seconds
+            worker["probes"], worker["hits"] = probes, hits  # running totals, the last report wins
+    for worker in stats.values():
+        worker["nodes/s"] = worker["nodes"] / max(worker["seconds"], 1e-9)
+    return counts, dict(stats)
+
+
+def move_name(move) -> str:
+    """Long algebraic notation for a move: from square, to square and any promotion piece"""
+    def square(r, c):
+        return "abcdefgh"[c] + str(8 - r)
+    promotion = move.special if move.special in ("q", "r", "b", "n") else ""
+    return square(move.r_from, move.c_from) + square(move.r_to, move.c_to) + promotion
+
+
+def time_perft(board: ChessBoard, depth: int) -> Tuple[int, float]:
+    """Runs perft, returning (nodes, seconds)"""
+    t0 = time.time()
+    nodes = perft(board, depth)
+    return nodes, time.time() - t0
+
+
+def run_suite(board_cls: Type[ChessBoard], max_depth: int) -> bool:
+    """Checks every reference position up to max_depth, printing counts and nodes/sec.
+    Returns True if all counts match."""
+    all_ok = True
+    for name, position in PERFT_POSITIONS.items():
+        board = board_cls.from_fen(position.fen, promotions="qnrb")
+        for depth, expected in enumerate(position.counts[:max_depth], start=1):
+            nodes, t = time_perft(board, depth)
+            ok = nodes == expected
+            all_ok &= ok
+            print("{:>10} depth {}: {:>9} nodes {:>8.0f} nodes/s {}".format(
+                name, depth, nodes, nodes / max(t, 1e-9), "ok" if ok else "FAIL, expected {}".format(expected)))
+    return all_ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count (and time) the legal move tree")
+    parser.add_argument("--board", default="array", choices=sorted(BOARD_BACKENDS), help="board backend")
+    parser.add_argument("--depth", type=int, default=3, help="plies to search")
+    parser.add_argument("--position", choices=sorted(PERFT_POSITIONS), help="reference position to count")
+    parser.add_argument("--fen", help="any other position to count")
+    parser.add_argument("--divide", action="store_true", help="print the count below each root move")
+    parser.add_argument("--workers", type=int, default=1, help="split the root moves over this many processes")
+    parser.add_argument("--cache-mb", type=float, default=0, help="memory for caching subtree counts, 0 for none")
+    args = parser.parse_args()
+    board_cls = BOARD_BACKENDS[args.board]
+
+    if args.position is None and args.fen is None:
+        raise SystemExit(0 if run_suite(board_cls, args.depth) else 1)
+
+    fen = args.fen if args.fen is not None else PERFT_POSITIONS[args.position].fen
+    board = board_cls.from_fen(fen, promotions="qnrb")
+    t0 = time.time()
+    if args.workers > 1:
+        counts, workers = parallel_divide(board, args.depth, args.workers, args.cache_mb)
+        nodes = sum(counts.values())
+        for pid, worker in sorted(workers.items()):
+            print("worker {}: {} nodes in {:.2f}s, {:.0f} nodes/s, cache hit rate {:.1%}".format(
+                pid, worker["nodes"], worker["seconds"], worker["nodes/s"],
+                worker["hits"] / worker["probes"] if worker["probes"] else 0))
+    else:
+        cache = HashCache(args.cache_mb, "Q") if args.cache_mb > 0 else None
+        counts = divide(board, args.depth, cache)
+        nodes = sum(counts.values())
+        if cache is not None:
+            print("cache hit rate {:.1%} of {} probes".format(cache.hits / max(cache.probes, 1), cache.probes))
+    if args.divide:
+        for move, count in sorted(counts.items()):
+            print("{}: {}".format(move, count))
+    t = time.time() - t0
+    print("depth {}: {} nodes in {:.2f}s, {:.0f} nodes/s".format(args.depth, nodes, t, nodes / max(t, 1e-9)))
+    if args.position is not None and args.depth <= len(PERFT_POSITIONS[args.position].counts):
+        expected = PERFT_POSITIONS[args.position].counts[args.depth - 1]
+        print("ok" if nodes == expected else "FAIL, expected {}".format(expected))
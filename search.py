@@ -2,31 +2,115 @@
 
 import numpy as np
 import time
+from collections import Counter
 
-TRANSPOSITION_TABLE = {}
-# Maps (board+depth) -> score to avoid repeated work and improve move ordering
-# key: str(board.board.flatten()) + depth
+from move_ordering import MoveOrdering, PrincipalVariationTable
+from time_manager import TimeManager
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
 
+TRANSPOSITION_TABLE = TranspositionTable(size_mb=16)
+# Maps board.hash -> (depth, bound, score, move) to avoid repeated work.
+# Fixed size, so replace it with a TranspositionTable(size_mb=...) to change the memory budget.
 
-def iterative_deepening(board, eval_fn, max_depth, max_t=10.0):
+MOVE_ORDERING = MoveOrdering()
+# Killer moves and history scores, learned from the beta cutoffs of the search.
+
+PV_TABLE = PrincipalVariationTable()
+# The best line found below each ply, and the previous iteration's line to search first.
+
+SEARCH_STATS = Counter()
+# Counts of search events, i.e. "nodes" visited. Never reset by the search itself,
+# call SEARCH_STATS.clear() before a measurement.
+
+DEPTH_STATS = []
+# One dict per iteration of the last iterative_deepening: depth, nodes, researches, seconds, score.
+
+
+def reset_search_state():
+    """Clears the transposition table, move ordering and SEARCH_STATS, so the next search
+    neither reuses what earlier ones learned nor adds to their counts"""
+    TRANSPOSITION_TABLE.clear()
+    MOVE_ORDERING.clear()
+    SEARCH_STATS.clear()
+
+
+def iterative_deepening(board, eval_fn, max_depth, max_t=10.0, params={}, time_manager=None, max_nodes=None,
+                        start_depth=0):
     """Iteratively calls minmax with higher depths.
-    1. this allows us to gracefully add a time limit.
-    2. NOTE: should fill up the transposition table for better move ordering,
-    but using that for move ordering doesn't seem to be better than the straight eval_fn
+    1. this allows us to gracefully add a time limit: a TimeManager (default: max_t seconds) predicts
+    whether the next depth will finish in time before starting it, and aborts it if it's still
+    running at the hard limit. Depth 1 always completes, after that an aborted depth's results
+    are thrown away and the last completed depth's are returned.
+    With max_nodes (or TimeManager.from_nodes) the clock is ignored, and the search stops after
+    exactly that many nodes (unless depth 1 alone takes more). The transposition table, move
+    ordering and PV tables are cleared first, so nothing from earlier searches carries over and
+    the same position and params always give the same result, for reproducible benchmarks.
+    2. each iteration's best moves (in the transposition table, and its principal variation)
+    are searched first by the next, so the deeper search prunes much more.
+    3. a previous iteration's score is a good guess for the next one's, so it's searched with an
+    aspiration window of params["aspiration_window"] (default 100, 0 for off) either side of it.
+    If the score lands outside, the window is widened on that side and the depth searched again.
 
-    Returns: (score, move)
+    start_depth: the first depth searched, e.g. for a helper of a parallel search to stay a ply ahead.
+    DEPTH_STATS is filled with the nodes, researches, seconds and score of each completed iteration.
+    Returns: (score, move, pv)
     """
-    t0 = time.time()
-    score, move = None, None
-    for depth in range(max_depth + 1):
-        tot_t = time.time() - t0
-        if tot_t > max_t:
+    if time_manager is None:
+        time_manager = TimeManager(max_t) if max_nodes is None else TimeManager.from_nodes(max_nodes)
+    time_manager.start()
+    if time_manager.reproducible:
+        TRANSPOSITION_TABLE.clear()
+        MOVE_ORDERING.clear()
+    TRANSPOSITION_TABLE.new_search()
+    MOVE_ORDERING.new_search()
+    PV_TABLE.follow(board, [])
+    DEPTH_STATS.clear()
+    time_discount = params.get("time_discount", 0.95)
+    window = params.get("aspiration_window", 100)
+    params = dict(params, time_manager=time_manager)  # counts every node, even before it can abort
+    score, move, pv = None, None, []
+    for depth in range(start_depth, max_depth + 1):
+        if not time_manager.should_start(DEPTH_STATS):
+            break
+        nodes, t_depth = SEARCH_STATS["nodes"], time.time()
+        time_manager.abortable = move is not None
+
+        # without a quiescence search scores swing between odd and even depths (whoever moved last
+        # looks better), so the guess is the score from two iterations ago, with the same side to move last
+        guesses = [stats["score"] for stats in DEPTH_STATS if stats["depth"] == depth - 2]
+        if depth < 3 or not window or not guesses:
+            alpha, beta = -np.inf, np.inf
+        else:
+            alpha, beta = guesses[0] - window, guesses[0] + window
+        delta = window
+        researches = 0
+        while True:
+            # minmax returns the root's score discounted, so scale the window like a parent would
+            result = minmax(board, eval_fn, depth, alpha / time_discount, beta / time_discount, params)
+            if time_manager.aborted:
+                break
+            if result[0] <= alpha:  # failed low, the true score is at or below the window
+                alpha -= delta
+            elif result[0] >= beta:  # failed high
+                beta += delta
+            else:
+                break
+            researches += 1
+            delta *= 4
+            if researches >= 3:  # still way off, stop guessing
+                alpha, beta = -np.inf, np.inf
+
+        if time_manager.aborted:
+            SEARCH_STATS["aborted_iterations"] += 1
             break
-        score, move = minmax(board, eval_fn, depth)
-    return score, move
+        score, move, pv = result
+        PV_TABLE.follow(board, pv)
+        DEPTH_STATS.append({"depth": depth, "nodes": SEARCH_STATS["nodes"] - nodes, "researches": researches,
+                            "seconds": time.time() - t_depth, "score": score})
+    return score, move, pv
 
 
-def minmax(board, eval_fn, max_depth, alpha=-np.inf, beta=np.inf, params={}):
+def minmax(board, eval_fn, max_depth, alpha=-np.inf, beta=np.inf, params={}, ply=0):
     """Finds the best move using MinMax and AlphaBeta pruning.
     Hopefully this function can be used across many different games!
 
@@ -34,8 +118,14 @@ def minmax(board, eval_fn, max_depth, alpha=-np.inf, beta=np.inf, params={}):
         [...] = board.moves()
         board.do_move(move)
         board.undo_move()
+        board.hash  # int that's equal for equal positions (incl. whose turn it is)
+        board.capture_score(move), board.move_index(move)  # for move ordering, see move_ordering.py
+        board.null_move_allowed(), board.do_null_move(), board.undo_null_move()  # only for params["null_move"]
+        board.in_check()  # only for params["lmr"], ["futility_margins"] and ["razor_margins"]
     eval_fn: a function that transforms a board into a score
-        score, over = eval_fn(board)
+        score, over = eval_fn(board, params, alpha, beta)
+        params["no_moves"] is set when board.moves() is empty, so it can score the end of the game
+        alpha and beta are the node's window: a score far enough outside it only needs to be roughly right
     max_depth: how many more layers to search.
     alpha:  worst possible score for "x" = -inf
     beta:   worst possible score for "o" = +inf
@@ -43,64 +133,188 @@ def minmax(board, eval_fn, max_depth, alpha=-np.inf, beta=np.inf, params={}):
         time_discount: how much to discount each turn
         explore_ratio: fraction of possible moves to explore
         min_branches: overrides explore_ratio in case there are few branches
+        eval_ordering: sort moves by calling eval_fn after each one (slow), rather than MOVE_ORDERING
+        iid_min_depth: depth from which a node without a hash move runs a shallower search to find one
+        pvs: principal variation search, searching all but the first move with a null window (default True)
+        null_move: depth reduction R for null move pruning, 0 for off (default)
+        lmr: number of moves searched at full depth before late quiet moves are reduced a ply, 0 for off (default)
+        futility_margins: [margin at depth 1, margin at depth 2, ...] for futility pruning, off if empty (default)
+        razor_margins: [margin at depth 1, ...] for razoring, off if empty (default)
+        time_manager: TimeManager to check (and count nodes with) as the search goes, see iterative_deepening.
+            Once it's out of time or nodes every node returns straight away, and the results are meaningless.
         ... others passed on to eval_fn
+    ply: how many moves deep from the root this call is
 
-    returns: (score, move) the expected score down that path.
+    returns: (score, move, pv) the expected score down the principal variation: the list of moves
+        both players are expected to make, starting with move.
     """
 
     TIME_DISCOUNT = params.get("time_discount", 0.95)
+    PV_TABLE.clear(ply)
+    time_manager = params.get("time_manager")
+    if time_manager is not None and time_manager.out_of_time():
+        return 0, None, []
+    SEARCH_STATS["nodes"] += 1
 
     # base cases
-    score, done = eval_fn(board, params)
+    score, done = eval_fn(board, params, alpha, beta)
     if done or max_depth == 0:
-        return score, None
+        return score, None, []
+    static_score = score  # cheap (the board keeps running totals), and good enough to prune with near the leaves
+
+    # reuse a previous search of this position if it was deep enough and its bound is good enough
+    entry = TRANSPOSITION_TABLE.probe(board.hash)
+    hash_move = None
+    if entry is not None:
+        tt_depth, tt_bound, tt_score, tt_move = entry
+        if tt_depth >= max_depth and (
+                tt_bound == EXACT
+                or (tt_bound == LOWER and tt_score >= beta)
+                or (tt_bound == UPPER and tt_score <= alpha)):
+            SEARCH_STATS["tt_cutoffs"] += 1
+            if tt_move is not None:
+                PV_TABLE.update(ply, tt_move, [])  # the rest of the line wasn't stored
+            return int(tt_score * TIME_DISCOUNT), tt_move, PV_TABLE.lines[ply]
+        hash_move = tt_move
+    if hash_move is None:
+        hash_move = PV_TABLE.move(board)
+    alpha_orig, beta_orig = alpha, beta
 
     # are we maxing or mining?
     direction = 1.0 if board.turn in ["x", "white"] else -1.0  # TODO: make turn binary?
 
+    # null move pruning: let the opponent move twice in a row. If a shallower search still says we're
+    # too good for the parent to allow (beats beta for max), any real move would be too, so skip them all
+    null_r = params.get("null_move", 0)
+    if null_r and ply > 0 and max_depth > null_r \
+            and (beta < np.inf if direction > 0 else alpha > -np.inf) and board.null_move_allowed():
+        null_alpha, null_beta = (beta - 1, beta) if direction > 0 else (alpha, alpha + 1)
+        board.do_null_move()
+        score, _, _ = minmax(board, eval_fn, max_depth - 1 - null_r,
+                             null_alpha / TIME_DISCOUNT, null_beta / TIME_DISCOUNT, params, ply + 1)
+        board.undo_null_move()
+        if time_manager is not None and time_manager.aborted:
+            return 0, None, []
+        if (score >= beta) if direction > 0 else (score <= alpha):
+            SEARCH_STATS["null_move_cutoffs"] += 1
+            return int(score * TIME_DISCOUNT), None, []
+
+    # near the leaves, a node whose static score is far below alpha (above beta for min) will rarely
+    # recover. The margins are how far a move or two could plausibly swing the score back at each depth
+    futility_margins = params.get("futility_margins")
+    razor_margins = params.get("razor_margins")
+    futile = False
+    if (futility_margins and max_depth <= len(futility_margins)) \
+            or (razor_margins and max_depth <= len(razor_margins)):
+        in_check = board.in_check()
+
+        # razoring: search it a ply shallower, at the last ply that's just the static score
+        if razor_margins and ply > 0 and max_depth <= len(razor_margins) and not in_check:
+            margin = razor_margins[max_depth - 1]
+            if (static_score + margin <= alpha) if direction > 0 else (static_score - margin >= beta):
+                SEARCH_STATS["razored"] += 1
+                max_depth -= 1
+                if max_depth == 0:
+                    return static_score, None, []
+
+        # futility pruning: skip the quiet moves, only captures and promotions could make up the difference
+        if futility_margins and ply > 0 and max_depth <= len(futility_margins) and not in_check:
+            margin = futility_margins[max_depth - 1]
+            futile = (static_score + margin <= alpha) if direction > 0 else (static_score - margin >= beta)
+
     # loop!
     best_move = None
     best_score = -np.inf * direction
 
     all_moves = board.moves()
+    if not all_moves:  # game over, but only the eval knows if it's a loss (checkmate) or a draw (stalemate)
+        score, _ = eval_fn(board, dict(params, no_moves=True))
+        return score, None, []
 
     # order these nicely to improve alpha beta pruning
-    def score_move_heuristic(move):
-        board.do_move(move)
-        score, _ = eval_fn(board, params)
-        board.undo_move()
-        return score
-    all_moves.sort(key=score_move_heuristic, reverse=(board.turn in ["white", "x"]))  # TODO: generalize white / x to any game
+    if params.get("eval_ordering", False):
+        def score_move_heuristic(move):
+            board.do_move(move)
+            score, _ = eval_fn(board, params)
+            board.undo_move()
+            return score
+        all_moves.sort(key=score_move_heuristic, reverse=(board.turn in ["white", "x"]))  # TODO: generalize white / x to any game
 
-    # we've already sorted, just return now (10% speedup)
-    if max_depth == 1:
-        move = all_moves[0]
-        board.do_move(move)
-        score, _ = eval_fn(board)
-        board.undo_move()
-        return int(score * TIME_DISCOUNT), move
+        # we've already sorted, just return now (10% speedup)
+        if max_depth == 1:
+            move = all_moves[0]
+            board.do_move(move)
+            score, _ = eval_fn(board)
+            board.undo_move()
+            TRANSPOSITION_TABLE.store(board.hash, max_depth, EXACT, score, move)
+            PV_TABLE.update(ply, move, [])
+            return int(score * TIME_DISCOUNT), move, PV_TABLE.lines[ply]
+    else:
+        # internal iterative deepening: no previous search to say what's best here, so do a quick one
+        if hash_move is None and max_depth >= params.get("iid_min_depth", 4):
+            SEARCH_STATS["iid_searches"] += 1
+            _, hash_move, _ = minmax(board, eval_fn, max_depth - 2, alpha, beta, params, ply)
+            if time_manager is not None and time_manager.aborted:
+                return 0, None, []
+        MOVE_ORDERING.order(board, all_moves, ply, hash_move)
 
     # search the tree!
     explore_ratio = params.get("explore_ratio", 1.0)
     min_branches = params.get("min_branches", 10)
     num_to_explore = max(int(len(all_moves) * explore_ratio), min_branches)
 
-    for move in all_moves[:num_to_explore]:
+    # children score their positions before our time discount, so their window is scaled up to match.
+    # scores are ints, so a window of 1 is enough to tell if a move beats alpha (or beta for min)
+    pvs = params.get("pvs", True)
+    lmr = params.get("lmr", 0)
+    can_reduce = lmr and max_depth >= 3 and not board.in_check()
+    for i, move in enumerate(all_moves[:num_to_explore]):
+        # late move reductions: quiet moves ordered late are unlikely to be any good, so they get a
+        # search a ply shallower, unless it turns out they're better than the moves so far after all
+        quiet = not board.capture_score(move)
+        reduce = can_reduce and i >= lmr and quiet
+        prune = futile and i > 0 and quiet
         board.do_move(move)
-        # add to transposition table
-        key = "".join(board.board.flatten()) + str(max_depth - 1)
+        if (reduce or prune) and board.in_check():  # checks are forcing, keep their full depth
+            reduce = prune = False
+        if prune:
+            board.undo_move()
+            SEARCH_STATS["futility_pruned"] += 1
+            continue
 
-        if key in TRANSPOSITION_TABLE:
-            score = TRANSPOSITION_TABLE[key]
+        if i == 0 or not (pvs or reduce):
+            score, _, _ = minmax(board, eval_fn, max_depth - 1,
+                                 alpha / TIME_DISCOUNT, beta / TIME_DISCOUNT, params, ply + 1)
         else:
-            score, _ = minmax(board, eval_fn, max_depth - 1, alpha, beta, params)
-            TRANSPOSITION_TABLE[key] = score
-
+            # principal variation search: assume the first move was the best, and only prove
+            # this one can't beat it with a cheap null window search
+            if not pvs:
+                null_alpha, null_beta = alpha, beta
+            elif direction > 0:
+                null_alpha, null_beta = alpha, alpha + 1
+            else:
+                null_alpha, null_beta = beta - 1, beta
+            if reduce:
+                SEARCH_STATS["lmr_reductions"] += 1
+                score, _, _ = minmax(board, eval_fn, max_depth - 2,
+                                     null_alpha / TIME_DISCOUNT, null_beta / TIME_DISCOUNT, params, ply + 1)
+            if not reduce or (score > alpha if direction > 0 else score < beta):
+                if reduce:
+                    SEARCH_STATS["lmr_researches"] += 1
+                score, _, _ = minmax(board, eval_fn, max_depth - 1,
+                                     null_alpha / TIME_DISCOUNT, null_beta / TIME_DISCOUNT, params, ply + 1)
+            if pvs and alpha < score < beta:  # it might, so search it properly to get its score
+                SEARCH_STATS["pvs_researches"] += 1
+                score, _, _ = minmax(board, eval_fn, max_depth - 1,
+                                     alpha / TIME_DISCOUNT, beta / TIME_DISCOUNT, params, ply + 1)
         board.undo_move()
+        if time_manager is not None and time_manager.aborted:  # unwind, don't store half searched results
+            return 0, None, []
 
         if score * direction > best_score * direction:
             best_score = score
             best_move = move
+            PV_TABLE.update(ply, move)
 
         # update heuristics
         if direction > 0:
@@ -108,6 +322,19 @@ def minmax(board, eval_fn, max_depth, alpha=-np.inf, beta=np.inf, params={}):
         else:
             beta = min(beta, score)  # only if min
         if beta <= alpha:  # we know the parent won't choose us. abandon the search!
+            SEARCH_STATS["beta_cutoffs"] += 1
+            if i == 0:  # how often the ordering got it right first time
+                SEARCH_STATS["first_move_cutoffs"] += 1
+            MOVE_ORDERING.cutoff(board, move, max_depth, ply)
             break
 
-    return int(best_score * TIME_DISCOUNT), best_move
+    # save the result, noting if alpha-beta only gave us a bound on the true score
+    if best_score <= alpha_orig:
+        bound = UPPER
+    elif best_score >= beta_orig:
+        bound = LOWER
+    else:
+        bound = EXACT
+    TRANSPOSITION_TABLE.store(board.hash, max_depth, bound, best_score, best_move)
+
+    return int(best_score * TIME_DISCOUNT), best_move, PV_TABLE.lines[ply]
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""Runs the whole chess test suite against each alternative board backend,
+and checks the backends agree with the array ChessBoard move for move."""
+
+import copy
+import random
+
+import numpy as np
+import pytest
+
+import chess
+import test_chess
+from bitboard import BitboardChessBoard
+from chessboard import ChessBoard
+from mailbox_board import MailboxChessBoard
+from test_chess import *  # noqa: F401,F403 re-collects every chess test, once per backend
+
+BACKENDS = [BitboardChessBoard, MailboxChessBoard]
+
+
+@pytest.fixture(autouse=True, params=BACKENDS)
+def backend(request, monkeypatch):
+    """Makes every ChessBoard() built by the tests and by play_game use the backend"""
+    monkeypatch.setattr(test_chess, "ChessBoard", request.param)
+    monkeypatch.setattr(chess, "ChessBoard", request.param)
+    return request.param
+
+
+def test_random_games_match_array_board(backend):
+    """Plays random games on both boards, comparing the generated moves and the board after
+    every do_move and undo_move"""
+    rng = random.Random(0)
+    for _ in range(5):
+        expected = ChessBoard()
+        actual = backend()
+        for _ in range(60):
+            moves = expected.moves()
+            assert set(actual.moves()) == set(moves)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            expected.do_move(move)
+            actual.do_move(copy.copy(move))
+            assert np.all(actual.board == expected.board)
+            assert actual.piece_set == expected.piece_set
+
+            # undo and redo, to exercise undo_move
+            expected.undo_move()
+            actual.undo_move()
+            assert np.all(actual.board == expected.board)
+            expected.do_move(move)
+            actual.do_move(copy.copy(move))
+
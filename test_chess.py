@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
 from typing import Set
+import time
 import copy
 
 import numpy as np
+import pytest
 
 from chessboard import (
     B_CASTLE_RIGHT,
@@ -15,10 +17,16 @@ from chessboard import (
     W_CASTLE_RIGHT,
     B_CASTLE_LEFT,
     B_CASTLE_RIGHT,
+    CASTLE_ROOK_HOPS,
 )
-from chess import eval_chess_board, play_game
-from search import minmax
+from chess import eval_chess_board, computer_player, play_game, WIN_SCORE, BOARD_BACKENDS, EVAL_CACHE
+from parallel_search import lazy_smp, root_split, WORKER_STATS
+from search import minmax, iterative_deepening, reset_search_state, DEPTH_STATS, PV_TABLE, SEARCH_STATS
+from time_manager import TimeManager
+from move_ordering import MoveOrdering
+from perft import PERFT_POSITIONS
 
+KIWIPETE = PERFT_POSITIONS["kiwipete"].fen
 
 
 def assert_row(b, row, expected):
@@ -509,7 +517,52 @@ def test_perft_moves():
     # for move in moves:
     #     b.print_move(move)
     assert len(moves) == 43
-    
+
+
+def test_perft_reference_positions():
+    """Counts the whole legal move tree of each reference position, with every promotion piece"""
+    from perft import perft, divide
+    for name, position in PERFT_POSITIONS.items():
+        b = ChessBoard.from_fen(position.fen, promotions="qnrb")
+        start = b.hash
+        for depth in [1, 2]:
+            assert perft(b, depth) == position.counts[depth - 1], name
+        assert b.hash == start
+    b = ChessBoard.from_fen(PERFT_POSITIONS["position3"].fen)
+    assert perft(b, 3) == PERFT_POSITIONS["position3"].counts[2]
+    assert divide(b, 2)["b4f4"] == 2, "rook takes the pawn, leaving black's king two moves"
+
+
+def test_perft_cache_and_parallel():
+    from hash_cache import HashCache
+    from perft import perft, divide, parallel_divide
+    b = ChessBoard.from_fen(KIWIPETE, promotions="qnrb")
+    cache = HashCache(size_mb=0.1, value_type="Q")
+    assert perft(b, 3, cache) == PERFT_POSITIONS["kiwipete"].counts[2]
+    assert cache.hits > 0
+    assert perft(b, 3, cache) == PERFT_POSITIONS["kiwipete"].counts[2], "fully cached the second time"
+
+    counts, workers = parallel_divide(b, 2, workers=2, cache_mb=0.1)
+    assert counts == divide(b, 2)
+    assert sum(worker["nodes"] for worker in workers.values()) == PERFT_POSITIONS["kiwipete"].counts[1]
+
+
+def test_from_fen():
+    b = ChessBoard.from_fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    assert str(b) == str(ChessBoard())
+    assert b.hash == ChessBoard().hash
+
+    expected = ChessBoard()
+    expected.do_move(Move(6, 4, 4, 4))  # e4
+    b = ChessBoard.from_fen("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b Kq e3")
+    assert b.en_passant_spot == (4, 4)
+    assert b.turn == "black"
+    assert b.w_castle_right_flag and not b.w_castle_left_flag
+    assert b.b_castle_left_flag and not b.b_castle_right_flag
+    expected.castle_rights = b.castle_rights
+    expected._sync_board_to_piece_set()
+    assert b.hash == expected.hash
+
 
 def test_castling_moves():
     """Tests castling move generation.
@@ -633,16 +686,14 @@ def test_minmax_1():
     b.board[7, 4] = "K"
     b._sync_board_to_piece_set()
 
-    _, move = minmax(b, eval_chess_board, 1)
+    _, move, _ = minmax(b, eval_chess_board, 1)
     expected = Move(1, 4, 2, 4, piece="k", captured="Q")
     b.print_move(move)
-    move.old_flags = None
     assert move == expected
 
-    _, move = minmax(b, eval_chess_board, 4)
+    _, move, _ = minmax(b, eval_chess_board, 4)
     expected = Move(1, 4, 2, 4, piece="k", captured="Q")
     b.print_move(move)
-    move.old_flags = None
     assert move == expected
 
 
@@ -663,14 +714,12 @@ def test_minmax_2():
     )
     b._sync_board_to_piece_set()
 
-    _, move = minmax(b, eval_chess_board, 1)
+    _, move, _ = minmax(b, eval_chess_board, 1)
     expected = Move(7, 2, 3, 6, piece="B", captured="q")
-    move.old_flags = None
     assert move == expected
 
-    _, move = minmax(b, eval_chess_board, 2)
+    _, move, _ = minmax(b, eval_chess_board, 2)
     expected = Move(7, 2, 3, 6, piece='B', captured="q")
-    move.old_flags = None
     assert move == expected
 
 
@@ -692,10 +741,9 @@ def test_minmax_3():
     )
     b._sync_board_to_piece_set()
 
-    _, move = minmax(b, eval_chess_board, 3)
+    _, move, _ = minmax(b, eval_chess_board, 3)
     b.print_move(move)
     expected = Move(7, 0, 7, 7, piece="R")
-    move.old_flags = None
     assert move == expected
 
     # forked!
@@ -714,10 +762,9 @@ def test_minmax_3():
     )
     b._sync_board_to_piece_set()
 
-    _, move = minmax(b, eval_chess_board, 3)
+    _, move, _ = minmax(b, eval_chess_board, 3)
     b.print_move(move)
     expected = Move(4, 3, 6, 2, piece="n", captured="P")
-    move.old_flags = None
     assert move == expected
 
 def test_play():
@@ -725,6 +772,19 @@ def test_play():
     play_game(white_params={"depth":2}, black_params={"depth":2})
 
 
+def test_play_to_checkmate():
+    b = ChessBoard.from_fen("6k1/5ppp/8/8/8/8/5PPP/2Q3K1 w - - 0 1")
+    score, board = play_game(white_params={"depth": 2}, black_params={"depth": 2}, display=False, board=b)
+    assert score == WIN_SCORE
+    assert board.moves() == [] and board.in_check() and len(board.past_moves) == 1, "Qc8#"
+
+
+def test_play_to_stalemate():
+    b = ChessBoard.from_fen("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1")
+    score, board = play_game(display=False, board=b)
+    assert score == 0 and board.past_moves == []
+
+
 def test_en_passant_flags():
     b = ChessBoard()
     m = Move(r_from=1, c_from=2, r_to=3, c_to=3)  # black pawn forward 2
@@ -919,3 +979,567 @@ def test_pawn_promotion_moves():
         Move(6, 7, 7, 7, piece="n", special="n"),
     }
     assert moves == expected, "3 moves also available for black"
+
+
+def test_debug_mode_piece_set():
+    """debug mode cross-checks the incremental piece set after every do_move / undo_move"""
+    b = ChessBoard(debug=True)
+    moves = [
+        Move(6, 4, 4, 4),  # e4
+        Move(1, 3, 3, 3),  # d5
+        Move(4, 4, 3, 3),  # exd5
+        Move(1, 2, 3, 2),  # c5, enables en passant
+        Move(3, 3, 2, 2, special="e"),  # dxc6 e.p.
+        Move(0, 1, 2, 2),  # Nxc6
+    ]
+    for m in moves:
+        b.do_move(m)
+    assert b.piece_set == b._scan_piece_set()
+    for _ in moves:
+        b.undo_move()
+    assert b.piece_set == ChessBoard()._scan_piece_set()
+
+    # corrupt the incremental state and make sure it gets caught
+    b.piece_set.add(("Q", 4, 4))
+    with pytest.raises(RuntimeError):  # debug mode catches the bad piece set
+        b.do_move(Move(6, 4, 4, 4))
+
+
+def test_zobrist_hash():
+    b = ChessBoard(debug=True)  # debug cross-checks the incremental hash on every move
+    start = b.hash
+
+    # same position reached by two different move orders
+    b.do_move(Move(7, 6, 5, 5))  # Nf3
+    b.do_move(Move(0, 6, 2, 5))  # Nf6
+    b.do_move(Move(7, 1, 5, 2))  # Nc3
+    after_1 = b.hash
+    for _ in range(3):
+        b.undo_move()
+    assert b.hash == start, "undo restores the hash"
+
+    b.do_move(Move(7, 1, 5, 2))  # Nc3
+    b.do_move(Move(0, 6, 2, 5))  # Nf6
+    b.do_move(Move(7, 6, 5, 5))  # Nf3
+    assert b.hash == after_1, "transpositions hash the same"
+
+    # turn, castle flags and en passant all change the hash
+    b = ChessBoard()
+    b.turn = "black"
+    b._sync_board_to_piece_set()
+    assert b.hash != start
+    b = ChessBoard()
+    b.w_castle_left_flag = False
+    b._sync_board_to_piece_set()
+    assert b.hash != start
+
+    b = ChessBoard()
+    b.do_move(Move(6, 4, 4, 4))  # e4, sets the en passant spot
+    with_ep = b.hash
+    b.en_passant_spot = None
+    b._sync_board_to_piece_set()
+    assert b.hash != with_ep
+
+
+def test_repetitions():
+    b = ChessBoard()
+    shuffle = [Move(7, 6, 5, 5), Move(0, 6, 2, 5), Move(5, 5, 7, 6), Move(2, 5, 0, 6)]
+    for m in shuffle:
+        b.do_move(copy.copy(m))
+    assert b.repetitions() == 1
+    _, over = eval_chess_board(b)
+    assert not over
+    for m in shuffle:
+        b.do_move(copy.copy(m))
+    assert b.repetitions() == 2
+    assert eval_chess_board(b) == (0, True), "3 fold repetition is a draw"
+
+    b.do_move(Move(6, 4, 4, 4))  # pawn moves, the positions before them can't come again
+    b.do_move(Move(1, 4, 3, 4))
+    assert b.repetitions() == 0
+    for m in shuffle + shuffle:  # the first time round clears the en passant spot
+        b.do_move(copy.copy(m))
+    assert b.repetitions() == 1
+    b.do_null_move()
+    b.do_null_move()
+    assert b.repetitions() == 2, "null moves don't end the look back"
+
+
+def test_precomputed_tables():
+    from chessboard import KNIGHT_TARGETS, KING_TARGETS, PAWN_ATTACKS, ROOK_RAYS, QUEEN_RAYS
+    assert sorted(KNIGHT_TARGETS[0][0]) == [(1, 2), (2, 1)]
+    assert len(KNIGHT_TARGETS[4][4]) == 8
+    assert len(KING_TARGETS[7][7]) == 3
+    assert PAWN_ATTACKS["white"][6][0] == [(5, 1)]
+    assert PAWN_ATTACKS["black"][7][3] == []
+    assert [(1, 0), (2, 0), (3, 0)] == ROOK_RAYS[0][0][0][:3], "rays are ordered nearest first"
+    assert sum(len(ray) for ray in QUEEN_RAYS[3][3]) == 27
+
+
+def test_is_attacked_and_in_check():
+    b = ChessBoard()
+    b.board = np.array(
+        (
+            "r . . . k . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . b".split(),
+            ". . . . . . . .".split(),
+            ". . . P . . . .".split(),
+            ". . . . K . N .".split(),
+        )
+    )
+    b._sync_board_to_piece_set()
+    assert b.king_square("white") == (7, 4)
+    assert b.in_check("white"), "bishop on h4 checks through the open diagonal"
+    assert not b.in_check("black")
+    assert b.is_attacked(0, 3, "black"), "rook covers the back rank"
+    assert not b.is_attacked(0, 6, "black"), "up to its own king"
+    assert b.is_attacked(5, 2, "white"), "pawn attacks diagonally forward"
+    assert not b.is_attacked(5, 3, "white"), "but not straight ahead"
+    assert b.is_attacked(5, 5, "white"), "knight on g1 hits f3"
+
+    b.do_move(Move(7, 6, 6, 4))  # Ne2 doesn't block
+    assert b.in_check("white")
+    b.undo_move()
+    b._add_piece("P", 6, 5)  # f2 does
+    assert not b.in_check("white")
+
+
+def test_mobility():
+    b = ChessBoard()
+    assert b.mobility("white") == 20
+    assert b.mobility("black") == 20
+    b.do_move(Move(6, 4, 4, 4))  # e4 frees the bishop, queen and king
+    assert b.mobility("white") == len(b.moves("white"))
+
+
+def test_packed_moves():
+    from chessboard import MoveBuffers, encode_move, decode_move
+    b = ChessBoard()
+    b.board = np.array(
+        (
+            "r . . . k . . r".split(),
+            "p P p p q p b .".split(),
+            "b n . . p n p .".split(),
+            ". . . P N . . .".split(),
+            ". p . . P . . .".split(),
+            ". . N . . Q . p".split(),
+            "P P P B B P P P".split(),
+            "R . . . K . . R".split(),
+        )
+    )
+    b._sync_board_to_piece_set()
+    b.do_move(Move(6, 0, 4, 0))  # a4, so black can take en passant
+    buffers = MoveBuffers(max_ply=2)
+    for ply, specials in enumerate([{"e", B_CASTLE_LEFT}, {"q", "n", W_CASTLE_RIGHT}]):
+        moves = b.pseudo_legal_moves()
+        assert specials <= {m.special for m in moves}, "covers every kind of special move"
+
+        n = b.generate_packed(buffers[ply])
+        codes = list(buffers[ply][:n])
+        assert sorted(codes) == sorted(encode_move(m) for m in moves)
+        for m in moves:
+            assert decode_move(encode_move(m), b) == m, "round trip"
+        b.do_packed_move(encode_move(next(m for m in moves if m.special in specials)))
+    b.undo_move()
+    b.undo_move()
+    assert b.turn == "black"
+
+
+def test_state_stack():
+    b = ChessBoard()
+    e4 = Move(6, 4, 4, 4)
+    before = copy.copy(e4)
+    b.do_move(e4)
+    assert e4 == before, "do_move leaves the move untouched, so it can be reused"
+    b.undo_move()
+
+    # a game longer than the preallocated stack grows it
+    shuffle = [Move(7, 6, 5, 5), Move(0, 6, 2, 5), Move(5, 5, 7, 6), Move(2, 5, 0, 6)]
+    start = b.hash
+    for i in range(len(b._hash_stack) + 10):
+        b.do_move(shuffle[i % 4])
+    assert b.ply == len(b.past_moves)
+    copied = ChessBoard.from_board(b)
+    assert copied.repetitions() == b.repetitions() > 2
+    for _ in range(b.ply):
+        b.undo_move()
+    assert b.hash == start
+    assert b.castle_rights == copied.castle_rights
+
+
+def test_legal_moves():
+    b = ChessBoard()
+    b.board = np.array(
+        (
+            ". . . . k . . .".split(),
+            ". . . . r . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". b . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . P N . . .".split(),
+            "R . . . K . . R".split(),
+        )
+    )
+    b._sync_board_to_piece_set()
+    b.castle_rights = 0
+    assert b.checks_and_pins() == (0, set(), {(6, 3): {(6, 3), (5, 2), (4, 1)}, (6, 4): {
+        (6, 4), (5, 4), (4, 4), (3, 4), (2, 4), (1, 4)}})
+    moves = b.moves()
+    assert not [m for m in moves if m.piece == "N"], "knight pinned by the rook can't move at all"
+    assert not [m for m in moves if m.piece == "P"], "pawn pinned by the bishop can't push"
+    assert not [m for m in moves if m.piece == "K" and m.c_to == 4], "king can't step up the e file"
+    assert Move(7, 4, 7, 5, "K") in moves
+
+    # castling out of, through or into check
+    b.castle_rights = 3
+    castles = {m.special for m in b.moves() if m.special in CASTLE_ROOK_HOPS}
+    assert castles == {W_CASTLE_LEFT, W_CASTLE_RIGHT}
+    b._add_piece("b", 5, 7)  # covers f1
+    castles = {m.special for m in b.moves() if m.special in CASTLE_ROOK_HOPS}
+    assert castles == {W_CASTLE_LEFT}, "can't castle through check"
+    b._remove_piece(6, 4)  # knight gone, rook gives check
+    castles = {m.special for m in b.moves() if m.special in CASTLE_ROOK_HOPS}
+    assert castles == set(), "can't castle out of check"
+
+    # single check: block or capture the checker, or move the king
+    checkers, evasions, _ = b.checks_and_pins()
+    assert checkers == 1
+    assert all(m.piece == "K" or (m.r_to, m.c_to) in evasions for m in b.moves())
+    assert Move(7, 0, 1, 0, "R") not in b.moves()
+
+    # double check: only the king moves
+    b._add_piece("n", 5, 3)
+    assert b.checks_and_pins()[0] == 2
+    assert {m.piece for m in b.moves()} == {"K"}
+
+
+def test_en_passant_discovered_check():
+    b = ChessBoard()
+    b.board = np.array(
+        (
+            ". . . . k . . .".split(),
+            ". . p . . . . .".split(),
+            ". . . . . . . .".split(),
+            "K . . P . . . r".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+        )
+    )
+    b.turn = "black"
+    b._sync_board_to_piece_set()
+    b.do_move(Move(1, 2, 3, 2))  # c5, pawns side by side with the rook behind them
+    assert not [m for m in b.moves() if m.special == "e"], "en passant would expose the king along the row"
+
+
+def test_checkmate_and_stalemate():
+    b = ChessBoard()
+    b.board = np.array(
+        (
+            "k . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". K . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . . . . . . .".split(),
+            ". . Q . . . . .".split(),
+        )
+    )
+    b._sync_board_to_piece_set()
+    b.do_move(Move(7, 2, 1, 2))  # Qc7 stalemates
+    assert b.moves() == []
+    assert eval_chess_board(b)[1] is False, "stalemate isn't a win"
+    assert minmax(b, eval_chess_board, 2)[0] == 0
+    b.undo_move()
+
+    b.do_move(Move(7, 2, 0, 2))  # Qc8 mates
+    assert b.in_check()
+    assert b.moves() == []
+    assert eval_chess_board(b, {"no_moves": True}) == (WIN_SCORE, True)
+    assert minmax(b, eval_chess_board, 2)[0] == WIN_SCORE, "search spots the mate without a king capture"
+
+
+def test_incremental_eval_totals():
+    """The running material and piece table totals match a full re-sum through random games,
+    which hit captures, castling, en passant and promotions along the way"""
+    import random
+    specials = set()
+    for seed in [2, 4]:
+        rng = random.Random(seed)
+        for _ in range(4):
+            b = ChessBoard(debug=True)  # also re-sums after every do_move and undo_move
+            for _ in range(150):
+                moves = b.moves()
+                if not moves:
+                    break
+                move = rng.choice(sorted(moves, key=str))
+                specials.add("promotion" if move.special in ("q", "n") else move.special)
+                b.do_move(move)
+                assert eval_chess_board(b) == eval_chess_board(b, {"full_eval": True})
+            while b.past_moves:
+                b.undo_move()
+            assert (b.material, b.piece_square) == (0, 0), "symmetric starting position"
+    assert {"promotion", W_CASTLE_RIGHT, "e"} <= specials
+
+
+def test_eval_batch():
+    import random
+    from chess import encode_boards, eval_batch
+    rng = random.Random(0)
+    b = ChessBoard()
+    positions = []
+    for _ in range(80):
+        b.do_move(rng.choice(sorted(b.moves(), key=str)))
+        positions.append(ChessBoard.from_board(b))
+    codes = encode_boards(positions)
+    assert codes.shape == (80, 8, 8)
+    for params in [{}, {"material": False}, {"piece_table": False}]:
+        expected = [eval_chess_board(p, params)[0] for p in positions]
+        assert list(eval_batch(codes, params)) == expected
+
+
+def test_move_ordering():
+    b = ChessBoard.from_fen("4k3/8/3q1r2/4P3/4N3/8/8/R3K3 w - - 0 1")
+    pxq = Move(3, 4, 2, 3, "P", "q")
+    pxr = Move(3, 4, 2, 5, "P", "r")
+    nxq = Move(4, 4, 2, 3, "N", "q")
+    assert b.capture_score(pxq) > b.capture_score(nxq) > b.capture_score(pxr) > 0, "victim first, then attacker"
+    quiet = Move(7, 0, 6, 0, "R")
+    assert b.capture_score(quiet) == 0
+    assert b.move_index(quiet) == (7 * 8 + 0) * 64 + 6 * 8 + 0
+
+    ordering = MoveOrdering()
+    moves = ordering.order(b, b.moves(), 0)
+    assert moves[:3] == [pxq, nxq, pxr]
+
+    ordering.cutoff(b, quiet, 3, 0)
+    ordering.cutoff(b, pxq, 3, 0)  # captures aren't learned, they're already first
+    assert ordering.killers[0] == [b.move_index(quiet), None]
+    assert ordering.history["white", b.move_index(quiet)] == 9
+    moves = ordering.order(b, b.moves(), 0)
+    assert moves[4] == quiet, "killer straight after the captures"
+    assert ordering.killers[1] == [None, None], "killers are per ply"
+
+    ordering.new_search()
+    assert ordering.killers[0] == [None, None]
+    assert ordering.history["white", b.move_index(quiet)] == 4
+
+    assert ordering.order(b, b.moves(), 0, hash_move=quiet)[0] == quiet, "hash move before everything"
+    assert ordering.order(b, b.moves(), 0, hash_move=Move(0, 0, 1, 0, "R"))[0] == pxq, "unless it isn't legal here"
+
+
+def test_cheap_move_ordering_search():
+    scores = {}
+    for name, params in [("eval", {"eval_ordering": True}), ("cheap", {}), ("iid", {"iid_min_depth": 2})]:
+        b = ChessBoard.from_fen(KIWIPETE)
+        reset_search_state()
+        scores[name], _, _ = minmax(b, eval_chess_board, 3, params=params)
+        assert 0 < SEARCH_STATS["first_move_cutoffs"] <= SEARCH_STATS["beta_cutoffs"]
+    assert scores["eval"] == scores["cheap"] == scores["iid"], "ordering changes the work, not the result"
+    assert SEARCH_STATS["iid_searches"] > 0
+
+
+def test_principal_variation():
+    b = ChessBoard.from_fen(KIWIPETE)
+    reset_search_state()
+    score, move, pv = iterative_deepening(b, eval_chess_board, 3)
+    assert pv[0] == move
+    assert 1 < len(pv) <= 3
+    for m in pv:  # a line of legal moves
+        assert m in b.moves()
+        b.do_move(m)
+    for _ in pv:
+        b.undo_move()
+    assert PV_TABLE.move(b) == move, "kept to be searched first next time"
+
+
+def test_pvs_and_aspiration_windows():
+    results = {}
+    for name, params in [("alpha-beta", {"pvs": False, "aspiration_window": 0}), ("pvs", {"aspiration_window": 0}),
+                         ("aspiration", {"aspiration_window": 10})]:
+        b = ChessBoard.from_fen(KIWIPETE)
+        reset_search_state()
+        score, _, _ = iterative_deepening(b, eval_chess_board, 4, params=params)
+        assert [d["depth"] for d in DEPTH_STATS] == [0, 1, 2, 3, 4]
+        assert sum(d["nodes"] for d in DEPTH_STATS) == SEARCH_STATS["nodes"]
+        results[name] = score, SEARCH_STATS["pvs_researches"], sum(d["researches"] for d in DEPTH_STATS)
+    assert results["alpha-beta"][0] == results["pvs"][0] == results["aspiration"][0], "same score, less work"
+    assert results["alpha-beta"][1] == 0 and results["pvs"][1] > 0
+    assert results["pvs"][2] == 0 and results["aspiration"][2] > 0, "a narrow window has to be widened"
+
+
+def test_null_move():
+    b = ChessBoard.from_fen("4k3/8/8/3pP3/8/8/8/R3K3 w - d6 0 1")
+    h, ep = b.hash, b.en_passant_spot
+    assert b.null_move_allowed()
+    b.do_null_move()
+    assert b.turn == "black" and b.en_passant_spot is None
+    assert b.hash == b._scan_hash()
+    assert not b.null_move_allowed(), "no two passes in a row"
+    b.undo_null_move()
+    assert b.turn == "white" and b.hash == h and b.en_passant_spot == ep
+    assert b.past_moves == []
+
+    assert not ChessBoard.from_fen("4k3/8/8/3pP3/8/8/8/4K3 w - - 0 1").null_move_allowed(), "zugzwang risk"
+    assert not ChessBoard.from_fen("4k3/8/8/8/8/8/8/R3K2r w - - 0 1").null_move_allowed(), "in check"
+
+
+def test_selective_search():
+    for params in [{"null_move": 1}, {"lmr": 2}, {"null_move": 1, "lmr": 2}]:
+        b = ChessBoard.from_fen(KIWIPETE)
+        h = b.hash
+        reset_search_state()
+        _, move, _ = iterative_deepening(b, eval_chess_board, 3, params=params)
+        assert move in b.moves() and b.hash == h
+        if "null_move" in params:
+            assert SEARCH_STATS["null_move_cutoffs"] > 0
+        if "lmr" in params:
+            assert SEARCH_STATS["lmr_reductions"] > 0
+            assert SEARCH_STATS["lmr_researches"] <= SEARCH_STATS["lmr_reductions"]
+
+    # the selectivity is passed down from the player's params
+    b = ChessBoard()
+    SEARCH_STATS.clear()
+    computer_player(b, {"depth": 3, "lmr": 2, "board": "mailbox"})
+    assert SEARCH_STATS["lmr_reductions"] > 0
+
+
+def test_futility_pruning_and_razoring():
+    results = {}
+    for name, params in [("full", {}), ("futility", {"futility_margins": [200, 500]}),
+                         ("razoring", {"razor_margins": [300, 600]})]:
+        b = ChessBoard.from_fen(KIWIPETE)
+        reset_search_state()
+        _, move, _ = iterative_deepening(b, eval_chess_board, 3, params=params)
+        assert move in b.moves()
+        results[name] = move, SEARCH_STATS["nodes"]
+    assert SEARCH_STATS["razored"] > 0
+    assert results["futility"][0] == results["full"][0], "only hopeless quiet moves are skipped"
+    assert results["futility"][1] < results["full"][1]
+    assert results["razoring"][1] < results["full"][1]
+
+
+def test_futility_keeps_checks():
+    b = ChessBoard.from_fen("6k1/5ppp/8/8/8/8/qr3PPP/4R1K1 w - - 0 1")
+    for params in [{}, {"futility_margins": [200, 500]}]:
+        reset_search_state()
+        score, move, _ = minmax(b, eval_chess_board, 2, -100, 100, params, ply=1)
+        assert (move.r_to, move.c_to) == (0, 4) and score > 900, "Re8# is quiet, but gives check"
+
+    reset_search_state()
+    minmax(b, eval_chess_board, 2, -100, 100, {"futility_margins": [200, 500]})
+    assert SEARCH_STATS["futility_pruned"] == 0, "not at the root"
+
+
+def test_lazy_eval():
+    b = ChessBoard.from_fen(KIWIPETE)
+    params = {"mobility": True, "eval_cache": False}  # a cached full score is returned even outside the window
+    full, _ = eval_chess_board(b, params)
+    cheap, _ = eval_chess_board(b, {"mobility": False})
+    assert full != cheap
+
+    SEARCH_STATS.clear()
+    assert eval_chess_board(b, params, full - 100, full + 100) == (full, False), "inside the window"
+    assert eval_chess_board(b, params, cheap + 300, cheap + 400) == (cheap, False), "far below alpha"
+    assert eval_chess_board(b, params, cheap - 400, cheap - 300) == (cheap, False), "far above beta"
+    assert SEARCH_STATS["lazy_evals"] == 2
+    assert eval_chess_board(b, dict(params, lazy_margin=None), cheap + 300, cheap + 400) == (full, False)
+
+
+def test_time_limited_search():
+    b = ChessBoard.from_fen(KIWIPETE)
+    h = b.hash
+    reset_search_state()
+    t0 = time.time()
+    tm = TimeManager(100.0, hard_limit=0.3)  # plenty of budget to start depths, so one has to be aborted
+    score, move, pv = iterative_deepening(b, eval_chess_board, 20, time_manager=tm)
+    assert time.time() - t0 < tm.hard_limit * 10, "stopped near the hard limit, with room for a slow machine"
+    assert SEARCH_STATS["aborted_iterations"] == 1
+    assert move in b.moves() and b.hash == h and b.past_moves == []
+    assert DEPTH_STATS[-1]["score"] == score, "the last completed depth's result"
+
+    move = computer_player(b, {"clock": 3.0, "increment": 0.0, "board": "mailbox"})
+    assert move in b.moves()
+
+
+def test_node_budget_search():
+    results = []
+    for board_cls in [ChessBoard, BOARD_BACKENDS["mailbox"]]:
+        b = board_cls.from_fen(KIWIPETE)
+        reset_search_state()
+        score, move, pv = iterative_deepening(b, eval_chess_board, 20, params={"null_move": 2}, max_nodes=3000)
+        assert SEARCH_STATS["nodes"] == 3000, "stops after exactly the budget"
+        assert SEARCH_STATS["aborted_iterations"] == 1
+        results.append((score, str(move), [str(m) for m in pv], [d["nodes"] for d in DEPTH_STATS]))
+    assert results[0] == results[1], "the same search, whatever the backend's move generation order"
+
+    b = ChessBoard.from_fen(KIWIPETE)
+    assert computer_player(b, {"max_nodes": 500, "board": "mailbox"}) in b.moves()
+
+    runs = []
+    for _ in range(3):  # nothing cleared in between, the search has to forget the earlier ones itself
+        score, move, pv = iterative_deepening(b, eval_chess_board, 20, params={"null_move": 2}, max_nodes=3000)
+        runs.append((score, str(move), [d["nodes"] for d in DEPTH_STATS]))
+    assert runs[0] == runs[1] == runs[2]
+    assert (runs[0][0], runs[0][1]) == results[0][:2]
+
+
+def test_lazy_smp():
+    b = BOARD_BACKENDS["mailbox"].from_fen(KIWIPETE)
+    h = b.hash
+    score, move, pv = lazy_smp(b, eval_chess_board, 3, workers=2, max_t=np.inf)
+    assert move in b.moves() and pv[0] == move
+    assert b.hash == h and b.past_moves == []
+    assert [w["start_depth"] for w in WORKER_STATS] == [1, 2], "staggered"
+    assert max(w["depth"] for w in WORKER_STATS) == 3
+
+    assert computer_player(b, {"depth": 2, "workers": 2, "board": "mailbox"}) in b.moves()
+    assert computer_player(b, {"workers": 2}) in b.moves(), "no limits given, the default depth"
+
+
+def test_root_split():
+    b = BOARD_BACKENDS["mailbox"].from_fen("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
+    h = b.hash
+    reset_search_state()
+    expected = minmax(b, eval_chess_board, 3)
+    reset_search_state()
+    score, move, pv = root_split(b, eval_chess_board, 3, workers=2)
+    assert (score, move) == expected[:2]
+    assert pv[0] == move and b.hash == h and b.past_moves == []
+
+    assert computer_player(b, {"depth": 2, "root_split": True, "workers": 2, "board": "mailbox"}) in b.moves()
+
+
+def test_eval_cache():
+    b = ChessBoard.from_fen(KIWIPETE)
+    EVAL_CACHE.clear()
+    for params in [{"eval_cache": True}, {"mobility": True}, {"piece_table": False, "eval_cache": True},
+                   {"mobility": True, "full_eval": True}]:
+        expected = eval_chess_board(b, dict(params, eval_cache=False))
+        assert eval_chess_board(b, params) == expected
+        assert eval_chess_board(b, params) == expected, "from the cache, not another config's entry"
+    assert EVAL_CACHE.stats()["hits"] == 4
+    eval_chess_board(b, {})
+    assert EVAL_CACHE.stats()["probes"] == 8, "off by default for the cheap eval"
+
+    EVAL_CACHE.clear()
+    lazy = eval_chess_board(b, {"mobility": True}, alpha=1000, beta=1001)
+    assert eval_chess_board(b, {"mobility": True}) != lazy, "lazy scores aren't cached"
+
+
+def test_compact_board():
+    b = ChessBoard()
+    for move in [((6, 4), (4, 4)), ((1, 0), (2, 0)), ((4, 4), (3, 4)), ((1, 3), (3, 3))]:
+        b.do_move([m for m in b.moves() if ((m.r_from, m.c_from), (m.r_to, m.c_to)) == move][0])
+    assert b.to_fen() == "rnbqkbnr/1pp1pppp/p7/3pP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3"
+    for board_cls in BOARD_BACKENDS.values():
+        c = board_cls.from_compact(b.compact())
+        assert c.hash == b.hash and c.to_fen() == b.to_fen()
+        assert c.repetitions() == b.repetitions() and len(c.past_moves) == len(b.past_moves)
+        assert sorted(map(str, c.moves())) == sorted(map(str, b.moves())), "incl. en passant"
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+import random
+
+from bitboard import rook_attacks, bishop_attacks, sliding_attacks, FULL
+from chessboard import ROOK_STEPS, BISHOP_STEPS
+
+
+def test_magic_attacks_match_rays():
+    """The saved magic tables give the same attacks as walking the rays"""
+    rng = random.Random(0)
+    for sq in range(64):
+        for _ in range(20):
+            occupied = rng.getrandbits(64) & rng.getrandbits(64) & FULL
+            assert rook_attacks(sq, occupied) == sliding_attacks(sq, occupied, ROOK_STEPS)
+            assert bishop_attacks(sq, occupied) == sliding_attacks(sq, occupied, BISHOP_STEPS)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+from hash_cache import HashCache
+from time_manager import TimeManager
+from transposition import (
+    TranspositionTable, SharedTranspositionTable, EXACT, LOWER, UPPER, ENTRY_BYTES, BUCKET_SIZE, SHARED_ENTRY_BYTES
+)
+
+
+def test_transposition_table_size():
+    tt = TranspositionTable(size_mb=1)
+    assert len(tt) * ENTRY_BYTES <= 2 ** 20
+    assert len(tt) == tt.num_buckets * BUCKET_SIZE
+
+
+def test_transposition_table_probe_and_store():
+    tt = TranspositionTable(size_mb=0.01)
+    assert tt.probe(1234) is None
+
+    tt.store(1234, 3, LOWER, 50, "move")
+    assert tt.probe(1234) == (3, LOWER, 50, "move")
+    tt.store(1234, 4, EXACT, 60, "better move")
+    assert tt.probe(1234) == (4, EXACT, 60, "better move"), "same position is always updated"
+
+    stats = tt.stats()
+    assert stats["probes"] == 3
+    assert stats["hits"] == 2
+    assert stats["fill"] == 1 / len(tt)
+
+    tt.clear()
+    assert tt.probe(1234) is None
+    assert tt.stats()["hits"] == 0
+
+
+def test_transposition_table_replacement():
+    tt = TranspositionTable(size_mb=0.01)
+    n = tt.num_buckets
+    deep, shallow, other = 7, 7 + n, 7 + 2 * n  # all land in the same bucket
+
+    tt.store(deep, 5, EXACT, 1, None)
+    tt.store(shallow, 2, UPPER, 2, None)
+    assert tt.probe(deep) is not None, "deeper entry is kept in the depth-preferred slot"
+    assert tt.probe(shallow) is not None, "shallower entry goes to the always-replace slot"
+
+    tt.store(other, 1, EXACT, 3, None)
+    assert tt.probe(deep) is not None
+    assert tt.probe(shallow) is None, "always-replace slot was overwritten"
+    assert tt.probe(other) is not None
+    assert tt.stats()["collisions"] == 1
+
+    # entries from an older search lose their depth preference
+    tt.new_search()
+    tt.store(shallow, 1, EXACT, 4, None)
+    assert tt.probe(deep) is None
+    assert tt.probe(shallow) == (1, EXACT, 4, None)
+
+
+def test_time_manager_from_clock():
+    tm = TimeManager.from_clock(60.0, increment=1.0)
+    assert 1.0 < tm.budget < tm.hard_limit < 30.0, "a fraction of the clock, with room to overrun"
+    tm = TimeManager.from_clock(0.5, increment=0.0, moves_to_go=1)
+    assert tm.hard_limit <= 0.5, "never more than what's left"
+    assert TimeManager(2.0).hard_limit == 2.0
+
+
+def test_time_manager_prediction_and_abort():
+    tm = TimeManager(1.0)
+    assert tm.should_start([]), "always start the first iteration"
+    stats = [{"nodes": 1, "seconds": 0.0}, {"nodes": 10, "seconds": 0.01}, {"nodes": 100, "seconds": 0.1}]
+    assert abs(tm.predict(stats) - 1.0) < 1e-9
+    assert abs(tm.ebf - 10) < 1e-9
+    assert tm.should_start(stats[:2])
+    assert not tm.should_start(stats), "predicted to finish after the budget"
+
+    tm = TimeManager(0.0)
+    assert tm.out_of_time() and tm.aborted
+    tm.start()
+    assert not tm.aborted
+
+
+def test_time_manager_node_budget():
+    tm = TimeManager.from_nodes(3)
+    assert tm.should_start([{"nodes": 1000, "seconds": 1000.0}]), "the clock is ignored"
+    assert [tm.out_of_time() for _ in range(5)] == [False, False, False, True, True]
+    assert tm.nodes == 3 and not tm.should_start([])
+
+    tm.start()
+    tm.abortable = False
+    assert not any(tm.out_of_time() for _ in range(5)), "counts, but can't abort yet"
+    tm.abortable = True
+    assert tm.out_of_time() and tm.nodes == 5
+
+
+def test_shared_transposition_table():
+    tt = SharedTranspositionTable(size_mb=0.01)
+    assert len(tt) * SHARED_ENTRY_BYTES <= 0.01 * 2 ** 20
+    assert tt.probe(1234) is None
+    tt.store(1234, 3, LOWER, -50, 77)
+    tt.store(2 ** 64 - 1, 0, UPPER, 1000, None)
+    assert tt.probe(1234) == (3, LOWER, -50, 77)
+
+    other = SharedTranspositionTable(size_mb=0.01, name=tt.name)  # e.g. in another process
+    assert other.probe(2 ** 64 - 1) == (0, UPPER, 1000, None)
+    other.store(1234, 4, EXACT, 60, 78)
+    assert tt.probe(1234) == (4, EXACT, 60, 78), "stores are seen by every table attached"
+
+    slot = (1234 % tt.num_buckets) * BUCKET_SIZE
+    tt.words[2 * slot + 1] ^= 1 << 40  # a write torn by another process
+    assert tt.probe(1234) is None, "the key check rejects it"
+    other.close()
+    tt.close()
+
+
+def test_eval_cache():
+    cache = HashCache(size_mb=0.01)
+    assert len(cache) * cache.entry_bytes <= 0.01 * 2 ** 20
+    assert cache.probe(1234, 1) is None
+    cache.store(1234, 1, -50)
+    assert cache.probe(1234, 1) == -50
+    assert cache.probe(1234, 2) is None, "another config never shares the entry"
+    cache.store(1234 + len(cache), 1, 70)  # same slot
+    assert cache.probe(1234, 1) is None and cache.probe(1234 + len(cache), 1) == 70
+    assert cache.stats()["probes"] == 5 and cache.stats()["hits"] == 2
+    cache.clear()
+    assert cache.probe(1234 + len(cache), 1) is None
@@ -66,26 +66,26 @@ def test_minmax():
     # depth = 0
     b = TicTacToeBoard(turn="x")
     b.board = np.array((("x", "x", "x"), (" ", " ", " "), (" ", " ", " ")))
-    score, _ = minmax(b, eval_tictactoe, 0)
+    score, _, _ = minmax(b, eval_tictactoe, 0)
     assert score == WIN_SCORE
 
     b = TicTacToeBoard(turn="o")
     b.board = np.array((("o", " ", " "), (" ", "o", " "), (" ", " ", " ")))
-    score, move = minmax(b, eval_tictactoe, 1)
+    score, move, _ = minmax(b, eval_tictactoe, 1)
     assert score <= .75 * -WIN_SCORE  # some latitude for time discounting
     assert move == (2,2)
 
     # depth = 1, offense
     b = TicTacToeBoard(turn="x")
     b.board = np.array((("x", " ", " "), (" ", "x", " "), (" ", " ", " ")))
-    score, move = minmax(b, eval_tictactoe, 1)
+    score, move, _ = minmax(b, eval_tictactoe, 1)
     assert move == (2, 2)
     assert score >= .75 * WIN_SCORE
 
     # depth = 2, defense
     b = TicTacToeBoard(turn="x")
     b.board = np.array((("o", " ", " "), (" ", "o", " "), (" ", " ", " ")))
-    score, move = minmax(b, eval_tictactoe, 2)
+    score, move, _ = minmax(b, eval_tictactoe, 2)
     assert score == 0
     assert move == (2, 2)
 
@@ -93,7 +93,7 @@ def test_minmax_deep():
     b = TicTacToeBoard(turn="x")
     # can stop a force win
     b.board = np.array((("o", " ", " "), (" ", " ", " "), (" ", " ", " ")))
-    score, move = minmax(b, eval_tictactoe, 6)
+    score, move, _ = minmax(b, eval_tictactoe, 6)
     assert score == 0
     assert move == (1, 1)
 
@@ -101,9 +101,10 @@ def test_minmax_deep():
     b = TicTacToeBoard(turn="o")
     start = np.array((("o", " ", " "), ("x", " ", " "), (" ", " ", " ")))
     b.board = copy.deepcopy(start)
-    score, move = minmax(b, eval_tictactoe, 6)
+    score, move, pv = minmax(b, eval_tictactoe, 6)
     assert score <= .75 * -WIN_SCORE  # some latitude for time discounting
-    assert move == (0, 2) or move == (0, 1)  # there are many other force victories
+    assert move in [(0, 2), (0, 1), (1, 1)]  # there are many other force victories
+    assert pv[0] == move
 
     # check board is unchanged after call to eval
     assert np.all(b.board == start)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import time
+import random
 from typing import Tuple
 
 import numpy as np
@@ -9,6 +10,11 @@ from search import minmax
 
 WIN_SCORE = 1000
 
+# Zobrist keys for each (row, column, player), and for "o" being the side to move
+_zobrist_rng = random.Random(0)
+ZOBRIST_CELLS = {(r, c, p): _zobrist_rng.getrandbits(64) for r in range(3) for c in range(3) for p in "xo"}
+ZOBRIST_O_TO_MOVE = _zobrist_rng.getrandbits(64)
+
 
 class TicTacToeBoard(object):
     TURNS = ["x", "o"]
@@ -34,6 +40,14 @@ class TicTacToeBoard(object):
             output += row
         return output
 
+    @property
+    def hash(self):
+        """Zobrist hash of the position. Only 9 squares, so it's just computed from the board"""
+        h = ZOBRIST_O_TO_MOVE if self.turn == "o" else 0
+        for r, c in zip(*np.where(self.board != " ")):
+            h ^= ZOBRIST_CELLS[(r, c, self.board[r, c])]
+        return h
+
     def moves(self):
         """Returns list of available moves, as (r,c) tuples.
         Note: this is actually the same no matter who's turn it is"""
@@ -56,6 +70,14 @@ class TicTacToeBoard(object):
         self.turn = self.next_turn()
         self.past_moves.append(move)
 
+    def capture_score(self, move):
+        """Nothing is ever captured in tic tac toe, see move_ordering.py"""
+        return 0
+
+    def move_index(self, move):
+        """Index of the square, for the search's history table"""
+        return move[0] * 3 + move[1]
+
     def undo_move(self):
         """Pops the last move off the stack"""
         last_move = self.past_moves.pop()
@@ -63,11 +85,12 @@ class TicTacToeBoard(object):
         self.turn = self.next_turn()
 
 
-def eval_tictactoe(board : TicTacToeBoard, params : dict = {}) -> Tuple[int, bool]:
+def eval_tictactoe(board : TicTacToeBoard, params : dict = {}, alpha=-np.inf, beta=np.inf) -> Tuple[int, bool]:
     """Evaluates a tictactoe board.
     "x" winning -> positive
     "o" winning -> negative.
     game over -> +/- 1000.
+    alpha, beta: the search window, unused as the eval is always cheap.
     return (score, game_over)
     """
     for team, team_direction in [("x", 1), ("o", -1)]:
@@ -108,7 +131,7 @@ def play_game():
                 print("Tie!")
                 return 0
 
-        score, move = minmax(b, eval_tictactoe, 9)
+        score, move, _ = minmax(b, eval_tictactoe, 9)
         b.do_move(move)
         print(b)
         score, over = eval_tictactoe(b)
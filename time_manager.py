@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Time management for iterative deepening: how long to think about a move, and when to stop.
+
+Two limits:
+    budget: the time we'd like to spend. A new iteration isn't started if it's predicted to end after it.
+    hard_limit: the time we must not exceed. The search checks it as it goes, and abandons the
+        iteration in flight if it's passed, falling back to the last completed iteration's move.
+
+The next iteration's time is predicted from the effective branching factor (EBF) of the ones
+so far: how many times more nodes each depth took than the one before.
+
+For benchmarking, a node budget can replace the clock (TimeManager.from_nodes): the search stops
+after exactly max_nodes nodes, so the result doesn't depend on how fast or loaded the machine is,
+and two versions of the code can be compared by the depth they reach and their time per node.
+"""
+
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MOVES_TO_GO = 30  # moves a game clock has to last for, if the time control doesn't say
+HARD_LIMIT_FACTOR = 4  # how far over budget a single move may run, if the clock allows
+CLOCK_SAFETY = 0.05  # seconds left on the clock for the overhead outside the search
+
+
+class TimeManager(object):
+    """Tracks the time spent on one move's search.
+
+    budget: seconds we'd like to spend.
+    hard_limit: seconds we must not exceed, defaults to the budget.
+    max_nodes: nodes the search may visit, no limit by default.
+    """
+
+    def __init__(self, budget: float, hard_limit: Optional[float] = None, max_nodes: Optional[int] = None):
+        self.budget = budget
+        self.hard_limit = budget if hard_limit is None else hard_limit
+        self.max_nodes = np.inf if max_nodes is None else max_nodes
+        self.start()
+
+    @classmethod
+    def from_clock(cls, remaining: float, increment: float = 0.0, moves_to_go: Optional[int] = None
+                   ) -> "TimeManager":
+        """Budgets one move out of a game clock.
+        remaining: seconds left on our clock.
+        increment: seconds added to our clock after each move.
+        moves_to_go: moves until the next time control, if there is one."""
+        if moves_to_go is None:
+            moves_to_go = MOVES_TO_GO
+        usable = max(remaining - CLOCK_SAFETY, 0.0)
+        budget = usable / moves_to_go + increment
+        hard_limit = min(budget * HARD_LIMIT_FACTOR, usable / 2 + increment, usable)
+        return cls(min(budget, hard_limit), hard_limit)
+
+    @classmethod
+    def from_nodes(cls, max_nodes: int) -> "TimeManager":
+        """Stops after max_nodes nodes, however long they take. Deterministic: the clock is ignored."""
+        return cls(np.inf, max_nodes=max_nodes)
+
+    def start(self) -> None:
+        """Starts the clock for a new search"""
+        self.t0 = time.time()
+        self.deadline = self.t0 + self.hard_limit
+        self.aborted = False
+        self.abortable = True  # iterative_deepening turns this off until it has a move to fall back on
+        self.nodes = 0  # visited by the search since start
+        self.ebf = None  # last effective branching factor seen by should_start
+
+    @property
+    def reproducible(self) -> bool:
+        """Whether the search must give the same result every time, i.e. it's stopped by a node budget"""
+        return self.max_nodes < np.inf
+
+    def elapsed(self) -> float:
+        return time.time() - self.t0
+
+    def out_of_time(self) -> bool:
+        """Called by the search at every node, before visiting it. Once the hard limit or the node
+        budget is passed, it stays aborted, and the node (and every one after it) isn't counted."""
+        if self.aborted:
+            return True
+        if self.abortable and (self.nodes >= self.max_nodes or time.time() > self.deadline):
+            self.aborted = True
+            return True
+        self.nodes += 1
+        return False
+
+    def predict(self, depth_stats: List[Dict[str, float]]) -> float:
+        """Seconds the next iteration is expected to take, given the stats of the completed ones
+        (see search.DEPTH_STATS). Scores and node counts swing between odd and even depths, so with
+        enough iterations the EBF is averaged over the last two."""
+        if len(depth_stats) < 2 or depth_stats[-2]["nodes"] == 0:
+            return 0.0
+        if len(depth_stats) >= 3 and depth_stats[-3]["nodes"] > 0:
+            self.ebf = (depth_stats[-1]["nodes"] / depth_stats[-3]["nodes"]) ** 0.5
+        else:
+            self.ebf = depth_stats[-1]["nodes"] / depth_stats[-2]["nodes"]
+        return depth_stats[-1]["seconds"] * self.ebf
+
+    def should_start(self, depth_stats: List[Dict[str, float]]) -> bool:
+        """Whether to start another iteration: only if it's predicted to finish within the budget.
+        With a node budget the iteration is started as long as there are nodes left, as predicting
+        from the clock would make the result depend on the machine's speed."""
+        if self.max_nodes < np.inf:
+            return self.nodes < self.max_nodes
+        return self.elapsed() + self.predict(depth_stats) <= self.budget
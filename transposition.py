@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""Fixed size transposition table for the search.
+
+Entries live in preallocated arrays, so memory stays at the configured budget no matter
+how many positions get searched. The table is split into buckets of two slots:
+    slot 0: depth-preferred. Only replaced by a search at least as deep, or from an older search.
+    slot 1: always replaced. Catches everything slot 0 turns away.
+
+SharedTranspositionTable keeps the same buckets in shared memory, so the processes of a
+parallel search all read and write one table (see parallel_search.py).
+"""
+
+from array import array
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Optional, Tuple
+
+# bound types: what a stored score says about the true score of the position
+EXACT = 0  # the true score
+LOWER = 1  # true score >= stored score (the search failed high / cut off)
+UPPER = 2  # true score <= stored score (the search failed low)
+
+BUCKET_SIZE = 2
+# bytes per slot: key (8) + score (4) + depth, bound and age (1 each) + reference to the move (8)
+ENTRY_BYTES = 8 + 4 + 1 + 1 + 1 + 8
+EMPTY = -1  # depth of a slot that was never written
+
+
+class TranspositionTable(object):
+    """Maps a position's hash to (depth, bound, score, best move) from a previous search of it.
+
+    size_mb: memory budget for the table.
+    """
+
+    def __init__(self, size_mb: float = 16):
+        self.size_mb = size_mb
+        self.num_buckets = max(1, int(size_mb * 2 ** 20) // (ENTRY_BYTES * BUCKET_SIZE))
+        size = self.num_buckets * BUCKET_SIZE
+        self.keys = array("Q", bytes(8 * size))
+        self.scores = array("i", bytes(4 * size))
+        self.depths = array("b", [EMPTY]) * size
+        self.bounds = array("b", bytes(size))
+        self.ages = array("B", bytes(size))
+        self.moves = [None] * size
+        self.age = 0  # bumped once per search, so entries from older searches get replaced first
+
+        # statistics
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0  # stores that evicted a different position
+        self.filled = 0  # slots that have ever been written
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def clear(self) -> None:
+        """Empties the table and resets the statistics"""
+        self.__init__(self.size_mb)
+
+    def new_search(self) -> None:
+        """Marks the start of a new search (i.e. a new move in the game), aging every existing entry"""
+        self.age = (self.age + 1) % 256
+
+    def probe(self, key: int) -> Optional[Tuple[int, int, int, object]]:
+        """Looks up a position's hash.
+        Returns (depth, bound, score, move) or None if the position isn't stored."""
+        self.probes += 1
+        slot = (key % self.num_buckets) * BUCKET_SIZE
+        for i in range(slot, slot + BUCKET_SIZE):
+            if self.keys[i] == key and self.depths[i] != EMPTY:
+                self.hits += 1
+                return self.depths[i], self.bounds[i], self.scores[i], self.moves[i]
+        return None
+
+    def store(self, key: int, depth: int, bound: int, score: int, move: object) -> None:
+        """Saves the result of searching a position to depth"""
+        slot = (key % self.num_buckets) * BUCKET_SIZE
+        if not (self.depths[slot] == EMPTY
+                or self.keys[slot] == key
+                or self.ages[slot] != self.age
+                or depth >= self.depths[slot]):
+            slot += 1  # depth-preferred slot keeps its deeper entry, use the always-replace slot
+
+        if self.depths[slot] == EMPTY:
+            self.filled += 1
+        elif self.keys[slot] != key:
+            self.collisions += 1
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.bounds[slot] = bound
+        self.scores[slot] = score
+        self.ages[slot] = self.age
+        self.moves[slot] = move
+
+    def stats(self) -> Dict[str, float]:
+        """Hit, collision and fill statistics since the table was created or cleared"""
+        return {
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.probes if self.probes else 0.0,
+            "collisions": self.collisions,
+            "fill": self.filled / len(self),
+        }
+
+
+# A shared slot is two 64 bit words: the key xor the data, then the data. The data packs:
+SHARED_ENTRY_BYTES = 16
+SCORE_BITS, MOVE_BITS, DEPTH_BITS, BOUND_BITS, AGE_BITS = 32, 16, 8, 2, 6
+MOVE_SHIFT = SCORE_BITS
+DEPTH_SHIFT = MOVE_SHIFT + MOVE_BITS
+BOUND_SHIFT = DEPTH_SHIFT + DEPTH_BITS
+AGE_SHIFT = BOUND_SHIFT + BOUND_BITS
+SCORE_OFFSET = 1 << (SCORE_BITS - 1)  # scores are stored unsigned
+
+
+class SharedTranspositionTable(object):
+    """TranspositionTable in a multiprocessing.shared_memory block, shared by several processes.
+
+    There's no lock: two processes can write the same slot at once, and a reader can see one's key
+    with the other's data. So each slot stores key ^ data next to data, and a probe only trusts the
+    slot if xoring them back gives its key. A torn entry then just reads as a miss.
+    Moves are packed into the data (16 bits) with encode and unpacked with decode, which is called
+    as decode(code) in the probed position: e.g. functools.partial(decode_move, board=board) for the
+    board being searched. The statistics are per process.
+
+    size_mb: memory budget for the table.
+    name: of an existing table's shared memory to attach to, rather than creating a new one.
+    """
+
+    def __init__(self, size_mb: float = 16, name: Optional[str] = None,
+                 encode: Callable[[object], int] = lambda move: move,
+                 decode: Callable[[int], object] = lambda code: code):
+        self.size_mb = size_mb
+        self.num_buckets = max(1, int(size_mb * 2 ** 20) // (SHARED_ENTRY_BYTES * BUCKET_SIZE))
+        size = self.num_buckets * BUCKET_SIZE
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=SHARED_ENTRY_BYTES * size)
+            self.shm.buf[:] = bytes(SHARED_ENTRY_BYTES * size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.words = self.shm.buf.cast("Q")  # key ^ data, data for each slot
+        self.encode, self.decode = encode, decode
+        self.age = 0
+
+        # statistics
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0
+        self.filled = 0
+
+    def __len__(self) -> int:
+        return len(self.words) // 2
+
+    def close(self) -> None:
+        """Detaches from the shared memory, and frees it if this is the table that created it"""
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def clear(self) -> None:
+        """Empties the table (for every process) and resets this process's statistics"""
+        self.shm.buf[:] = bytes(len(self.shm.buf))
+        self.probes = self.hits = self.collisions = self.filled = 0
+
+    def new_search(self) -> None:
+        self.age = (self.age + 1) % (1 << AGE_BITS)
+
+    def _read(self, i: int) -> Tuple[int, int]:
+        """(key, data) of slot i, data is 0 if the slot is empty"""
+        data = self.words[2 * i + 1]
+        return self.words[2 * i] ^ data, data
+
+    def probe(self, key: int) -> Optional[Tuple[int, int, int, object]]:
+        """Looks up a position's hash.
+        Returns (depth, bound, score, move) or None if the position isn't stored."""
+        self.probes += 1
+        slot = (key % self.num_buckets) * BUCKET_SIZE
+        for i in range(slot, slot + BUCKET_SIZE):
+            slot_key, data = self._read(i)
+            if slot_key == key and data:
+                self.hits += 1
+                move = (data >> MOVE_SHIFT) & ((1 << MOVE_BITS) - 1)
+                return (((data >> DEPTH_SHIFT) & ((1 << DEPTH_BITS) - 1)) - 1,
+                        (data >> BOUND_SHIFT) & ((1 << BOUND_BITS) - 1),
+                        (data & ((1 << SCORE_BITS) - 1)) - SCORE_OFFSET,
+                        None if move == 0 else self.decode(move - 1))
+        return None
+
+    def store(self, key: int, depth: int, bound: int, score: int, move: object) -> None:
+        """Saves the result of searching a position to depth"""
+        slot = (key % self.num_buckets) * BUCKET_SIZE
+        slot_key, data = self._read(slot)
+        if not (data == 0
+                or slot_key == key
+                or data >> AGE_SHIFT != self.age
+                or depth >= ((data >> DEPTH_SHIFT) & ((1 << DEPTH_BITS) - 1)) - 1):
+            slot += 1
+            slot_key, data = self._read(slot)
+
+        if data == 0:
+            self.filled += 1
+        elif slot_key != key:
+            self.collisions += 1
+        data = (int(score) + SCORE_OFFSET
+                | (0 if move is None else self.encode(move) + 1) << MOVE_SHIFT
+                | (depth + 1) << DEPTH_SHIFT
+                | bound << BOUND_SHIFT
+                | self.age << AGE_SHIFT)
+        self.words[2 * slot] = key ^ data
+        self.words[2 * slot + 1] = data
+
+    def stats(self) -> Dict[str, float]:
+        """Hit, collision and fill statistics of this process since the table was created or cleared"""
+        return TranspositionTable.stats(self)